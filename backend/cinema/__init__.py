@@ -1 +1,4 @@
-# Инициализация Django приложения
\ No newline at end of file
+# Инициализация Django приложения
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
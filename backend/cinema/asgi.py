@@ -9,8 +9,19 @@ https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
+from django.core.exceptions import ImproperlyConfigured
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
+# Под ASGI частые запросы на чтение обслуживают асинхронные представления
+# (movies.async_views); ASYNC_VIEWS=False возвращает синхронные
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+# Синхронный код каждого запроса выполняется в отдельном потоке, поэтому
+# постоянное соединение не переиспользовалось бы, а оставалось открытым
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
-application = get_asgi_application()
\ No newline at end of file
+application = get_asgi_application()
+
+if any(database.get('CONN_MAX_AGE') != 0 for database in settings.DATABASES.values()):
+    raise ImproperlyConfigured('Под ASGI постоянные соединения не поддерживаются: DB_CONN_MAX_AGE=0')
\ No newline at end of file
@@ -0,0 +1,16 @@
+"""
+Приложение Celery. Задачи — в tasks.py приложений, очереди и дедупликация
+отложенных пересчетов — в cinema.deferred.
+
+celery -A cinema worker -Q realtime
+celery -A cinema worker -Q bulk --concurrency 1
+"""
+import os
+
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
+
+app = Celery('cinema')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
@@ -0,0 +1,26 @@
+"""
+PostgreSQL с учетом соединений: время установки каждого нового соединения
+и неудачные проверки переиспользуемых попадают в cinema.db_metrics.
+"""
+import time
+
+from django.db.backends.postgresql import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # cinema.db_metrics импортируется при первом соединении: движок
+    # загружается раньше приложений, а метрики зависят от DRF
+
+    def connect(self):
+        from cinema import db_metrics
+        started = time.perf_counter()
+        super().connect()
+        db_metrics.record_connect(time.perf_counter() - started)
+
+    def close_if_health_check_failed(self):
+        had_connection = self.connection is not None
+        super().close_if_health_check_failed()
+        if had_connection and self.connection is None:
+            # Соединение оборвалось между запросами (перезапуск БД или пулера)
+            from cinema import db_metrics
+            db_metrics.record_health_check_failure()
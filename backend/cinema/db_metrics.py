@@ -0,0 +1,186 @@
+"""
+Соединения с БД: метрики (раздел database в /api/metrics/) и проверки
+настроек при запуске.
+
+Статистика установки соединений общая для всех процессов и хранится в
+Redis: число новых соединений, суммарное время и распределение по
+интервалам, число соединений, не прошедших проверку перед повторным
+использованием. При постоянных соединениях (CONN_MAX_AGE) новые
+соединения редки, и их поток показывает, работает ли переиспользование.
+
+Заполненность считается при запросе метрик: соединения сервера PostgreSQL
+относительно max_connections, а при работе через pgbouncer — его пул для
+нашей базы (SHOW DATABASES/SHOW POOLS в консоли pgbouncer; пользователь БД
+должен быть в stats_users).
+"""
+import logging
+
+import psycopg2
+import redis
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError, connection
+
+from cinema import metrics
+from cinema.redis_client import get_redis
+
+
+logger = logging.getLogger('cinema')
+
+STATS_KEY = 'db:connections:stats'
+# Границы интервалов времени установки соединения (мс)
+ACQUIRE_BUCKETS_MS = (5, 20, 100, 500)
+PGBOUNCER_ADMIN_DB = 'pgbouncer'
+
+
+def _acquire_bucket(milliseconds):
+    for bound in ACQUIRE_BUCKETS_MS:
+        if milliseconds <= bound:
+            return f'acquire_le_{bound}ms'
+    return f'acquire_gt_{ACQUIRE_BUCKETS_MS[-1]}ms'
+
+
+def record_connect(seconds):
+    """Учитывает новое соединение, установленное за seconds"""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(STATS_KEY, 'connects', 1)
+        pipe.hincrbyfloat(STATS_KEY, 'acquire_seconds_total', seconds)
+        pipe.hincrby(STATS_KEY, _acquire_bucket(seconds * 1000), 1)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Не удалось учесть соединение с БД: %s', e)
+
+
+def record_health_check_failure():
+    try:
+        get_redis().hincrby(STATS_KEY, 'health_check_failures', 1)
+    except redis.RedisError as e:
+        logger.warning('Не удалось учесть проверку соединения с БД: %s', e)
+
+
+def pgbouncer_console(*commands):
+    """Результаты команд консоли pgbouncer: [[{колонка: значение}, ...], ...]"""
+    params = connection.get_connection_params()
+    params['dbname'] = PGBOUNCER_ADMIN_DB
+    console = psycopg2.connect(**params)
+    try:
+        # Консоль не поддерживает транзакции
+        console.autocommit = True
+        results = []
+        with console.cursor() as cursor:
+            for command in commands:
+                cursor.execute(command)
+                columns = [column.name for column in cursor.description]
+                results.append([dict(zip(columns, row)) for row in cursor.fetchall()])
+        return results
+    finally:
+        console.close()
+
+
+def server_connections():
+    """Соединения клиентов PostgreSQL относительно max_connections"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT current_setting('max_connections')::int,
+                   count(*),
+                   count(*) FILTER (WHERE state = 'active'),
+                   count(*) FILTER (WHERE state = 'idle in transaction')
+            FROM pg_stat_activity WHERE backend_type = 'client backend'
+            """
+        )
+        max_connections, used, active, idle_in_transaction = cursor.fetchone()
+    return {
+        'max_connections': max_connections,
+        'connections': used,
+        'active': active,
+        'idle_in_transaction': idle_in_transaction,
+        'saturation': used / max_connections,
+    }
+
+
+def pgbouncer_pool():
+    """Пул pgbouncer для нашей базы: серверные соединения, ожидающие клиенты"""
+    name = connection.settings_dict['NAME']
+    databases, pools = pgbouncer_console('SHOW DATABASES', 'SHOW POOLS')
+    database = next(row for row in databases if row['name'] == name)
+    pool_rows = [row for row in pools if row['database'] == name]
+
+    def total(column):
+        return sum(row[column] for row in pool_rows)
+
+    return {
+        'pool_size': database['pool_size'],
+        'server_active': total('sv_active'),
+        'server_idle': total('sv_idle'),
+        'clients_active': total('cl_active'),
+        'clients_waiting': total('cl_waiting'),
+        'max_wait_seconds': max((row['maxwait'] + row.get('maxwait_us', 0) / 1e6 for row in pool_rows), default=0),
+        'saturation': total('sv_active') / database['pool_size'] if database['pool_size'] else 0,
+    }
+
+
+@metrics.register('database')
+def database_metrics():
+    stats = {key.decode(): float(value) for key, value in get_redis().hgetall(STATS_KEY).items()}
+    connects = stats.get('connects', 0)
+    result = {
+        'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+        'pooler': settings.DB_POOLER or None,
+        'acquire_avg_ms': stats.get('acquire_seconds_total', 0) / connects * 1000 if connects else 0,
+        **stats,
+        'server': server_connections(),
+    }
+    if settings.DB_POOLER == 'pgbouncer':
+        result['pgbouncer'] = pgbouncer_pool()
+    return result
+
+
+@checks.register(checks.Tags.database)
+def check_database(app_configs=None, databases=None, **kwargs):
+    """
+    Соединение с БД и совместимость с пулером. Выполняется при запуске
+    gunicorn (gunicorn.conf.py) и командой check --database default.
+    """
+    if not databases or 'default' not in databases:
+        return []
+    try:
+        connection.ensure_connection()
+    except DatabaseError as e:
+        return [checks.Error(f'Нет соединения с БД: {e}', id='cinema.E001')]
+
+    errors = []
+    if settings.DB_POOLER == 'pgbouncer':
+        with connection.cursor() as cursor:
+            # Значение по умолчанию, а не текущее: Django уже выставил свое при подключении
+            cursor.execute("SELECT reset_val FROM pg_settings WHERE name = 'TimeZone'")
+            server_timezone = cursor.fetchone()[0]
+        if server_timezone != connection.timezone_name:
+            # Иначе Django выполняет SET TIME ZONE при подключении, а в режиме
+            # transaction настройка сеанса достается случайному серверному соединению
+            errors.append(checks.Error(
+                f'Часовой пояс PostgreSQL {server_timezone}, а соединениям Django нужен '
+                f'{connection.timezone_name}',
+                hint=f"Задайте timezone = '{connection.timezone_name}' в postgresql.conf "
+                     "или для роли (ALTER ROLE ... SET timezone)",
+                id='cinema.E002',
+            ))
+        try:
+            (config,) = pgbouncer_console('SHOW CONFIG')
+        except psycopg2.Error as e:
+            errors.append(checks.Warning(
+                f'Консоль pgbouncer недоступна, режим пула не проверен: {str(e).strip()}',
+                hint='Добавьте пользователя БД в stats_users pgbouncer',
+                id='cinema.W001',
+            ))
+        else:
+            pool_mode = next((row['value'] for row in config if row['key'] == 'pool_mode'), None)
+            if pool_mode != 'transaction':
+                errors.append(checks.Warning(
+                    f'pgbouncer работает в режиме {pool_mode}: при постоянных соединениях '
+                    'бэкенда серверные соединения не делятся между воркерами',
+                    hint='pool_mode = transaction',
+                    id='cinema.W002',
+                ))
+    return errors
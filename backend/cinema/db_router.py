@@ -0,0 +1,306 @@
+"""
+Чтение каталога с реплик PostgreSQL (DB_REPLICAS).
+
+На реплику идут только запросы на чтение моделей каталога (CATALOG_MODELS)
+во время GET/HEAD-запросов пользователей мини-приложения. Все остальное
+читается с основной БД: данные пользователей (избранное, история, оценки,
+прогресс), запросы после записи, фоновые команды и админка.
+
+Отставание каждой реплики процесс проверяет не чаще
+REPLICA_LAG_CHECK_INTERVAL секунд. Недоступная реплика или реплика с
+отставанием больше REPLICA_MAX_LAG не используется до следующей проверки;
+если подходящих реплик нет, каталог читается с основной БД.
+
+Пользователь, который что-то изменил (успешный POST/PUT/PATCH/DELETE),
+REPLICA_PIN_SECONDS секунд читает только с основной БД, поэтому не увидит
+каталог без своего отзыва или оценки. Отметка хранится в Redis и
+проверяется при первом чтении с реплики в запросе: ответы из кэша ее не
+запрашивают. Данные для долгоживущих кэшей (полки, манифесты потоков)
+собираются с основной БД, см. primary_reads().
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from urllib.parse import parse_qs
+
+import redis
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import checks
+from django.db import DatabaseError, connections
+
+from cinema import metrics
+from cinema.redis_client import get_async_redis, get_redis
+
+
+logger = logging.getLogger('cinema')
+
+PIN_KEY = 'db:primary-pin:{telegram_id}'
+# Общие для всех пользователей данные, которым допустимо отставание реплики
+CATALOG_MODELS = {
+    'movies.genre',
+    'movies.movie',
+    'movies.moviestream',
+    'movies.moviecollection',
+    'movies.collectionmovie',
+    'movies.similarmovie',
+    'movies.suggestterm',
+    'movies.review',
+    'movies.moviereviewstats',
+}
+SAFE_METHODS = ('GET', 'HEAD')
+
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+class RequestReads:
+    """Чтение каталога в текущем запросе: пользователь и выбранная БД"""
+
+    def __init__(self, telegram_id):
+        self.telegram_id = telegram_id
+        self.alias = None
+
+
+_request_reads = contextvars.ContextVar('request_reads', default=None)
+
+
+def measure_lag(alias):
+    """Отставание реплики в секундах (None — неизвестно); DatabaseError, если недоступна"""
+    with connections[alias].cursor() as cursor:
+        cursor.execute(LAG_SQL)
+        lag = cursor.fetchone()[0]
+    return None if lag is None else max(float(lag), 0.0)
+
+
+class LagMonitor:
+    """Последнее известное процессу отставание реплик"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # alias -> (время проверки по time.monotonic(), отставание или None)
+        self._checked = {}
+
+    def lag(self, alias):
+        now = time.monotonic()
+        with self._lock:
+            checked_at, lag = self._checked.get(alias, (None, None))
+            if checked_at is not None and now - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+                return lag
+            # Проверяет один поток, остальные до ее конца видят прежнее значение
+            self._checked[alias] = (now, lag)
+
+        try:
+            lag = measure_lag(alias)
+        except DatabaseError as e:
+            logger.warning('Реплика %s недоступна: %s', alias, e)
+            connections[alias].close()
+            lag = None
+        with self._lock:
+            self._checked[alias] = (time.monotonic(), lag)
+        return lag
+
+    def is_usable(self, alias):
+        lag = self.lag(alias)
+        return lag is not None and lag <= settings.REPLICA_MAX_LAG
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            return {alias: (now - checked_at, lag) for alias, (checked_at, lag) in self._checked.items()}
+
+
+lag_monitor = LagMonitor()
+
+
+def pin_to_primary(telegram_id):
+    try:
+        get_redis().set(PIN_KEY.format(telegram_id=telegram_id), 1, ex=settings.REPLICA_PIN_SECONDS)
+    except redis.RedisError as e:
+        logger.warning('Не удалось закрепить пользователя %s за основной БД: %s', telegram_id, e)
+
+
+async def apin_to_primary(telegram_id):
+    try:
+        await get_async_redis().set(PIN_KEY.format(telegram_id=telegram_id), 1, ex=settings.REPLICA_PIN_SECONDS)
+    except redis.RedisError as e:
+        logger.warning('Не удалось закрепить пользователя %s за основной БД: %s', telegram_id, e)
+
+
+def is_pinned(telegram_id):
+    try:
+        return bool(get_redis().exists(PIN_KEY.format(telegram_id=telegram_id)))
+    except redis.RedisError as e:
+        # Без Redis неизвестно, были ли записи: читаем с основной БД
+        logger.warning('Не удалось проверить закрепление за основной БД: %s', e)
+        return True
+
+
+def choose_alias(telegram_id):
+    """БД для чтения каталога в запросе пользователя"""
+    usable = [alias for alias in settings.REPLICA_DATABASES if lag_monitor.is_usable(alias)]
+    if not usable or is_pinned(telegram_id):
+        return 'default'
+    return random.choice(usable)
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """
+    Чтение внутри блока — с основной БД. Для данных, которые кэшируются
+    надолго: иначе сразу после сброса кэша в него попала бы копия с реплики,
+    еще не получившей изменение.
+    """
+    token = _request_reads.set(None)
+    try:
+        yield
+    finally:
+        _request_reads.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        # Явно 'default', а не None: иначе связанные объекты фильма с
+        # реплики (избранное, оценки) читались бы с той же реплики
+        reads = _request_reads.get()
+        if reads is None or model._meta.label_lower not in CATALOG_MODELS:
+            return 'default'
+        if reads.alias is None:
+            reads.alias = choose_alias(reads.telegram_id)
+        return reads.alias
+
+    def db_for_write(self, model, **hints):
+        reads = _request_reads.get()
+        if reads is not None:
+            # После записи запрос дочитывает с основной БД
+            reads.alias = 'default'
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+def init_data_telegram_id(init_data):
+    """
+    Telegram id пользователя из initData без проверки подписи. Только для выбора БД:
+    подделка может лишь перевести свои запросы на основную БД.
+    """
+    try:
+        return int(json.loads(parse_qs(init_data)['user'][0])['id'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        return None
+
+
+class ReplicaReadsMiddleware:
+    """
+    Разрешает чтение каталога с реплик GET/HEAD-запросам мини-приложения и
+    закрепляет за основной БД пользователя после успешной записи
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.begin(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                _request_reads.reset(token)
+        telegram_id = self.writer_id(request, response)
+        if telegram_id is not None:
+            pin_to_primary(telegram_id)
+        return response
+
+    async def __acall__(self, request):
+        token = self.begin(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                _request_reads.reset(token)
+        telegram_id = self.writer_id(request, response)
+        if telegram_id is not None:
+            await apin_to_primary(telegram_id)
+        return response
+
+    def begin(self, request):
+        if request.method not in SAFE_METHODS:
+            return None
+        init_data = request.META.get('HTTP_X_TELEGRAM_INIT_DATA')
+        telegram_id = init_data_telegram_id(init_data) if init_data else None
+        if telegram_id is None:
+            return None
+        return _request_reads.set(RequestReads(telegram_id))
+
+    def writer_id(self, request, response):
+        """Пользователь, чьи изменения реплики могли еще не получить"""
+        if request.method in SAFE_METHODS or response.status_code >= 400:
+            return None
+        # DRF и async_views записывают пользователя Telegram в request.user
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            return None
+        return getattr(user, 'telegram_id', None)
+
+
+@metrics.register('replicas')
+def replica_metrics():
+    checked = lag_monitor.snapshot()
+    replicas = {}
+    for alias in settings.REPLICA_DATABASES:
+        age, lag = checked.get(alias, (None, None))
+        replicas[alias] = {
+            'host': settings.DATABASES[alias]['HOST'],
+            'lag_seconds': lag,
+            'usable': lag is not None and lag <= settings.REPLICA_MAX_LAG,
+            'checked_seconds_ago': age,
+        }
+    return {
+        'max_lag_seconds': settings.REPLICA_MAX_LAG,
+        'pin_seconds': settings.REPLICA_PIN_SECONDS,
+        'replicas': replicas,
+    }
+
+
+@checks.register(checks.Tags.database)
+def check_replicas(app_configs=None, databases=None, **kwargs):
+    """Доступность и отставание реплик (check --database replica1 ...)"""
+    warnings = []
+    for alias in settings.REPLICA_DATABASES:
+        if not databases or alias not in databases:
+            continue
+        try:
+            lag = measure_lag(alias)
+        except DatabaseError as e:
+            warnings.append(checks.Warning(
+                f'Реплика {alias} недоступна, каталог будет читаться с основной БД: {str(e).strip()}',
+                id='cinema.W003',
+            ))
+            continue
+        if lag is None or lag > settings.REPLICA_MAX_LAG:
+            warnings.append(checks.Warning(
+                f'Реплика {alias} отстает ({lag} с), пока отставание больше '
+                f'{settings.REPLICA_MAX_LAG} с, каталог читается с основной БД',
+                id='cinema.W004',
+            ))
+    return warnings
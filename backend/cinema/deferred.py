@@ -0,0 +1,151 @@
+"""
+Отложенные пересчеты после записей (задачи Celery с дедупликацией).
+
+Сигнал не выполняет пересчет сам, а вызывает defer(task, *ids): после
+коммита транзакции id попадают в множество Redis, и задача ставится в
+очередь, только если ее там еще нет (флаг с SET NX). Задача в начале
+снимает флаг и забирает все накопленные id, поэтому сотня сохранений
+одного фильма при импорте дает один пересчет, а запись во время
+выполнения — новый запуск. Обработчики идемпотентны: пересчитывают
+состояние по БД, а не применяют дельты, и повтор после сбоя безопасен.
+
+Без Redis или брокера задачи realtime выполняются сразу в процессе, как
+до появления очереди. Задачи bulk в запросе не выполняются: без брокера
+накопленные id остаются в множестве и уйдут со следующим запуском.
+"""
+import functools
+import logging
+
+import redis
+from celery import shared_task
+from django.conf import settings
+from django.db import transaction
+from kombu.exceptions import ChannelError, OperationalError
+
+from cinema import metrics
+from cinema.celery import app
+from cinema.redis_client import get_redis
+
+
+logger = logging.getLogger('cinema')
+
+# Сброс кэшей и прочее, что пользователь замечает через секунды
+REALTIME_QUEUE = 'realtime'
+# Тяжелые пересчеты, которым допустимо ждать минуты
+BULK_QUEUE = 'bulk'
+QUEUES = (REALTIME_QUEUE, BULK_QUEUE)
+
+PENDING_KEY = 'deferred:pending:{name}'
+SCHEDULED_KEY = 'deferred:scheduled:{name}'
+# Флаг живет дольше отсрочки: если сообщение потеряется, задача снова
+# встанет в очередь при следующей записи
+SCHEDULED_SLACK = 15 * 60
+RETRY_DELAY = 30
+
+_tasks = {}
+
+
+def deferred_task(queue, countdown=0):
+    """
+    Задача пересчета для defer(). Обработчик получает список накопленных id
+    (строки); пустой список — задача без аргументов (пересчет целиком).
+    countdown — отсрочка запуска (сек), за нее копятся id из новых записей.
+    """
+    def decorator(handler):
+        name = f'{handler.__module__}.{handler.__name__}'
+
+        @shared_task(name=name, bind=True, queue=queue, max_retries=5)
+        @functools.wraps(handler)
+        def task(self):
+            items = _drain(name)
+            try:
+                handler(items)
+            except Exception as e:
+                # Вернем id в пачку, повтор заберет их вместе с новыми
+                if items:
+                    get_redis().sadd(PENDING_KEY.format(name=name), *items)
+                raise self.retry(exc=e, countdown=RETRY_DELAY)
+            return len(items)
+
+        task.handler = handler
+        task.countdown = countdown
+        # Тяжелый пересчет в запросе пользователя хуже, чем запуск позже
+        task.runs_inline = queue == REALTIME_QUEUE
+        _tasks[name] = task
+        return task
+    return decorator
+
+
+def _drain(name):
+    pipe = get_redis().pipeline()
+    pipe.delete(SCHEDULED_KEY.format(name=name))
+    pipe.smembers(PENDING_KEY.format(name=name))
+    pipe.delete(PENDING_KEY.format(name=name))
+    _, items, _ = pipe.execute()
+    return sorted(item.decode() for item in items)
+
+
+def defer(task, *items):
+    """Ставит пересчет для items в очередь после коммита текущей транзакции"""
+    transaction.on_commit(lambda: _schedule(task, items))
+
+
+def _schedule(task, items):
+    try:
+        pipe = get_redis().pipeline()
+        if items:
+            pipe.sadd(PENDING_KEY.format(name=task.name), *items)
+        pipe.set(SCHEDULED_KEY.format(name=task.name), 1, nx=True, ex=task.countdown + SCHEDULED_SLACK)
+        *_, scheduled = pipe.execute()
+    except redis.RedisError as e:
+        if not task.runs_inline:
+            logger.warning('Очередь пересчетов недоступна, %s отложен до следующего запуска: %s', task.name, e)
+            return
+        logger.warning('Очередь пересчетов недоступна, %s выполняется сразу: %s', task.name, e)
+        task.handler([str(item) for item in items])
+        return
+    if not scheduled:
+        # Задача уже в очереди и заберет эти id
+        return
+    try:
+        task.apply_async(countdown=task.countdown)
+    except OperationalError as e:
+        if task.runs_inline:
+            logger.warning('Брокер Celery недоступен, %s выполняется сразу: %s', task.name, e)
+            task.apply()
+            return
+        logger.warning('Брокер Celery недоступен, %s отложен до следующего запуска: %s', task.name, e)
+        # id остаются в множестве; без флага следующая запись снова поставит задачу
+        try:
+            get_redis().delete(SCHEDULED_KEY.format(name=task.name))
+        except redis.RedisError:
+            pass
+
+
+@metrics.register('tasks')
+def task_metrics():
+    """Глубина очередей Celery и накопленные, но еще не обработанные пересчеты"""
+    queues = {}
+    with app.connection_for_read() as connection:
+        for queue in QUEUES:
+            # passive: только узнать число сообщений, не создавая очередь.
+            # Ошибка закрывает канал, поэтому у каждой очереди свой
+            channel = connection.channel()
+            try:
+                queues[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+            except ChannelError:
+                # Очереди нет; в Redis так выглядит и пустая очередь
+                queues[queue] = 0
+            finally:
+                channel.close()
+
+    pipe = get_redis().pipeline()
+    for name in _tasks:
+        pipe.scard(PENDING_KEY.format(name=name))
+        pipe.exists(SCHEDULED_KEY.format(name=name))
+    counts = iter(pipe.execute())
+    pending = {
+        name: {'pending_items': next(counts), 'scheduled': bool(next(counts))}
+        for name in _tasks
+    }
+    return {'queues': queues, 'deferred': pending, 'eager': settings.CELERY_TASK_ALWAYS_EAGER}
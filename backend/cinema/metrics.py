@@ -0,0 +1,36 @@
+import logging
+
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+
+
+logger = logging.getLogger('cinema')
+
+_collectors = {}
+
+
+def register(name):
+    """Регистрирует функцию, возвращающую словарь метрик подсистемы"""
+    def decorator(func):
+        _collectors[name] = func
+        return func
+    return decorator
+
+
+def collect():
+    metrics = {}
+    for name, func in _collectors.items():
+        try:
+            metrics[name] = func()
+        except Exception as e:
+            logger.warning('Не удалось собрать метрики %s: %s', name, e)
+            metrics[name] = {'error': str(e)}
+    return metrics
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def metrics_view(request):
+    """Внутренние метрики бэкенда (только для администраторов)"""
+    return Response(collect())
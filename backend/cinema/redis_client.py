@@ -0,0 +1,28 @@
+import asyncio
+import weakref
+
+import redis
+import redis.asyncio
+from django.conf import settings
+
+
+_client = None
+# Соединения redis.asyncio привязаны к циклу событий, поэтому клиент свой у каждого цикла
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis():
+    """Общий для процесса клиент Redis (REDIS_URL)"""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def get_async_redis():
+    """Асинхронный клиент Redis для текущего цикла событий (асинхронные представления)"""
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+    return client
@@ -1,5 +1,6 @@
 import os
 from decouple import config
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -20,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'rest_framework',
@@ -64,25 +66,124 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'cinema.wsgi.application'
+ASGI_APPLICATION = 'cinema.asgi.application'
+
+# Асинхронные версии частых запросов на чтение (movies.async_views).
+# При запуске через cinema.asgi (uvicorn-воркеры) включаются по умолчанию
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+# Сколько асинхронных запросов процесса одновременно работают с БД: у
+# каждого свой поток и свое соединение (воркеров x значение <= max_connections)
+ASYNC_DB_CONCURRENCY = config('ASYNC_DB_CONCURRENCY', default=10, cast=int)
 
 # Database
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        # PostgreSQL с метриками соединений (cinema.db_metrics)
+        'ENGINE': 'cinema.db_backend',
         'NAME': config('DB_NAME', default='telegram_cinema'),
         'USER': config('DB_USER', default='cinema_user'),
         'PASSWORD': config('DB_PASSWORD', default='cinema_pass'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='5432'),
+        # Соединение воркера живет между запросами не дольше DB_CONN_MAX_AGE
+        # секунд (0 — новое на каждый запрос); перед повторным использованием
+        # оно проверяется, и оборванное заменяется новым
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Пулер соединений между бэкендом и PostgreSQL: пусто — напрямую,
+# pgbouncer — pgbouncer в режиме transaction (DB_HOST/DB_PORT указывают на него)
+DB_POOLER = config('DB_POOLER', default='')
+if DB_POOLER == 'pgbouncer':
+    # Серверные курсоры (QuerySet.iterator()) не переживают смену серверного
+    # соединения между транзакциями
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+elif DB_POOLER:
+    raise ImproperlyConfigured(f'DB_POOLER: неизвестный пулер "{DB_POOLER}" (допустимо: pgbouncer)')
+if DATABASES['default']['CONN_MAX_AGE'] < 0:
+    raise ImproperlyConfigured('DB_CONN_MAX_AGE не может быть отрицательным')
+
+# Реплики для чтения каталога (cinema.db_router): адреса host[:port] через
+# запятую, база и пользователь те же, что у основной
+REPLICA_DATABASES = []
+for index, address in enumerate(filter(None, config('DB_REPLICAS', default='', cast=lambda v: [s.strip() for s in v.split(',')]))):
+    alias = f'replica{index + 1}'
+    host, _, port = address.partition(':')
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        # Недоступная реплика не должна надолго задерживать запрос
+        'OPTIONS': {'connect_timeout': config('DB_REPLICA_CONNECT_TIMEOUT', default=2, cast=int)},
+        'TEST': {'MIRROR': 'default'},
+    }
+    REPLICA_DATABASES.append(alias)
+# Реплика с большим отставанием (сек) не используется
+REPLICA_MAX_LAG = config('REPLICA_MAX_LAG', default=5, cast=float)
+REPLICA_LAG_CHECK_INTERVAL = config('REPLICA_LAG_CHECK_INTERVAL', default=5, cast=float)
+# Сколько секунд после своей записи пользователь читает только с основной БД
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=15, cast=int)
+if REPLICA_PIN_SECONDS < REPLICA_MAX_LAG + REPLICA_LAG_CHECK_INTERVAL:
+    # Реплику с отставанием до REPLICA_MAX_LAG используют еще
+    # REPLICA_LAG_CHECK_INTERVAL секунд после проверки
+    raise ImproperlyConfigured('REPLICA_PIN_SECONDS должно быть не меньше REPLICA_MAX_LAG + REPLICA_LAG_CHECK_INTERVAL')
+if REPLICA_DATABASES:
+    DATABASE_ROUTERS = ['cinema.db_router.ReplicaRouter']
+    MIDDLEWARE.append('cinema.db_router.ReplicaReadsMiddleware')
+
 # Redis
 REDIS_URL = config('REDIS_URL', default='redis://localhost:6379/0')
 
-# Celery
+# Кэш
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'cinema',
+    }
+}
+
+# Время жизни закэшированных ответов каталога (сек)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=600, cast=int)
+
+# Счетчик просмотров: как часто переносить накопленные в Redis просмотры в БД (сек)
+VIEW_COUNTER_FLUSH_INTERVAL = config('VIEW_COUNTER_FLUSH_INTERVAL', default=60, cast=int)
+
+# Прогресс просмотра: как часто переносить буфер позиций из Redis в WatchHistory (сек)
+WATCH_PROGRESS_FLUSH_INTERVAL = config('WATCH_PROGRESS_FLUSH_INTERVAL', default=10, cast=int)
+
+# Счетчики голосов за отзывы: как часто сверять их с ReviewLike (сек)
+REVIEW_VOTES_RECONCILE_INTERVAL = config('REVIEW_VOTES_RECONCILE_INTERVAL', default=3600, cast=int)
+
+# Полка «В тренде»: за сколько часов вклад просмотра уменьшается вдвое.
+# После изменения выполните change_trending_half_life --from-hours <старое значение>
+TRENDING_HALF_LIFE_HOURS = config('TRENDING_HALF_LIFE_HOURS', default=24, cast=float)
+
+# Celery (cinema/celery.py, отложенные пересчеты — cinema.deferred)
 CELERY_BROKER_URL = REDIS_URL
 CELERY_RESULT_BACKEND = REDIS_URL
+# Очереди: realtime — сброс кэшей после записей, поисковый индекс и
+# подсказки, счетчики коллекций, агрегаты оценок; bulk — похожие фильмы и
+# рекомендации. У каждой свои воркеры
+CELERY_TASK_DEFAULT_QUEUE = 'bulk'
+CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
+# Без брокера задача realtime выполняется в процессе (cinema.deferred), запрос не ждет долгих повторов
+CELERY_TASK_PUBLISH_RETRY_POLICY = {'max_retries': 1, 'interval_start': 0, 'interval_step': 0.1, 'interval_max': 0.1}
+# Задачи идемпотентны: подтверждение после выполнения, упавший воркер не теряет задачу
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_IGNORE_RESULT = True
+# Неподтвержденная задача возвращается в очередь через visibility_timeout (сек):
+# значение должно быть больше отсрочки плюс время самой долгой задачи
+# (пересчет рекомендаций), иначе она выполнится повторно
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': config('CELERY_VISIBILITY_TIMEOUT', default=6 * 3600, cast=int)}
+# True — задачи выполняются сразу в процессе бэкенда, без воркеров
+CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=False, cast=bool)
+# Пересчет рекомендаций после новых оценок и избранного — не чаще раза в столько секунд
+RECOMMENDATIONS_REFRESH_INTERVAL = config('RECOMMENDATIONS_REFRESH_INTERVAL', default=3600, cast=int)
 
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
@@ -132,7 +233,8 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    # Курсорная пагинация; ?pagination=page включает постраничный режим для админки
+    'DEFAULT_PAGINATION_CLASS': 'movies.pagination.KeysetPagination',
     'PAGE_SIZE': 20,
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
@@ -148,6 +250,11 @@ CORS_ALLOW_CREDENTIALS = True
 # Telegram Bot
 TELEGRAM_BOT_TOKEN = config('TELEGRAM_BOT_TOKEN', default='')
 
+# Сколько действует подписанный initData после auth_date (сек)
+TELEGRAM_AUTH_MAX_AGE = config('TELEGRAM_AUTH_MAX_AGE', default=86400, cast=int)
+# Сколько проверенных initData держать в памяти каждого процесса
+TELEGRAM_AUTH_CACHE_SIZE = config('TELEGRAM_AUTH_CACHE_SIZE', default=10000, cast=int)
+
 # Spectacular settings
 SPECTACULAR_SETTINGS = {
     'TITLE': 'Telegram Cinema API',
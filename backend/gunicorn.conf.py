@@ -0,0 +1,29 @@
+"""
+Настройки gunicorn (читаются автоматически из рабочего каталога).
+
+До запуска воркеров проверяются соединение с БД, реплики и совместимость с пулером
+(cinema.db_metrics.check_database): с ошибочной конфигурацией сервер не
+стартует, а не падает на первых запросах.
+"""
+import os
+import sys
+
+
+def on_starting(server):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
+    import django
+    django.setup()
+
+    from django.conf import settings
+    from django.core import checks
+    from django.db import connections
+
+    messages = checks.run_checks(tags=[checks.Tags.database], databases=list(settings.DATABASES))
+    # Воркеры не должны унаследовать соединение мастера
+    connections.close_all()
+
+    # Логгер gunicorn после настройки логирования Django отключен
+    for message in messages:
+        print(message, file=sys.stderr)
+    if any(message.is_serious() for message in messages):
+        sys.exit(1)
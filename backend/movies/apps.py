@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class MoviesConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'movies'
+    verbose_name = 'Фильмы'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        # Регистрация метрик подсистем (и проверок настроек БД)
+        from . import view_counter  # noqa: F401
+        from cinema import db_metrics, db_router  # noqa: F401
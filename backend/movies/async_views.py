@@ -0,0 +1,203 @@
+"""
+Асинхронные версии частых запросов на чтение для режима ASGI (ASYNC_VIEWS,
+см. cinema/asgi.py): потоки фильма, списки и карточка фильма, поиск и
+снимок библиотеки.
+
+DRF 3.14 не поддерживает асинхронные представления, поэтому это обычные
+async-представления Django с той же аутентификацией и теми же ответами,
+что у синхронных версий в movies.views. Redis (кэш авторизации, манифесты,
+кэш полок, буфер прогресса, версия библиотеки) читается асинхронным
+клиентом, простые запросы к БД идут через асинхронный ORM. Сериализация,
+полнотекстовый поиск и промахи кэша выполняются синхронным кодом в потоке
+(sync_to_async): в Django 4.2 асинхронный ORM сам по себе работает так же,
+а prefetch_related с асинхронной итерацией не поддерживается.
+
+Синхронный код каждого запроса под ASGI выполняется в отдельном потоке со
+своим соединением с БД, поэтому все обращения к БД идут внутри db_access():
+одновременно их не больше ASYNC_DB_CONCURRENCY на процесс, и соединение
+закрывается сразу после участка, а не в конце ответа.
+"""
+import asyncio
+import contextlib
+import functools
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse
+from rest_framework.exceptions import AuthenticationFailed, NotAuthenticated, NotFound
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from telegram_auth import cache as auth_cache
+from telegram_auth.authentication import TelegramAuthentication
+from . import library, response_cache, views
+from .models import Movie
+from .serializers import MovieDetailSerializer
+from .stream_manifest import aget_compiled, get_manifest
+from .user_state import UserMovieState, apply_user_state, wants_user_fields
+from .view_counter import arecord_view
+
+
+authentication = TelegramAuthentication()
+# Семафор участков с БД; как и клиент Redis, свой у каждого цикла событий
+_db_slots = weakref.WeakKeyDictionary()
+
+
+@contextlib.asynccontextmanager
+async def db_access():
+    """Участок с запросами к БД (см. описание модуля)"""
+    loop = asyncio.get_running_loop()
+    slots = _db_slots.get(loop)
+    if slots is None:
+        slots = _db_slots[loop] = asyncio.Semaphore(settings.ASYNC_DB_CONCURRENCY)
+    async with slots:
+        try:
+            yield
+        finally:
+            await sync_to_async(close_old_connections)()
+
+
+def json_response(data, status=200, headers=None):
+    return JsonResponse(
+        data, status=status, headers=headers, encoder=JSONEncoder,
+        safe=False, json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')}
+    )
+
+
+def authenticated(view):
+    """Аналог @permission_classes([IsAuthenticated]): request.user — пользователь Telegram"""
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return json_response({'detail': f'Метод "{request.method}" не разрешен.'}, status=405)
+        init_data = request.META.get('HTTP_X_TELEGRAM_INIT_DATA')
+        user = auth_cache.get_user(init_data) if init_data else None
+        if user is None:
+            try:
+                async with db_access():
+                    result = await authentication.aauthenticate(request)
+            except AuthenticationFailed as e:
+                # Без заголовка WWW-Authenticate DRF отвечает 403, как и здесь
+                return json_response({'detail': e.detail}, status=403)
+            if result is None:
+                return json_response({'detail': NotAuthenticated().detail}, status=403)
+            user = result[0]
+        request.user = user
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def drf_request(request):
+    """Обертка DRF для сериализаторов и пагинации (query_params, build_absolute_uri)"""
+    wrapped = Request(request)
+    wrapped.user = request.user
+    return wrapped
+
+
+def run_sync_view(view):
+    """Синхронное DRF-представление в потоке; Response отрисует обработчик Django"""
+    view = sync_to_async(view)
+
+    async def run(request, *args, **kwargs):
+        async with db_access():
+            return await view(request, *args, **kwargs)
+    return run
+
+
+sync_movie_list = run_sync_view(views.MovieListView.as_view())
+sync_search = run_sync_view(views.SearchMoviesView.as_view())
+
+
+@authenticated
+async def movie_streams(request, pk):
+    """Ссылки для просмотра фильма (?season=N — только один сезон)"""
+    season = request.GET.get('season')
+    if season is not None:
+        try:
+            season = int(season)
+        except ValueError:
+            return json_response({'error': 'Неверный номер сезона'}, status=400)
+
+    compiled, manifest = await aget_compiled(pk, season)
+    if not compiled or manifest is None:
+        async with db_access():
+            if not compiled:
+                manifest = await sync_to_async(get_manifest)(pk, season)
+            season_exists = (
+                manifest is None and season is not None
+                and await Movie.objects.filter(pk=pk, is_active=True).aexists()
+            )
+        if season_exists:
+            return json_response({'error': 'Сезон не найден'}, status=404)
+        if manifest is None:
+            return json_response({'error': 'Фильм не найден'}, status=404)
+    return HttpResponse(manifest, content_type='application/json')
+
+
+@authenticated
+async def movie_list(request):
+    """
+    Полки каталога из кэша ответов с персональными полями поверх; остальные
+    списки и промахи кэша — синхронным MovieListView
+    """
+    if request.GET.get('category') not in views.CACHED_SHELVES:
+        return await sync_movie_list(request)
+
+    data = await response_cache.aget(response_cache.make_key(views.MovieListView.cache_prefix, request.GET))
+    if data is None:
+        return await sync_movie_list(request)
+
+    if wants_user_fields(drf_request(request)):
+        items = data['results'] if isinstance(data, dict) else data
+        state = UserMovieState(request.user)
+        async with db_access():
+            await state.aload(item['id'] for item in items)
+        apply_user_state(items, state)
+    return json_response(data)
+
+
+@authenticated
+async def movie_detail(request, pk):
+    async with db_access():
+        movie = await Movie.objects.filter(is_active=True).select_related('review_stats').filter(pk=pk).afirst()
+        if movie is None:
+            return json_response({'detail': NotFound().detail}, status=404)
+        # Похожие фильмы и персональные поля — запросы сериализатора
+        context = {'request': drf_request(request)}
+        data = await sync_to_async(lambda: MovieDetailSerializer(movie, context=context).data)()
+
+    # Учитываем просмотр (views_count обновится при сбросе счетчиков)
+    await arecord_view(movie.pk)
+    return json_response(data)
+
+
+@authenticated
+async def search_movies(request):
+    """Полнотекстовый поиск: запрос и сериализация — синхронным SearchMoviesView"""
+    return await sync_search(request)
+
+
+@authenticated
+async def user_library(request):
+    """Снимок библиотеки (см. views.user_library); при совпадении ETag — 304 без потока и БД"""
+    version = await library.aget_version(request.user.pk)
+    client_etags = library.client_etags(request.headers.get('If-None-Match'))
+    if version is not None and f'"{version}"' in client_etags:
+        return not_modified(version)
+
+    async with db_access():
+        snapshot = await sync_to_async(library.build_snapshot)(request.user.pk)
+    if version is None:
+        version = library.content_version(snapshot)
+        if f'"{version}"' in client_etags:
+            return not_modified(version)
+
+    return json_response({'version': version, **snapshot}, headers={'ETag': f'"{version}"'})
+
+
+def not_modified(version):
+    response = HttpResponseNotModified()
+    response['ETag'] = f'"{version}"'
+    return response
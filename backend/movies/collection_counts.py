@@ -0,0 +1,40 @@
+"""
+Денормализованное число активных фильмов коллекции (MovieCollection.movies_count).
+
+Сигналы CollectionMovie сдвигают счетчик на единицу при добавлении и
+удалении фильма, сигнал Movie — при включении или снятии фильма с показа.
+Список коллекций читает поле как есть, без COUNT на каждую коллекцию.
+Массовые изменения состава (bulk_create, импорт) пересчитывают счетчик
+с нуля через refresh_counts.
+"""
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import CollectionMovie, Movie, MovieCollection
+
+
+def _shifted(delta):
+    return Greatest(F('movies_count') + delta, Value(0))
+
+
+def shift_count(collection_id, movie_id, delta):
+    """Фильм добавлен в коллекцию или убран из нее; неактивные фильмы не считаются"""
+    MovieCollection.objects.filter(
+        Exists(Movie.objects.filter(pk=movie_id, is_active=True)), pk=collection_id
+    ).update(movies_count=_shifted(delta))
+
+
+def shift_counts_for_movie(collection_ids, delta):
+    """Фильм включили (+1) или сняли с показа (-1): сдвигает счетчики его коллекций"""
+    if collection_ids:
+        MovieCollection.objects.filter(pk__in=collection_ids).update(movies_count=_shifted(delta))
+
+
+def refresh_counts(queryset=None):
+    """Пересчитывает счетчики с нуля. Возвращает число коллекций."""
+    if queryset is None:
+        queryset = MovieCollection.objects.all()
+    active = CollectionMovie.objects.filter(
+        collection=OuterRef('pk'), movie__is_active=True
+    ).values('collection').annotate(total=Count('id')).values('total')
+    return queryset.update(movies_count=Coalesce(Subquery(active), Value(0)))
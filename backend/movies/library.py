@@ -0,0 +1,157 @@
+"""
+Компактный снимок библиотеки пользователя (/api/user/library/).
+
+Клиент один раз получает избранное, «Смотреть позже», оценки и прогресс и
+сам подставляет персональные поля в карточки, а списки каталога запрашивает
+с ?no_user_fields=1 (общий для всех ответ, см. response_cache).
+
+Идентификаторы фильмов отсортированы и закодированы разностями:
+[3, 10, 12] -> [3, 7, 2]. Значения оценок и прогресса идут параллельными
+массивами в том же порядке.
+
+Версия снимка — случайный токен в Redis, который меняется после каждого
+изменения библиотеки (сигналы моделей, пакетная синхронизация, буфер
+прогресса). Она же отдается как ETag, поэтому повторный запрос с
+If-None-Match получает 304 без обращения к БД.
+"""
+import hashlib
+import json
+import logging
+import uuid
+
+import redis
+from django.db import transaction
+from django.utils.http import parse_etags
+
+from cinema.redis_client import get_async_redis, get_redis
+from . import watch_progress
+from .models import MovieRating, UserFavorite, WatchHistory, WatchLater
+
+
+logger = logging.getLogger('cinema')
+
+VERSION_KEY = 'library:version:{user_id}'
+# Токен живет ограниченное время: если смена версии потерялась (Redis был
+# недоступен), клиент все равно перезапросит снимок не позже чем через сутки
+VERSION_TTL = 60 * 60 * 24
+
+
+def _new_token():
+    return uuid.uuid4().hex[:16]
+
+
+def bump_version(*user_ids, pipe=None):
+    """Меняет версию библиотеки пользователей; с pipe — в составе чужого пайплайна"""
+    if not user_ids:
+        return
+    try:
+        target = pipe if pipe is not None else get_redis().pipeline()
+        for user_id in user_ids:
+            target.set(VERSION_KEY.format(user_id=user_id), _new_token(), ex=VERSION_TTL)
+        if pipe is None:
+            target.execute()
+    except redis.RedisError as e:
+        logger.warning('Не удалось сменить версию библиотеки %s: %s', user_ids, e)
+
+
+def bump_version_on_commit(*user_ids):
+    """Смена версии после коммита: иначе параллельный запрос закэширует старые данные под новой версией"""
+    transaction.on_commit(lambda: bump_version(*user_ids))
+
+
+def get_version(user_id):
+    """Текущая версия библиотеки; None, если Redis недоступен"""
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        client = get_redis()
+        token = client.get(key)
+        if token is None:
+            client.set(key, _new_token(), ex=VERSION_TTL, nx=True)
+            token = client.get(key)
+        return token.decode() if token is not None else None
+    except redis.RedisError as e:
+        logger.warning('Версия библиотеки недоступна: %s', e)
+        return None
+
+
+async def aget_version(user_id):
+    """get_version через асинхронный клиент Redis"""
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        client = get_async_redis()
+        token = await client.get(key)
+        if token is None:
+            await client.set(key, _new_token(), ex=VERSION_TTL, nx=True)
+            token = await client.get(key)
+        return token.decode() if token is not None else None
+    except redis.RedisError as e:
+        logger.warning('Версия библиотеки недоступна: %s', e)
+        return None
+
+
+def client_etags(if_none_match):
+    """ETag из If-None-Match; слабые (W/) сравниваются как сильные"""
+    return [etag.removeprefix('W/') for etag in parse_etags(if_none_match or '')]
+
+
+def delta_encode(ids):
+    """Отсортированные id -> первый id и разности соседних"""
+    encoded, previous = [], 0
+    for movie_id in ids:
+        encoded.append(movie_id - previous)
+        previous = movie_id
+    return encoded
+
+
+def delta_decode(encoded):
+    ids, current = [], 0
+    for delta in encoded:
+        current += delta
+        ids.append(current)
+    return ids
+
+
+def _latest_progress(user_id):
+    """Последняя позиция по каждому фильму с учетом буфера: {movie_id: (progress, season, episode, время)}"""
+    latest = {
+        movie_id: (progress, season, episode, watched_at)
+        for movie_id, progress, season, episode, watched_at in WatchHistory.objects.filter(
+            user_id=user_id
+        ).order_by('movie_id', '-watched_at').distinct('movie_id').values_list(
+            'movie_id', 'progress', 'season', 'episode', 'watched_at'
+        )
+    }
+    for (movie_id, season, episode), (progress, watched_at) in watch_progress.buffered_progress(user_id).items():
+        if movie_id not in latest or watched_at > latest[movie_id][3]:
+            latest[movie_id] = (progress, season, episode, watched_at)
+    return latest
+
+
+def build_snapshot(user_id):
+    """Снимок библиотеки без версии (четыре запроса и чтение буфера прогресса)"""
+    def ids(model):
+        return delta_encode(
+            model.objects.filter(user_id=user_id).order_by('movie_id').values_list('movie_id', flat=True)
+        )
+
+    ratings = list(MovieRating.objects.filter(user_id=user_id).order_by('movie_id').values_list('movie_id', 'rating'))
+    progress = sorted(_latest_progress(user_id).items())
+    return {
+        'favorites': ids(UserFavorite),
+        'watch_later': ids(WatchLater),
+        'ratings': {
+            'ids': delta_encode(movie_id for movie_id, _ in ratings),
+            'values': [rating for _, rating in ratings],
+        },
+        'progress': {
+            'ids': delta_encode(movie_id for movie_id, _ in progress),
+            'progress': [row[0] for _, row in progress],
+            'season': [row[1] for _, row in progress],
+            'episode': [row[2] for _, row in progress],
+        },
+    }
+
+
+def content_version(snapshot):
+    """Версия по содержимому — когда токена в Redis нет"""
+    return hashlib.md5(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()[:16]
@@ -0,0 +1,283 @@
+"""
+Пакетная синхронизация библиотеки пользователя (/api/user/sync/).
+
+Клиент копит операции офлайн и присылает их пачкой, каждую со временем
+совершения (ts, миллисекунды unix):
+
+    {"op": "favorite", "movie_id": 1, "value": true, "ts": 1700000000000}
+
+op — favorite и watch_later (value true/false — добавить/убрать), rating
+(1..10 или null — снять оценку), progress (value {"progress": сек,
+"season": .., "episode": ..}). Операции задают состояние, а не
+переключают его, поэтому повтор пачки безопасен. Конфликты решаются по
+правилу last-writer-wins: для каждого элемента хранится время последнего
+изменения (LibraryChange, включая удаления), более старая операция
+пропускается; прогресс сравнивается с WatchHistory.watched_at.
+Пачка применяется в одной транзакции групповыми запросами; счетчики
+фильмов и UserStats сдвигаются теми же дельтами, что и в сигналах.
+"""
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cinema.deferred import defer
+from . import library, response_cache, tasks, watch_progress
+from .models import LibraryChange, Movie, MovieRating, UserFavorite, WatchLater
+from .ratings import apply_rating_deltas
+from .user_state import UserMovieState, watch_progress_data
+from .user_stats import apply_genre_deltas, apply_stats_delta, is_high_rating
+
+MAX_OPERATIONS = 500
+# Пространство ключей pg_advisory_xact_lock: синхронизации одного пользователя идут по очереди
+SYNC_LOCK_NAMESPACE = 0x73796e63
+
+Operation = namedtuple('Operation', 'op movie_id value moment')
+
+
+class OperationError(ValueError):
+    pass
+
+
+def _optional_int(value):
+    return None if value is None else int(value)
+
+
+def parse_operations(raw, now=None):
+    """
+    Проверяет операции запроса. Возвращает (операции, ошибки по индексам).
+    Время из будущего (сбитые часы клиента) ограничивается текущим моментом.
+    """
+    now = now or timezone.now()
+    if not isinstance(raw, list):
+        return [], ['Ожидается список операций']
+    if len(raw) > MAX_OPERATIONS:
+        return [], [f'Не больше {MAX_OPERATIONS} операций за раз']
+
+    operations, errors = [], []
+    for index, item in enumerate(raw):
+        try:
+            op = item['op']
+            movie_id = int(item['movie_id'])
+            if not 0 < movie_id <= watch_progress.MAX_BIGINT:
+                raise OperationError('Неверный id фильма')
+            moment = min(datetime.fromtimestamp(float(item['ts']) / 1000, tz=dt_timezone.utc), now)
+            value = item.get('value')
+
+            if op in ('favorite', 'watch_later'):
+                if not isinstance(value, bool):
+                    raise OperationError('value должно быть true или false')
+            elif op == 'rating':
+                if value is not None and (isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= 10):
+                    raise OperationError('Рейтинг должен быть от 1 до 10')
+            elif op == 'progress':
+                value = (
+                    int(value['progress']), _optional_int(value.get('season')), _optional_int(value.get('episode'))
+                )
+                if not watch_progress.is_valid_position(movie_id, *value):
+                    raise OperationError('Неверные данные прогресса')
+            else:
+                raise OperationError('Неизвестная операция')
+        except (KeyError, TypeError, ValueError, OverflowError, OSError) as e:
+            errors.append(f'{index}: {e if isinstance(e, OperationError) else "неверный формат операции"}')
+            continue
+        operations.append(Operation(op, movie_id, value, moment))
+    return operations, errors
+
+
+def record_change(user_id, movie_id, field, moment=None):
+    """Отмечает изменение элемента одиночным запросом API (тот же last-writer-wins)"""
+    LibraryChange.objects.update_or_create(
+        user_id=user_id, movie_id=movie_id, field=field,
+        defaults={'changed_at': moment or timezone.now()}
+    )
+
+
+def _delete_rows(model, user_id, movie_ids):
+    """DELETE без загрузки объектов и сигналов; возвращает id фильмов удаленных строк"""
+    if not movie_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {model._meta.db_table} WHERE user_id = %s AND movie_id = ANY(%s) RETURNING movie_id',
+            [user_id, list(movie_ids)],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _insert_rows(model, user_id, movie_ids):
+    """
+    INSERT без сигналов; строки, которые успел добавить одиночный запрос API,
+    пропускаются. Возвращает id фильмов вставленных строк.
+    """
+    if not movie_ids:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} (user_id, movie_id, created_at) '
+            f'SELECT %s, movie_id, %s FROM unnest(%s::bigint[]) AS movie_id '
+            f'ON CONFLICT (user_id, movie_id) DO NOTHING RETURNING movie_id',
+            [user_id, timezone.now(), list(movie_ids)],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _apply_membership(model, user, wanted):
+    """Добавляет/убирает фильмы ({movie_id: bool}) в избранном или «Смотреть позже»"""
+    existing = set(model.objects.filter(user=user, movie_id__in=wanted).values_list('movie_id', flat=True))
+    added = _insert_rows(model, user.pk, [
+        movie_id for movie_id, value in wanted.items() if value and movie_id not in existing
+    ])
+    removed = _delete_rows(model, user.pk, [
+        movie_id for movie_id, value in wanted.items() if not value and movie_id in existing
+    ])
+    return added, removed
+
+
+def _apply_ratings(user, wanted, now):
+    """
+    Ставит, меняет и снимает оценки ({movie_id: оценка или None}).
+    Возвращает (дельты UserStats, {movie_id: дельта высоких оценок}, измененные фильмы,
+    фильмы с изменившимся our_rating).
+    """
+    existing = {rating.movie_id: rating for rating in MovieRating.objects.filter(user=user, movie_id__in=wanted)}
+    created, updated, removed = [], [], []
+    changes = {}  # movie_id: (старая оценка, новая)
+    for movie_id, value in wanted.items():
+        current = existing.get(movie_id)
+        old = current.rating if current else None
+        if old == value:
+            continue
+        changes[movie_id] = (old, value)
+        if current is None:
+            created.append(MovieRating(user=user, movie_id=movie_id, rating=value))
+        elif value is None:
+            removed.append(movie_id)
+        else:
+            current.rating, current.updated_at = value, now
+            updated.append(current)
+
+    MovieRating.objects.bulk_create(created)
+    MovieRating.objects.bulk_update(updated, ['rating', 'updated_at'])
+    _delete_rows(MovieRating, user.pk, removed)
+
+    movie_deltas = {
+        movie_id: ((new or 0) - (old or 0), (new is not None) - (old is not None))
+        for movie_id, (old, new) in changes.items()
+    }
+    our_rating_changed = apply_rating_deltas(movie_deltas)
+    stats = {
+        'ratings_sum': sum(sum_delta for sum_delta, _ in movie_deltas.values()),
+        'ratings_count': sum(count_delta for _, count_delta in movie_deltas.values()),
+    }
+    genre_deltas = {
+        movie_id: 1 if is_high_rating(new) else -1
+        for movie_id, (old, new) in changes.items()
+        if is_high_rating(old) != is_high_rating(new)
+    }
+    return stats, genre_deltas, list(changes), our_rating_changed
+
+
+def apply_operations(user, operations):
+    """
+    Применяет операции (см. parse_operations) в одной транзакции.
+    Возвращает {'applied', 'skipped', 'rejected', 'state'}.
+    """
+    now = timezone.now()
+    # По каждому элементу нужна только самая поздняя операция пачки
+    latest = {}
+    for operation in operations:
+        key = (operation.op, operation.movie_id)
+        if operation.op == 'progress':
+            key += operation.value[1:]
+        if key not in latest or operation.moment >= latest[key].moment:
+            latest[key] = operation
+
+    movie_ids = {operation.movie_id for operation in latest.values()}
+    durations = dict(Movie.objects.filter(pk__in=movie_ids, is_active=True).values_list('id', 'duration'))
+    rejected = sorted(movie_ids - durations.keys())
+    latest = {key: operation for key, operation in latest.items() if operation.movie_id in durations}
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, %s)', [SYNC_LOCK_NAMESPACE, user.pk])
+
+        clocks = {
+            (change.field, change.movie_id): change.changed_at
+            for change in LibraryChange.objects.filter(user=user, movie_id__in=durations)
+        }
+        # Прогресс сравнивается с WatchHistory.watched_at внутри apply_progress
+        progress = [operation for operation in latest.values() if operation.op == 'progress']
+        fresh = [
+            operation for key, operation in latest.items()
+            if operation.op != 'progress' and (clocks.get(key) is None or operation.moment > clocks[key])
+        ]
+        LibraryChange.objects.bulk_create(
+            [
+                LibraryChange(user=user, movie_id=operation.movie_id, field=operation.op, changed_at=operation.moment)
+                for operation in fresh
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'movie', 'field'],
+            update_fields=['changed_at'],
+        )
+
+        def wanted(op):
+            return {operation.movie_id: operation.value for operation in fresh if operation.op == op}
+
+        favorites_added, favorites_removed = _apply_membership(UserFavorite, user, wanted('favorite'))
+        if favorites_added:
+            Movie.objects.filter(pk__in=favorites_added).update(favorites_count=F('favorites_count') + 1)
+        if favorites_removed:
+            Movie.objects.filter(pk__in=favorites_removed).update(favorites_count=F('favorites_count') - 1)
+        _apply_membership(WatchLater, user, wanted('watch_later'))
+        rating_stats, genre_deltas, rated, rerated = _apply_ratings(user, wanted('rating'), now)
+
+        # Строки уже записаны: если статистики нет, она строится с нуля с их учетом
+        row_existed = apply_stats_delta(
+            user.pk, favorites_count=len(favorites_added) - len(favorites_removed), **rating_stats
+        )
+        if row_existed:
+            apply_genre_deltas(user.pk, genre_deltas)
+
+        progress_applied = watch_progress.apply_progress([
+            (user.pk, operation.movie_id, operation.value[1], operation.value[2], operation.value[0],
+             operation.moment.timestamp())
+            for operation in progress
+        ])
+
+        if fresh or progress_applied:
+            library.bump_version_on_commit(user.pk)
+        changed_movies = set(favorites_added) | set(favorites_removed) | set(rated)
+        if changed_movies:
+            # Счетчики в карточках фильмов изменились
+            defer(tasks.invalidate_cache, *[f'movie:{pk}' for pk in changed_movies])
+            defer(tasks.refresh_recommendations)
+        if rerated:
+            # our_rating влияет на полки и сортировку по рейтингу
+            defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG)
+
+    return {
+        'applied': len(fresh) + progress_applied,
+        'skipped': len(latest) - len(fresh) - progress_applied,
+        'rejected': rejected,
+        'state': library_state(user, durations),
+    }
+
+
+def library_state(user, durations):
+    """Итоговое состояние фильмов ({movie_id: duration}) для ответа синхронизации"""
+    state = UserMovieState(user)
+    state.load(durations)
+    watch_later = set(WatchLater.objects.filter(user=user, movie_id__in=durations).values_list('movie_id', flat=True))
+    return {
+        movie_id: {
+            'is_favorite': state.is_favorite(movie_id),
+            'in_watch_later': movie_id in watch_later,
+            'user_rating': state.get_rating(movie_id),
+            'watch_progress': watch_progress_data(state.get_progress(movie_id), duration),
+        }
+        for movie_id, duration in durations.items()
+    }
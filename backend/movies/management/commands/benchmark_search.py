@@ -0,0 +1,108 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from movies.models import Movie
+from movies.search import search_movies, update_search_vectors
+
+
+RU_SYLLABLES = ['ка', 'ро', 'ми', 'ста', 'ле', 'ны', 'во', 'зе', 'ли', 'тра', 'ный', 'ва']
+EN_SYLLABLES = ['ka', 'ro', 'mi', 'star', 'le', 'ny', 'vo', 'ze', 'li', 'tra', 'ous', 'er']
+NAMES = [
+    'Иван Петров', 'Анна Смирнова', 'John Smith', 'Emma Stone', 'Tom Hardy',
+    'Мария Иванова', 'Christopher Nolan', 'Алексей Серебряков', 'Cillian Murphy',
+]
+
+
+def make_vocabulary(syllables, size, rng):
+    """Словарь псевдослов из слогов, чтобы частоты слов были близки к реальному каталогу"""
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choices(syllables, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку полнотекстового поиска и старого поиска через icontains '
+        'на синтетическом каталоге. Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            queries = self.generate_catalog(options['movies'])
+
+            for query in queries:
+                legacy = self.measure(lambda: list(self.legacy_search(query)[:20]), options['repeat'])
+                ranked = self.measure(lambda: list(search_movies(query)[:20]), options['repeat'])
+                self.stdout.write(
+                    f'{query!r:24} icontains: {legacy:8.1f} мс   полнотекстовый: {ranked:8.1f} мс'
+                )
+
+            transaction.set_rollback(True)
+
+    def generate_catalog(self, count):
+        """Создает каталог и возвращает набор тестовых запросов"""
+        self.stdout.write(f'Создание {count} фильмов...')
+        rng = random.Random(42)
+        ru_words = make_vocabulary(RU_SYLLABLES, 20000, rng)
+        en_words = make_vocabulary(EN_SYLLABLES, 20000, rng)
+
+        batch = []
+        for i in range(count):
+            words = ru_words if i % 2 else en_words
+            batch.append(Movie(
+                title=' '.join(rng.sample(words, 3)).capitalize(),
+                original_title=' '.join(rng.sample(en_words, 2)).title(),
+                description=' '.join(rng.choices(ru_words, k=40)),
+                director=rng.choice(NAMES),
+                cast=rng.sample(NAMES, 3),
+                year=rng.randint(1950, 2024),
+                our_rating=round(rng.uniform(3, 9.5), 1),
+                views_count=rng.randint(0, 100000),
+            ))
+            if len(batch) == 5000:
+                Movie.objects.bulk_create(batch)
+                batch = []
+        Movie.objects.bulk_create(batch)
+
+        update_search_vectors(Movie.objects.all())
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Movie._meta.db_table}')
+
+        return [
+            rng.choice(ru_words),
+            rng.choice(en_words),
+            ' '.join(rng.sample(ru_words, 2)),
+            rng.choice(en_words)[:4],
+            'Nolan',
+            'Смирнова',
+        ]
+
+    def legacy_search(self, query):
+        """Прежняя реализация SearchMoviesView"""
+        return Movie.objects.filter(
+            Q(title__icontains=query) |
+            Q(original_title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(director__icontains=query) |
+            Q(cast__icontains=query),
+            is_active=True
+        ).distinct().order_by('-our_rating', '-views_count')
+
+    def measure(self, func, repeat):
+        """Медианное время выполнения в миллисекундах"""
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,50 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from movies.similarity import BATCH_SIZE, TOP_K, build_feature_matrix, top_neighbors
+from .benchmark_search import NAMES
+
+
+COUNTRIES = ['США', 'Россия', 'Великобритания', 'Франция', 'Германия', 'Япония', 'Корея', 'Индия', 'Испания', 'Италия']
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время расчета похожих фильмов на синтетическом каталоге (в памяти, без БД)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--k', type=int, default=TOP_K)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        # Расширяем пул имен, чтобы актеры не повторялись в каждом втором фильме
+        people = [f'{name} {i}' for name in NAMES for i in range(200)]
+        movies = [
+            {
+                'id': i,
+                'year': rng.randint(1950, 2024),
+                'director': rng.choice(people),
+                'cast': rng.sample(people, 5),
+                'countries': rng.sample(COUNTRIES, rng.randint(1, 2)),
+                'genre_ids': rng.sample(range(20), rng.randint(1, 3)),
+            }
+            for i in range(options['movies'])
+        ]
+
+        started = time.perf_counter()
+        matrix = build_feature_matrix(movies)
+        prepared = time.perf_counter()
+        pairs = sum(
+            len(neighbors)
+            for _, neighbors, _ in top_neighbors(matrix, range(len(movies)), options['k'], options['batch_size'])
+        )
+        finished = time.perf_counter()
+
+        self.stdout.write(
+            f'Фильмов: {len(movies)}  признаков: {matrix.shape[1]}  пар соседей: {pairs}\n'
+            f'Матрица признаков: {prepared - started:.1f} с  top-K: {finished - prepared:.1f} с  '
+            f'всего: {finished - started:.1f} с'
+        )
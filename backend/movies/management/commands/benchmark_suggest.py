@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from movies.models import Movie, SuggestTerm
+from movies.suggest import _find, query_keys, rebuild_movie_terms
+from .benchmark_search import EN_SYLLABLES, NAMES, RU_SYLLABLES, make_vocabulary
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку автодополнения (без кэша) на синтетическом каталоге. '
+        'Данные создаются в транзакции и откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            titles = self.generate_catalog(options['movies'])
+
+            rng = random.Random(7)
+            timings = []
+            for _ in range(options['queries']):
+                title = rng.choice(titles)
+                query = title[:rng.randint(1, len(title))]
+                started = time.perf_counter()
+                _find(query_keys(query), 10)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            timings.sort()
+            self.stdout.write(
+                f'Запросов: {len(timings)}  p50: {statistics.median(timings):.1f} мс  '
+                f'p99: {timings[int(len(timings) * 0.99) - 1]:.1f} мс  max: {timings[-1]:.1f} мс'
+            )
+
+            transaction.set_rollback(True)
+
+    def generate_catalog(self, count):
+        self.stdout.write(f'Создание {count} фильмов...')
+        rng = random.Random(42)
+        ru_words = make_vocabulary(RU_SYLLABLES, 20000, rng)
+        en_words = make_vocabulary(EN_SYLLABLES, 20000, rng)
+
+        titles = []
+        for start in range(0, count, 5000):
+            movies = []
+            for i in range(start, min(start + 5000, count)):
+                title = ' '.join(rng.sample(ru_words if i % 2 else en_words, rng.randint(1, 3)))
+                titles.append(title)
+                movies.append(Movie(
+                    title=title.capitalize(),
+                    original_title=' '.join(rng.sample(en_words, 2)).title(),
+                    director=rng.choice(NAMES),
+                    cast=rng.sample(NAMES, 3),
+                    year=rng.randint(1950, 2024),
+                ))
+            rebuild_movie_terms(Movie.objects.bulk_create(movies))
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Movie._meta.db_table}')
+            cursor.execute(f'ANALYZE {SuggestTerm._meta.db_table}')
+        self.stdout.write(f'Ключей автодополнения: {SuggestTerm.objects.count()}')
+        return titles
@@ -0,0 +1,74 @@
+import statistics
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from movies.models import Movie
+from movies.view_counter import apply_view_counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет время свертки просмотров в trending_score на синтетическом '
+        'потоке событий. Каждый сброс фиксируется отдельно, как в работе; '
+        'созданные фильмы удаляются в конце.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movies', type=int, default=100000)
+        parser.add_argument('--events', type=int, default=10000000)
+        parser.add_argument('--flushes', type=int, default=1440, help='На сколько сбросов счетчиков делится поток')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"Создание {options['movies']} фильмов...")
+        movies = Movie.objects.bulk_create(
+            [Movie(title=f'Фильм {i}', year=2000, is_active=False) for i in range(options['movies'])],
+            batch_size=5000,
+        )
+        movie_ids = np.array([movie.pk for movie in movies])
+        try:
+            self.run(movie_ids, options)
+        finally:
+            # Напрямую, без сигналов: у синтетических фильмов нет связанных записей
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {Movie._meta.db_table} WHERE id = ANY(%s)', [movie_ids.tolist()])
+
+    def run(self, movie_ids, options):
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Movie._meta.db_table}')
+
+        # Популярность фильмов по закону Ципфа; каждый сброс получает свою долю событий
+        rng = np.random.default_rng(42)
+        events_per_flush = options['events'] // options['flushes']
+        moment = timezone.now() - timedelta(days=1)
+        step = timedelta(days=1) / options['flushes']
+
+        timings = []
+        flushed_movies = 0
+        for _ in range(options['flushes']):
+            picks = (rng.zipf(1.2, events_per_flush) - 1) % len(movie_ids)
+            hits = np.bincount(picks, minlength=len(movie_ids))
+            counts = {int(movie_ids[i]): int(hits[i]) for i in np.flatnonzero(hits)}
+
+            started = time.perf_counter()
+            with transaction.atomic():
+                apply_view_counts(counts, moment)
+            timings.append((time.perf_counter() - started) * 1000)
+            flushed_movies += len(counts)
+            moment += step
+
+        started = time.perf_counter()
+        list(Movie.objects.order_by('-trending_score', '-id').values_list('id', flat=True)[:20])
+        shelf_ms = (time.perf_counter() - started) * 1000
+
+        self.stdout.write(
+            f'Событий: {events_per_flush * options["flushes"]}  сбросов: {len(timings)}  '
+            f'фильмов в среднем за сброс: {flushed_movies // len(timings)}\n'
+            f'Свертка всего: {sum(timings) / 1000:.1f} с  на сброс p50: {statistics.median(timings):.1f} мс  '
+            f'max: {max(timings):.1f} мс\n'
+            f'Полка «В тренде» (20 фильмов): {shelf_ms:.1f} мс'
+        )
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from movies.recommender import NEIGHBORS, TOP_N, USER_CHUNK_SIZE, build_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает персональные рекомендации (MovieRecommendation). Запускать периодически, например раз в сутки.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top-n', type=int, default=TOP_N, help='Рекомендаций на пользователя')
+        parser.add_argument('--neighbors', type=int, default=NEIGHBORS, help='Соседей на фильм в матрице близости')
+        parser.add_argument('--chunk-size', type=int, default=USER_CHUNK_SIZE, help='Пользователей в пачке')
+
+    def handle(self, *args, **options):
+        stats = build_recommendations(
+            top_n=options['top_n'],
+            neighbors=options['neighbors'],
+            user_chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Пользователей: {stats['users']}, фильмов: {stats['movies']}, "
+            f"взаимодействий: {stats['interactions']}, рекомендаций: {stats['recommendations']}, "
+            f"матрица близости {stats['prepare_seconds']} с, всего {stats['total_seconds']} с"
+        ))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from movies.trending import change_half_life
+
+
+class Command(BaseCommand):
+    help = (
+        'Переводит trending_score на новый полупериод (TRENDING_HALF_LIFE_HOURS) '
+        'с сохранением текущих весов. Запускать один раз после изменения настройки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-hours', type=float, required=True, help='Прежний полупериод (ч)')
+
+    def handle(self, *args, **options):
+        updated = change_half_life(options['from_hours'], settings.TRENDING_HALF_LIFE_HOURS)
+        self.stdout.write(self.style.SUCCESS(
+            f"Полупериод {options['from_hours']} ч -> {settings.TRENDING_HALF_LIFE_HOURS} ч, "
+            f'обновлено фильмов: {updated}'
+        ))
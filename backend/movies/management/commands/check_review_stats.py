@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from movies.review_stats import find_histogram_drift, rebuild_histogram
+
+
+class Command(BaseCommand):
+    help = 'Сверяет гистограммы оценок отзывов (MovieReviewStats) с GROUP BY по Review'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Перезаписать расходящиеся гистограммы фактическими значениями'
+        )
+
+    def handle(self, *args, **options):
+        drift = find_histogram_drift()
+
+        for movie_id, stored, expected in drift:
+            self.stdout.write(f'Фильм {movie_id}: сохранено {stored}, фактически {expected}')
+            if options['fix']:
+                rebuild_histogram(movie_id, expected)
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено фильмов: {len(drift)}'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Фильмов с расхождениями: {len(drift)}'))
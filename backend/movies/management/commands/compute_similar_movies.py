@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from movies.models import Movie
+from movies.similarity import BATCH_SIZE, TOP_K, recompute_all, recompute_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает таблицу похожих фильмов. Без параметров — полный пересчет, '
+        'с --movie-ids или --since-hours — только для новых фильмов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--movie-ids', type=int, nargs='+', help='ID новых или измененных фильмов')
+        parser.add_argument('--since-hours', type=int, help='Фильмы, добавленные за последние N часов')
+        parser.add_argument('--k', type=int, default=TOP_K, help='Сколько соседей хранить на фильм')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        movie_ids = options['movie_ids']
+        if options['since_hours'] is not None:
+            since = timezone.now() - timedelta(hours=options['since_hours'])
+            movie_ids = list(Movie.objects.filter(created_at__gte=since).values_list('id', flat=True))
+
+        if movie_ids is None:
+            stats = recompute_all(k=options['k'], batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Фильмов: {stats['movies']}, признаков: {stats['features']}, "
+                f"подготовка {stats['prepare_seconds']} с, всего {stats['total_seconds']} с"
+            ))
+            return
+
+        stats = recompute_for(movie_ids, k=options['k'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Новых фильмов: {stats['movies']}, обновлено списков соседей: {stats['updated_neighbors']}, "
+            f"всего {stats['total_seconds']} с"
+        ))
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from movies.view_counter import flush_view_counts
+
+
+class Command(BaseCommand):
+    help = 'Переносит накопленные в Redis просмотры в Movie.views_count'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, сбрасывая счетчики каждые VIEW_COUNTER_FLUSH_INTERVAL секунд'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            # Как в начале запроса: устаревшее (CONN_MAX_AGE) или оборванное соединение заменяется
+            close_old_connections()
+            updated = flush_view_counts()
+            self.stdout.write(f'Обновлено фильмов: {updated}')
+
+            if not options['loop']:
+                break
+            time.sleep(settings.VIEW_COUNTER_FLUSH_INTERVAL)
@@ -0,0 +1,27 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from movies.watch_progress import flush_watch_progress
+
+
+class Command(BaseCommand):
+    help = 'Переносит накопленный в Redis прогресс просмотра в WatchHistory и UserMovieStatus'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, сбрасывая буфер каждые WATCH_PROGRESS_FLUSH_INTERVAL секунд'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            updated = flush_watch_progress()
+            self.stdout.write(f'Обновлено записей истории: {updated}')
+
+            if not options['loop']:
+                break
+            time.sleep(settings.WATCH_PROGRESS_FLUSH_INTERVAL)
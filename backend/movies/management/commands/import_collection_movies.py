@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from movies.collection_counts import refresh_counts
+from movies.models import CollectionMovie, Movie, MovieCollection
+
+LEGACY_LINKS = 'movies_moviecollection_movies'
+STASH = 'movies_collection_links_legacy'
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит состав коллекций из прежней M2M-таблицы в CollectionMovie. '
+        'Запускать дважды: до "migrate" (миграция удаляет старую таблицу, связи '
+        'сохраняются в отдельную) и после него (связи переносятся с позициями в '
+        'прежнем порядке, счетчики пересчитываются). Повторный запуск ничего не меняет.'
+    )
+    requires_system_checks = []
+
+    def handle(self, *args, **options):
+        tables = connection.introspection.table_names()
+        entries_table = CollectionMovie._meta.db_table
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            if STASH in tables and entries_table in tables:
+                cursor.execute(
+                    f"""
+                    INSERT INTO {entries_table} (collection_id, movie_id, position, added_at)
+                    SELECT s.moviecollection_id, s.movie_id,
+                           row_number() OVER (PARTITION BY s.moviecollection_id ORDER BY s.id) - 1, now()
+                    FROM {STASH} s
+                    WHERE EXISTS (SELECT 1 FROM {MovieCollection._meta.db_table} c WHERE c.id = s.moviecollection_id)
+                      AND EXISTS (SELECT 1 FROM {Movie._meta.db_table} m WHERE m.id = s.movie_id)
+                    ON CONFLICT (collection_id, movie_id) DO NOTHING
+                    """
+                )
+                imported = cursor.rowcount
+                cursor.execute(f'DROP TABLE {STASH}')
+                refreshed = refresh_counts()
+                self.stdout.write(self.style.SUCCESS(
+                    f'Перенесено связей: {imported}, пересчитано коллекций: {refreshed}'
+                ))
+            elif LEGACY_LINKS in tables:
+                cursor.execute(
+                    f'CREATE TABLE IF NOT EXISTS {STASH} AS '
+                    f'SELECT id, moviecollection_id, movie_id FROM {LEGACY_LINKS}'
+                )
+                cursor.execute(f'SELECT count(*) FROM {STASH}')
+                self.stdout.write(
+                    f'Сохранено связей: {cursor.fetchone()[0]}. '
+                    f'Выполните "python manage.py migrate" и запустите команду еще раз'
+                )
+            else:
+                self.stdout.write('Старых связей нет — переносить нечего')
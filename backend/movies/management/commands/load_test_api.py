@@ -0,0 +1,182 @@
+import hashlib
+import hmac
+import json
+import multiprocessing
+import random
+import statistics
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from movies.models import Movie
+from telegram_auth.authentication import get_secret_key
+
+# Синтетические пользователи Telegram: id начиная с этого значения
+TELEGRAM_ID_BASE = 9_000_000_000
+
+# Сценарий клиента мини-приложения: (эндпоинт, вес)
+SCENARIO = [
+    ('shelves', 4),
+    ('detail', 2),
+    ('streams', 2),
+    ('library', 1),
+    ('search', 1),
+]
+SHELVES = ['featured', 'new', 'popular', 'top_rated', 'trending']
+
+
+def sign_init_data(telegram_id, bot_token):
+    """initData мини-приложения, подписанный токеном бота, как его присылает Telegram"""
+    fields = {
+        'auth_date': str(int(time.time())),
+        'query_id': f'load-{telegram_id}',
+        'user': json.dumps({'id': telegram_id, 'first_name': 'Load', 'last_name': str(telegram_id)}),
+    }
+    check = '\n'.join(f'{key}={fields[key]}' for key in sorted(fields))
+    fields['hash'] = hmac.new(get_secret_key(bot_token), check.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def run_client(base_url, init_data, movie_ids, words, started_at, warmup_until, stop_at, samples, seed):
+    """Один клиент: запросы по сценарию без пауз до stop_at; замеры после прогрева"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.headers['X-Telegram-Init-Data'] = init_data
+    endpoints, weights = zip(*SCENARIO)
+    library_etag = None
+
+    while True:
+        now = time.perf_counter()
+        if now >= stop_at:
+            return
+        endpoint = rng.choices(endpoints, weights)[0]
+        headers = {}
+        if endpoint == 'shelves':
+            url = f'{base_url}/movies/?category={rng.choice(SHELVES)}'
+        elif endpoint == 'detail':
+            url = f'{base_url}/movies/{rng.choice(movie_ids)}/'
+        elif endpoint == 'streams':
+            url = f'{base_url}/movies/{rng.choice(movie_ids)}/streams/'
+        elif endpoint == 'library':
+            url = f'{base_url}/user/library/'
+            if library_etag:
+                headers['If-None-Match'] = library_etag
+        else:
+            url = f'{base_url}/movies/search/?q={rng.choice(words)}'
+
+        try:
+            response = session.get(url, headers=headers, timeout=30)
+            status = response.status_code
+            if endpoint == 'library' and status == 200:
+                library_etag = response.headers.get('ETag')
+        except requests.RequestException:
+            status = 0
+        finished = time.perf_counter()
+        if now >= warmup_until:
+            samples.append((endpoint, status, (finished - now) * 1000, finished - started_at))
+
+
+def run_process(base_url, clients, movie_ids, words, warmup, duration, seed):
+    """Группа клиентов в потоках одного процесса (GIL ограничивает число клиентов на процесс)"""
+    started_at = time.perf_counter()
+    warmup_until = started_at + warmup
+    stop_at = warmup_until + duration
+    samples = []
+    threads = [
+        threading.Thread(target=run_client, args=(
+            base_url, init_data, movie_ids, words, started_at, warmup_until, stop_at, samples, seed + index
+        ))
+        for index, init_data in enumerate(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def percentile(timings, share):
+    return timings[max(int(len(timings) * share) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный тест API: N одновременных клиентов мини-приложения (полки, карточка, '
+        'потоки, библиотека, поиск) без пауз между запросами. Выводит пропускную '
+        'способность и задержки p50/p99 по эндпоинтам. Клиенты входят как синтетические '
+        f'пользователи Telegram (telegram_id от {TELEGRAM_ID_BASE}) с initData, подписанным '
+        'TELEGRAM_BOT_TOKEN, — у сервера должен быть тот же токен.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api')
+        parser.add_argument('--clients', type=int, default=500)
+        parser.add_argument('--duration', type=int, default=30, help='Длительность замера (сек)')
+        parser.add_argument('--warmup', type=int, default=5, help='Прогрев без замеров (сек)')
+        parser.add_argument('--processes', type=int, default=4, help='Процессов генератора нагрузки')
+        parser.add_argument(
+            '--cleanup', action='store_true', help='Удалить синтетических пользователей после теста'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise CommandError('TELEGRAM_BOT_TOKEN не настроен')
+
+        movie_ids = list(Movie.objects.filter(is_active=True).order_by('-views_count').values_list('id', flat=True)[:1000])
+        if not movie_ids:
+            raise CommandError('В каталоге нет активных фильмов')
+        words = sorted({
+            word for title in Movie.objects.filter(pk__in=movie_ids).values_list('title', flat=True)
+            for word in title.split() if len(word) >= 3
+        }) or ['фильм']
+
+        clients = [
+            sign_init_data(TELEGRAM_ID_BASE + index, settings.TELEGRAM_BOT_TOKEN)
+            for index in range(options['clients'])
+        ]
+        processes = max(1, min(options['processes'], len(clients)))
+        base_url = options['url'].rstrip('/')
+        self.stdout.write(
+            f"Клиентов: {len(clients)}  процессов: {processes}  "
+            f"прогрев: {options['warmup']} с  замер: {options['duration']} с  {base_url}"
+        )
+
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.starmap(run_process, [
+                (base_url, clients[index::processes], movie_ids, words,
+                 options['warmup'], options['duration'], index * len(clients))
+                for index in range(processes)
+            ])
+
+        by_endpoint = defaultdict(list)
+        for samples in results:
+            for endpoint, status, latency, _ in samples:
+                by_endpoint[endpoint].append((status, latency))
+        by_endpoint['total'] = [sample for samples in by_endpoint.values() for sample in samples]
+
+        duration = options['duration']
+        for endpoint in [name for name, _ in SCENARIO] + ['total']:
+            samples = by_endpoint.get(endpoint)
+            if not samples:
+                continue
+            errors = sum(1 for status, _ in samples if not 200 <= status < 400)
+            timings = sorted(latency for _, latency in samples)
+            self.stdout.write(
+                f'{endpoint:>8}: {len(samples) / duration:8.1f} запр/с  '
+                f'p50: {statistics.median(timings):7.1f} мс  p99: {percentile(timings, 0.99):7.1f} мс  '
+                f'ошибок: {errors}'
+            )
+
+        if options['cleanup']:
+            deleted, _ = get_user_model().objects.filter(
+                telegram_id__gte=TELEGRAM_ID_BASE, telegram_id__lt=TELEGRAM_ID_BASE + len(clients)
+            ).delete()
+            self.stdout.write(f'Удалено записей синтетических пользователей: {deleted}')
+
+        self.stdout.write(self.style.SUCCESS('Готово'))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from movies.ratings import find_rating_drift, rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает с нуля агрегаты оценок фильмов (ratings_sum, ratings_count, our_rating)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать фильмы с расхождениями, ничего не меняя'
+        )
+
+    def handle(self, *args, **options):
+        drifted = find_rating_drift()
+        for movie in drifted[:50]:
+            self.stdout.write(
+                f'{movie}: сумма {movie.ratings_sum} -> {movie.actual_sum}, '
+                f'количество {movie.ratings_count} -> {movie.actual_count}'
+            )
+        drift_count = drifted.count()
+        self.stdout.write(f'Фильмов с расхождениями: {drift_count}')
+
+        if options['check']:
+            return
+
+        updated = rebuild_rating_aggregates()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано фильмов: {updated}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from movies.search import update_search_vectors
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает поисковые документы фильмов (Movie.search_vector)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Movie.objects.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            update_search_vectors(Movie.objects.filter(pk__in=batch))
+            self.stdout.write(f'Обработано фильмов: {start + len(batch)}/{len(ids)}')
+
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс пересобран'))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from movies.models import Movie
+from movies.suggest import rebuild_movie_terms
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ключи автодополнения (SuggestTerm) для всех фильмов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        ids = list(Movie.objects.order_by('pk').values_list('pk', flat=True))
+
+        for start in range(0, len(ids), batch_size):
+            batch = Movie.objects.filter(pk__in=ids[start:start + batch_size]).only(
+                'title', 'original_title', 'director', 'cast'
+            )
+            rebuild_movie_terms(batch)
+            self.stdout.write(f'Обработано фильмов: {min(start + batch_size, len(ids))}/{len(ids)}')
+
+        self.stdout.write(self.style.SUCCESS('Индекс автодополнения пересобран'))
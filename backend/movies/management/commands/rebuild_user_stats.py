@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from movies.user_stats import find_stats_drift, rebuild_all_user_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает с нуля статистику пользователей (UserStats) по истории, избранному и оценкам'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать пользователей с расхождениями, ничего не меняя'
+        )
+
+    def handle(self, *args, **options):
+        drift = find_stats_drift()
+        for user_id, stored, expected in drift[:50]:
+            self.stdout.write(f'Пользователь {user_id}: сохранено {stored}, фактически {expected}')
+        self.stdout.write(f'Пользователей с расхождениями: {len(drift)}')
+
+        if options['check']:
+            return
+
+        rebuilt = rebuild_all_user_stats()
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано пользователей: {rebuilt}'))
@@ -0,0 +1,48 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from movies.models import Review
+from movies.review_votes import find_vote_drift, rebuild_vote_counts
+
+
+class Command(BaseCommand):
+    help = 'Сверяет счетчики лайков/дизлайков отзывов с ReviewLike и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Только показать отзывы с расхождениями, ничего не меняя'
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Работать постоянно, повторяя сверку каждые REVIEW_VOTES_RECONCILE_INTERVAL секунд'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            self.reconcile(options['check'])
+
+            if not options['loop']:
+                break
+            time.sleep(settings.REVIEW_VOTES_RECONCILE_INTERVAL)
+
+    def reconcile(self, check_only):
+        drifted = list(find_vote_drift())
+        for review in drifted[:50]:
+            self.stdout.write(
+                f'Отзыв {review.pk}: лайки {review.likes_count} -> {review.actual_likes}, '
+                f'дизлайки {review.dislikes_count} -> {review.actual_dislikes}'
+            )
+
+        if not drifted:
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+        elif check_only:
+            self.stdout.write(self.style.WARNING(f'Отзывов с расхождениями: {len(drifted)}'))
+        else:
+            # Пересчет в UPDATE, а не по найденным значениям: голоса могли измениться после выборки
+            updated = rebuild_vote_counts(Review.objects.filter(pk__in=[review.pk for review in drifted]))
+            self.stdout.write(self.style.SUCCESS(f'Исправлено отзывов: {updated}'))
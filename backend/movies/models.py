@@ -1,5 +1,7 @@
+from django.conf import settings
 from django.db import models
-from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -16,6 +18,9 @@ class Genre(models.Model):
 
 
 class Movie(models.Model):
+    # Минимум пользовательских оценок, после которого считается наш рейтинг
+    MIN_RATINGS_FOR_OUR_RATING = 5
+    
     MOVIE_TYPES = [
         ('movie', 'Фильм'),
         ('series', 'Сериал'),
@@ -49,6 +54,7 @@ class Movie(models.Model):
     kinopoisk_rating = models.FloatField(null=True, blank=True, validators=[MinValueValidator(0), MaxValueValidator(10)])
     our_rating = models.FloatField(null=True, blank=True, verbose_name='Наш рейтинг')
     ratings_count = models.PositiveIntegerField(default=0, verbose_name='Количество оценок')
+    ratings_sum = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
     
     # Изображения
     poster_url = models.URLField(blank=True, verbose_name='Постер')
@@ -81,6 +87,11 @@ class Movie(models.Model):
     # Статистика
     views_count = models.PositiveIntegerField(default=0, verbose_name='Количество просмотров')
     favorites_count = models.PositiveIntegerField(default=0, verbose_name='Добавлений в избранное')
+    # Логарифм затухающей суммы просмотров (см. movies.trending)
+    trending_score = models.FloatField(default=0, editable=False, verbose_name='Трендовость')
+    
+    # Поисковый документ (см. movies.search)
+    search_vector = SearchVectorField(null=True, editable=False)
     
     # Системные поля
     is_featured = models.BooleanField(default=False, verbose_name='Рекомендуемый')
@@ -102,24 +113,23 @@ class Movie(models.Model):
     @property
     def average_user_rating(self):
         """Средний рейтинг пользователей"""
-        ratings = self.user_ratings.all()
-        if ratings:
-            return sum(r.rating for r in ratings) / len(ratings)
+        if self.ratings_count:
+            return self.ratings_sum / self.ratings_count
         return None
     
     def update_our_rating(self):
-        """Обновляет наш рейтинг на основе пользовательских оценок"""
-        user_ratings = self.user_ratings.all()
-        if user_ratings.count() >= 5:  # Минимум 5 оценок
-            avg_rating = sum(r.rating for r in user_ratings) / user_ratings.count()
-            self.our_rating = round(avg_rating, 1)
-            self.ratings_count = user_ratings.count()
-            self.save(update_fields=['our_rating', 'ratings_count'])
+        """
+        Пересчитывает агрегаты оценок с нуля. В обычном режиме они поддерживаются
+        инкрементально (см. movies.ratings), метод нужен для исправления расхождений.
+        """
+        from .ratings import rebuild_rating_aggregates
+        rebuild_rating_aggregates(Movie.objects.filter(pk=self.pk))
+        self.refresh_from_db(fields=['our_rating', 'ratings_count', 'ratings_sum'])
     
     def increment_views(self):
-        """Увеличить счетчик просмотров"""
-        self.views_count += 1
-        self.save(update_fields=['views_count'])
+        """Учесть просмотр (попадет в views_count и trending_score при следующем сбросе счетчиков)"""
+        from .view_counter import record_view
+        record_view(self.pk)
     
     class Meta:
         verbose_name = 'Фильм'
@@ -131,6 +141,12 @@ class Movie(models.Model):
             models.Index(fields=['views_count']),
             models.Index(fields=['is_featured']),
             models.Index(fields=['movie_type']),
+            GinIndex(fields=['search_vector']),
+            # Keyset-пагинация каталога (см. movies.pagination)
+            models.Index(fields=['-created_at', '-id']),
+            models.Index(fields=['-views_count', '-our_rating', '-id']),
+            models.Index(fields=['-our_rating', '-id']),
+            models.Index(fields=['-trending_score', '-id']),
         ]
 
 
@@ -166,8 +182,37 @@ class MovieStream(models.Model):
         ordering = ['-priority', 'quality']
 
 
+class SuggestTerm(models.Model):
+    """Ключ автодополнения фильма (см. movies.suggest)"""
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='suggest_terms')
+    # Collation "C" позволяет искать по префиксу обычным btree-индексом
+    key = models.CharField(max_length=255, db_collation='C', db_index=True)
+    weight = models.FloatField(default=1.0)
+    text = models.CharField(max_length=255, verbose_name='Исходный текст')
+    
+    class Meta:
+        verbose_name = 'Ключ автодополнения'
+        verbose_name_plural = 'Ключи автодополнения'
+
+
+class SimilarMovie(models.Model):
+    """Предрассчитанные похожие фильмы (см. movies.similarity)"""
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='neighbors')
+    similar = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='similar_for')
+    score = models.FloatField(verbose_name='Близость')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место в списке')
+    
+    class Meta:
+        unique_together = ['movie', 'similar']
+        verbose_name = 'Похожий фильм'
+        verbose_name_plural = 'Похожие фильмы'
+        indexes = [
+            models.Index(fields=['movie', 'rank']),
+        ]
+
+
 class UserFavorite(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -175,10 +220,13 @@ class UserFavorite(models.Model):
         unique_together = ['user', 'movie']
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
 
 
 class WatchHistory(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     progress = models.PositiveIntegerField(default=0, verbose_name='Прогресс (секунды)')
     season = models.PositiveIntegerField(null=True, blank=True)
@@ -189,11 +237,14 @@ class WatchHistory(models.Model):
         unique_together = ['user', 'movie', 'season', 'episode']
         verbose_name = 'История просмотров'
         verbose_name_plural = 'История просмотров'
+        indexes = [
+            models.Index(fields=['user', '-watched_at', '-id']),
+        ]
         ordering = ['-watched_at']
 
 
 class Review(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='reviews')
     rating = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(10)])
     title = models.CharField(max_length=200, verbose_name='Заголовок отзыва')
@@ -201,6 +252,9 @@ class Review(models.Model):
     is_spoiler = models.BooleanField(default=False, verbose_name='Содержит спойлеры')
     likes_count = models.PositiveIntegerField(default=0, verbose_name='Лайки')
     dislikes_count = models.PositiveIntegerField(default=0, verbose_name='Дизлайки')
+    # Нижняя граница доверительного интервала Уилсона для доли лайков;
+    # обновляется вместе со счетчиками голосов (см. movies.review_votes)
+    helpful_rank = models.FloatField(default=0, editable=False, verbose_name='Полезность (Уилсон)')
     is_verified = models.BooleanField(default=False, verbose_name='Проверенный отзыв')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -220,12 +274,59 @@ class Review(models.Model):
         unique_together = ['user', 'movie']
         verbose_name = 'Отзыв'
         verbose_name_plural = 'Отзывы'
+        indexes = [
+            models.Index(fields=['movie', '-created_at', '-id']),
+            models.Index(fields=['movie', '-helpful_rank', '-id']),
+            # Выдача без спойлеров идет по частичным индексам, без фильтрации строк
+            models.Index(
+                fields=['movie', '-created_at', '-id'], condition=models.Q(is_spoiler=False),
+                name='review_no_spoiler_recent',
+            ),
+            models.Index(
+                fields=['movie', '-helpful_rank', '-id'], condition=models.Q(is_spoiler=False),
+                name='review_no_spoiler_helpful',
+            ),
+        ]
         ordering = ['-created_at']
 
 
+class MovieReviewStats(models.Model):
+    """Гистограмма оценок отзывов фильма (поддерживается сигналами Review)"""
+    movie = models.OneToOneField(Movie, on_delete=models.CASCADE, primary_key=True, related_name='review_stats')
+    reviews_count = models.PositiveIntegerField(default=0, verbose_name='Количество отзывов')
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    rating_6 = models.PositiveIntegerField(default=0)
+    rating_7 = models.PositiveIntegerField(default=0)
+    rating_8 = models.PositiveIntegerField(default=0)
+    rating_9 = models.PositiveIntegerField(default=0)
+    rating_10 = models.PositiveIntegerField(default=0)
+    
+    def distribution(self):
+        return {str(i): getattr(self, f'rating_{i}') for i in range(1, 11)}
+    
+    def as_dict(self):
+        """Формат поля reviews_stats в MovieDetailSerializer"""
+        if not self.reviews_count:
+            return {'total': 0, 'average_rating': 0, 'rating_distribution': {}}
+        return {
+            'total': self.reviews_count,
+            'average_rating': round(self.rating_sum / self.reviews_count, 1),
+            'rating_distribution': self.distribution()
+        }
+    
+    class Meta:
+        verbose_name = 'Статистика отзывов'
+        verbose_name_plural = 'Статистика отзывов'
+
+
 class ReviewLike(models.Model):
     """Лайки/дизлайки отзывов"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     review = models.ForeignKey(Review, on_delete=models.CASCADE, related_name='votes')
     is_like = models.BooleanField()  # True = лайк, False = дизлайк
     created_at = models.DateTimeField(auto_now_add=True)
@@ -238,7 +339,7 @@ class ReviewLike(models.Model):
 
 class MovieRating(models.Model):
     """Отдельная модель для рейтингов (без обязательного отзыва)"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='user_ratings')
     rating = models.PositiveIntegerField(validators=[MinValueValidator(1), MaxValueValidator(10)])
     created_at = models.DateTimeField(auto_now_add=True)
@@ -252,7 +353,7 @@ class MovieRating(models.Model):
 
 class WatchLater(models.Model):
     """Список "Смотреть позже" """
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -260,6 +361,9 @@ class WatchLater(models.Model):
         unique_together = ['user', 'movie']
         verbose_name = 'Смотреть позже'
         verbose_name_plural = 'Смотреть позже'
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id']),
+        ]
         ordering = ['-created_at']
 
 
@@ -267,7 +371,9 @@ class MovieCollection(models.Model):
     """Коллекции фильмов"""
     name = models.CharField(max_length=200, verbose_name='Название коллекции')
     description = models.TextField(blank=True, verbose_name='Описание')
-    movies = models.ManyToManyField(Movie, blank=True, verbose_name='Фильмы')
+    # Состав и порядок — в CollectionMovie (collection.entries).
+    # Число активных фильмов поддерживается сигналами (см. movies.collection_counts)
+    movies_count = models.PositiveIntegerField(default=0, editable=False, verbose_name='Фильмов')
     is_featured = models.BooleanField(default=False, verbose_name='Рекомендуемая')
     poster_url = models.URLField(blank=True, verbose_name='Постер коллекции')
     created_at = models.DateTimeField(auto_now_add=True)
@@ -281,6 +387,23 @@ class MovieCollection(models.Model):
         ordering = ['-created_at']
 
 
+class CollectionMovie(models.Model):
+    """Фильм в коллекции; position задает порядок показа"""
+    collection = models.ForeignKey(MovieCollection, on_delete=models.CASCADE, related_name='entries')
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    position = models.PositiveIntegerField(default=0, verbose_name='Позиция')
+    added_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ['collection', 'movie']
+        verbose_name = 'Фильм коллекции'
+        verbose_name_plural = 'Фильмы коллекций'
+        ordering = ['position', 'id']
+        indexes = [
+            models.Index(fields=['collection', 'position', 'id']),
+        ]
+
+
 class UserMovieStatus(models.Model):
     """Статус просмотра фильма пользователем"""
     STATUS_CHOICES = [
@@ -291,7 +414,7 @@ class UserMovieStatus(models.Model):
         ('on_hold', 'Отложено'),
     ]
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -303,9 +426,31 @@ class UserMovieStatus(models.Model):
         verbose_name_plural = 'Статусы просмотра'
 
 
+class LibraryChange(models.Model):
+    """
+    Время последнего изменения элемента библиотеки пользователя, в том
+    числе удаления (last-writer-wins при синхронизации, см. movies.library_sync)
+    """
+    FIELD_CHOICES = [
+        ('favorite', 'Избранное'),
+        ('watch_later', 'Смотреть позже'),
+        ('rating', 'Оценка'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
+    field = models.CharField(max_length=20, choices=FIELD_CHOICES)
+    changed_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ['user', 'movie', 'field']
+        verbose_name = 'Изменение библиотеки'
+        verbose_name_plural = 'Изменения библиотеки'
+
+
 class MovieRecommendation(models.Model):
     """Персональные рекомендации"""
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
     score = models.FloatField(verbose_name='Оценка рекомендации')
     reason = models.CharField(max_length=200, verbose_name='Причина рекомендации')
@@ -316,4 +461,45 @@ class MovieRecommendation(models.Model):
         unique_together = ['user', 'movie']
         verbose_name = 'Рекомендация'
         verbose_name_plural = 'Рекомендации'
-        ordering = ['-score', '-created_at']
\ No newline at end of file
+        ordering = ['-score', '-created_at']
+
+
+class UserStats(models.Model):
+    """Статистика пользователя (поддерживается сигналами, см. movies.user_stats)"""
+    FAVORITE_GENRE_RATING = 7
+    
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='movie_stats')
+    watched_count = models.PositiveIntegerField(default=0, verbose_name='Записей в истории')
+    favorites_count = models.PositiveIntegerField(default=0, verbose_name='В избранном')
+    ratings_count = models.PositiveIntegerField(default=0, verbose_name='Оценок')
+    ratings_sum = models.PositiveIntegerField(default=0, verbose_name='Сумма оценок')
+    watch_time = models.PositiveBigIntegerField(default=0, verbose_name='Время просмотра (секунды)')
+    # {genre_id: число оценок >= FAVORITE_GENRE_RATING фильмам жанра}
+    genre_counts = models.JSONField(default=dict, blank=True, verbose_name='Высокие оценки по жанрам')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def favorite_genres(self, limit=5):
+        """[(genre_id, count), ...] по убыванию числа высоких оценок"""
+        counts = sorted(
+            ((int(genre_id), count) for genre_id, count in self.genre_counts.items() if count > 0),
+            key=lambda item: (-item[1], item[0])
+        )
+        return counts[:limit]
+    
+    def as_dict(self, genre_names):
+        """Формат ответа /api/user/stats/"""
+        return {
+            'total_watched': self.watched_count,
+            'total_favorites': self.favorites_count,
+            'total_ratings': self.ratings_count,
+            'average_rating': round(self.ratings_sum / self.ratings_count, 1) if self.ratings_count else 0,
+            'total_watch_time_minutes': self.watch_time // 60,
+            'favorite_genres': [
+                {'name': genre_names.get(genre_id, ''), 'count': count}
+                for genre_id, count in self.favorite_genres()
+            ]
+        }
+    
+    class Meta:
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
@@ -0,0 +1,181 @@
+"""
+Keyset-пагинация (по курсору) для списков API.
+
+Следующая страница выбирается условием «строки после последней строки
+текущей страницы» по всем полям сортировки с добавленным id, поэтому нет
+ни COUNT(*), ни OFFSET, и скорость не зависит от глубины прокрутки.
+Старый постраничный режим доступен по параметру ?pagination=page
+(используется админ-панелью).
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.db import connection
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    mode_query_param = 'pagination'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.delegate = None
+
+        ordering = self.get_ordering(queryset)
+        if request.query_params.get(self.mode_query_param) == 'page' or ordering is None:
+            self.delegate = PageNumberPagination()
+            return self.delegate.paginate_queryset(queryset, request, view)
+
+        self.ordering = ordering
+        queryset = queryset.order_by(*ordering)
+
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded:
+            queryset = queryset.filter(self.after(queryset, self.decode_cursor(encoded)))
+
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.delegate is not None:
+            return self.delegate.get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_ordering(self, queryset):
+        """Поля сортировки queryset с id в конце для однозначности; None — если keyset невозможен"""
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not all(isinstance(field, str) for field in ordering):
+            return None
+
+        if not any(field.lstrip('-') in ('id', 'pk') for field in ordering):
+            descending = not ordering or ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [self.to_cursor_value(getattr(last, field.lstrip('-'))) for field in self.ordering]
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(values))
+
+    def after(self, queryset, values):
+        """
+        Условие «строка идет после values» в порядке self.ordering.
+        PostgreSQL считает NULL больше любого значения: при DESC они первые,
+        при ASC — последние.
+        """
+        if len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        model = queryset.model
+        condition = Q(pk__in=[])
+        equal = Q()
+        coerced = []
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            if name == 'pk':
+                name = 'id'
+            descending = field.startswith('-')
+            value = self.coerce(queryset, name, value)
+            coerced.append(value)
+
+            if value is None:
+                beyond = Q(**{f'{name}__isnull': False}) if descending else Q(pk__in=[])
+                same = Q(**{f'{name}__isnull': True})
+            elif descending:
+                beyond = Q(**{f'{name}__lt': value})
+                same = Q(**{name: value})
+            else:
+                beyond = Q(**{f'{name}__gt': value})
+                if self.is_nullable(model, name):
+                    beyond |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+
+            condition |= equal & beyond
+            equal &= same
+
+        # Граница по первому полю, чтобы БД шла по индексу диапазоном
+        first_field, first_value = self.ordering[0], coerced[0]
+        if first_value is not None and first_field.startswith('-'):
+            condition &= Q(**{f'{first_field[1:]}__lte': first_value})
+        return condition
+
+    def coerce(self, queryset, name, value):
+        """
+        Значение курсора в типе поля сортировки. Курсор приходит от клиента:
+        строка вместо числа или даты и число вне диапазона столбца дали бы
+        ошибку БД, а не 404.
+        """
+        if value is None:
+            return None
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            annotation = queryset.query.annotations.get(name)
+            try:
+                field = annotation.output_field if annotation is not None else None
+            except FieldError:
+                field = None
+        if field is None or isinstance(value, (dict, list)):
+            raise NotFound(self.invalid_cursor_message)
+
+        try:
+            value = field.to_python(value)
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        internal_type = field.get_internal_type()
+        if isinstance(value, int) and internal_type in connection.ops.integer_field_ranges:
+            low, high = connection.ops.integer_field_range(internal_type)
+            if not low <= value <= high:
+                raise NotFound(self.invalid_cursor_message)
+        return value
+
+    def is_nullable(self, model, name):
+        try:
+            return model._meta.get_field(name).null
+        except FieldDoesNotExist:
+            # Аннотации (например, оценка релевантности поиска)
+            return True
+
+    def to_cursor_value(self, value):
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        return value
+
+    def encode_cursor(self, values):
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode_cursor(self, encoded):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list):
+            raise NotFound(self.invalid_cursor_message)
+        return values
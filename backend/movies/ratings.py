@@ -0,0 +1,98 @@
+"""
+Инкрементальные агрегаты пользовательских оценок.
+
+Movie.ratings_sum/ratings_count меняются атомарными дельтами при каждом
+изменении MovieRating, our_rating пересчитывается в том же UPDATE. Если он
+изменился, сбрасываются и полки каталога.
+"""
+from django.db import connection
+from django.db.models import Case, Count, F, FloatField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Cast, Coalesce, Round
+from django.db.models.lookups import GreaterThanOrEqual
+
+from .models import Movie, MovieRating
+
+
+def _our_rating_expression(ratings_sum, ratings_count):
+    """our_rating = среднее, если оценок достаточно, иначе прежнее значение"""
+    return Case(
+        When(
+            GreaterThanOrEqual(ratings_count, Movie.MIN_RATINGS_FOR_OUR_RATING),
+            then=Round(Cast(ratings_sum, FloatField()) / ratings_count, 1),
+        ),
+        default=F('our_rating'),
+    )
+
+
+def apply_rating_delta(movie_id, sum_delta, count_delta):
+    """Применяет изменение суммы и числа оценок фильма одним UPDATE. True, если изменился our_rating."""
+    return movie_id in apply_rating_deltas({movie_id: (sum_delta, count_delta)})
+
+
+def apply_rating_deltas(deltas):
+    """
+    То же для многих фильмов одним UPDATE: {movie_id: (дельта суммы, дельта числа)}.
+    Возвращает id фильмов, у которых изменился our_rating (от него зависят полки и сортировка).
+    """
+    deltas = {movie_id: delta for movie_id, delta in deltas.items() if any(delta)}
+    if not deltas:
+        return set()
+
+    table = Movie._meta.db_table
+    new_sum = f'{table}.ratings_sum + d.sum_delta'
+    new_count = f'{table}.ratings_count + d.count_delta'
+    with connection.cursor() as cursor:
+        # Прежний our_rating читается под той же блокировкой строки, что и UPDATE
+        cursor.execute(
+            f"""
+            UPDATE {table} SET
+                ratings_sum = {new_sum},
+                ratings_count = {new_count},
+                our_rating = CASE
+                    WHEN {new_count} >= %s THEN ROUND(({new_sum})::numeric / ({new_count}), 1)
+                    ELSE {table}.our_rating
+                END
+            FROM unnest(%s::bigint[], %s::integer[], %s::integer[]) AS d(id, sum_delta, count_delta)
+            JOIN (SELECT id, our_rating FROM {table} WHERE id = ANY(%s) FOR UPDATE) old ON old.id = d.id
+            WHERE {table}.id = d.id
+            RETURNING {table}.id, {table}.our_rating IS DISTINCT FROM old.our_rating
+            """,
+            [
+                Movie.MIN_RATINGS_FOR_OUR_RATING,
+                list(deltas),
+                [sum_delta for sum_delta, _ in deltas.values()],
+                [count_delta for _, count_delta in deltas.values()],
+                list(deltas),
+            ],
+        )
+        return {movie_id for movie_id, changed in cursor.fetchall() if changed}
+
+
+def rebuild_rating_aggregates(queryset=None):
+    """Пересчитывает агрегаты с нуля по MovieRating. Возвращает число обновленных фильмов."""
+    if queryset is None:
+        queryset = Movie.objects.all()
+
+    stats = MovieRating.objects.filter(movie=OuterRef('pk')).values('movie')
+    ratings_sum = Coalesce(Subquery(stats.annotate(total=Sum('rating')).values('total')), Value(0))
+    ratings_count = Coalesce(Subquery(stats.annotate(total=Count('id')).values('total')), Value(0))
+
+    updated = queryset.update(ratings_sum=ratings_sum, ratings_count=ratings_count)
+    queryset.filter(ratings_count__gte=Movie.MIN_RATINGS_FOR_OUR_RATING).update(
+        our_rating=_our_rating_expression(F('ratings_sum'), F('ratings_count'))
+    )
+    return updated
+
+
+def find_rating_drift(queryset=None):
+    """Фильмы, у которых сохраненные агрегаты расходятся с MovieRating"""
+    if queryset is None:
+        queryset = Movie.objects.all()
+
+    stats = MovieRating.objects.filter(movie=OuterRef('pk')).values('movie')
+    return queryset.annotate(
+        actual_sum=Coalesce(Subquery(stats.annotate(total=Sum('rating')).values('total')), Value(0)),
+        actual_count=Coalesce(Subquery(stats.annotate(total=Count('id')).values('total')), Value(0)),
+    ).exclude(
+        ratings_sum=F('actual_sum'), ratings_count=F('actual_count')
+    )
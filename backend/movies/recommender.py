@@ -0,0 +1,257 @@
+"""
+Пакетный расчет персональных рекомендаций (item-item коллаборативная фильтрация).
+
+Из истории просмотров, оценок, избранного и «Смотреть позже» строится
+разреженная матрица взаимодействий пользователь x фильм. Близость фильмов —
+косинус столбцов этой матрицы, для каждого фильма хранится только top-M
+соседей. Оценка кандидата для пользователя — сумма близостей к фильмам,
+с которыми он взаимодействовал, с их весами. Пользователи обрабатываются
+пачками, результат (top-N на пользователя) пишется в MovieRecommendation,
+откуда его читает user_recommendations.
+"""
+import itertools
+import time
+
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.utils import timezone
+
+from .models import (
+    Movie, MovieRating, MovieRecommendation, UserFavorite, WatchHistory, WatchLater
+)
+
+TOP_N = 20
+# Сколько соседей хранить на фильм в матрице близости
+NEIGHBORS = 50
+USER_CHUNK_SIZE = 1000
+INTERACTION_CHUNK_SIZE = 100000
+ITEM_CHUNK_SIZE = 2000
+
+WATCHED_WEIGHT = 1.0
+WATCH_LATER_WEIGHT = 1.0
+FAVORITE_WEIGHT = 3.0
+# Оценка 10 дает +2, оценка 5 — ноль, низкие оценки — отрицательный вес
+RATING_NEUTRAL = 5
+RATING_SCALE = 2.5
+
+
+def iter_interactions():
+    """(user_id, movie_id, вес) по всем источникам; записи читаются потоком"""
+    watched = WatchHistory.objects.values_list('user_id', 'movie_id').distinct()
+    for user_id, movie_id in watched.iterator(chunk_size=10000):
+        yield user_id, movie_id, WATCHED_WEIGHT
+
+    for user_id, movie_id in WatchLater.objects.values_list('user_id', 'movie_id').iterator(chunk_size=10000):
+        yield user_id, movie_id, WATCH_LATER_WEIGHT
+
+    for user_id, movie_id in UserFavorite.objects.values_list('user_id', 'movie_id').iterator(chunk_size=10000):
+        yield user_id, movie_id, FAVORITE_WEIGHT
+
+    ratings = MovieRating.objects.values_list('user_id', 'movie_id', 'rating')
+    for user_id, movie_id, rating in ratings.iterator(chunk_size=10000):
+        yield user_id, movie_id, (rating - RATING_NEUTRAL) / RATING_SCALE
+
+
+def _merge_blocks(blocks, shape):
+    """
+    Сумма блоков в одну CSR-матрицу. Не через сложение CSR: оно выбрасывает
+    нулевые суммы, а пара с весом 0 (оценка 5) — тоже просмотренный фильм.
+    """
+    blocks = [block.tocoo() for block in blocks]
+    merged = sparse.coo_matrix(
+        (
+            np.concatenate([block.data for block in blocks]),
+            (np.concatenate([block.row for block in blocks]), np.concatenate([block.col for block in blocks])),
+        ),
+        shape=shape,
+    )
+    # Повторы пар суммируются
+    return merged.tocsr()
+
+
+def build_interaction_matrix(interactions, chunk_size=INTERACTION_CHUNK_SIZE):
+    """
+    CSR-матрица весов (пользователи x фильмы), id пользователей и фильмов по
+    строкам и столбцам. Веса одной пары суммируются; в матрице остаются и
+    отрицательные суммы — по ним фильм исключается из рекомендаций.
+
+    Взаимодействия читаются пачками по chunk_size, каждая сразу сворачивается
+    в разреженный блок. Блоки вливаются в матрицу, когда их набирается столько
+    же, сколько в ней ненулевых: память растет с числом различных пар, а не
+    со всей таблицей взаимодействий.
+    """
+    user_index, movie_index = {}, {}
+    matrix, pending, pending_nnz = None, [], 0
+    interactions = iter(interactions)
+    while chunk := list(itertools.islice(interactions, chunk_size)):
+        rows = np.fromiter(
+            (user_index.setdefault(user_id, len(user_index)) for user_id, _, _ in chunk),
+            dtype=np.int32, count=len(chunk),
+        )
+        cols = np.fromiter(
+            (movie_index.setdefault(movie_id, len(movie_index)) for _, movie_id, _ in chunk),
+            dtype=np.int32, count=len(chunk),
+        )
+        weights = np.fromiter((weight for _, _, weight in chunk), dtype=np.float32, count=len(chunk))
+        shape = (len(user_index), len(movie_index))
+        block = sparse.coo_matrix((weights, (rows, cols)), shape=shape).tocsr()
+        pending.append(block)
+        pending_nnz += block.nnz
+        if matrix is None or pending_nnz >= matrix.nnz:
+            matrix = _merge_blocks([block for block in (matrix, *pending) if block is not None], shape)
+            pending, pending_nnz = [], 0
+
+    shape = (len(user_index), len(movie_index))
+    if matrix is None:
+        matrix = sparse.csr_matrix(shape, dtype=np.float32)
+    elif pending:
+        matrix = _merge_blocks([matrix, *pending], shape)
+    return matrix, np.array(list(user_index), dtype=np.int64), np.array(list(movie_index), dtype=np.int64)
+
+
+def positive_part(matrix):
+    """Только положительные веса (отрицательные не делают фильмы похожими)"""
+    positive = matrix.copy()
+    positive.data = np.maximum(positive.data, 0)
+    positive.eliminate_zeros()
+    return positive
+
+
+def top_per_row(block, k):
+    """Оставляет в каждой строке CSR-матрицы k наибольших значений"""
+    rows, cols, values = [], [], []
+    for row in range(block.shape[0]):
+        start, end = block.indptr[row], block.indptr[row + 1]
+        data, indices = block.data[start:end], block.indices[start:end]
+        if len(data) > k:
+            keep = np.argpartition(-data, k)[:k]
+            data, indices = data[keep], indices[keep]
+        rows.append(np.full(len(data), row))
+        cols.append(indices)
+        values.append(data)
+
+    if not rows:
+        return sparse.csr_matrix(block.shape, dtype=np.float32)
+    return sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))),
+        shape=block.shape,
+    )
+
+
+def item_similarity(positive, neighbors=NEIGHBORS, chunk_size=ITEM_CHUNK_SIZE):
+    """
+    Косинусная близость фильмов (фильмы x фильмы) с top-M соседями на фильм.
+    Считается блоками строк, полная матрица фильмы x фильмы не строится.
+    """
+    norms = np.sqrt(np.asarray(positive.multiply(positive).sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    normalized = sparse.csr_matrix(positive @ sparse.diags(1 / norms), dtype=np.float32)
+    by_item = normalized.T.tocsr()
+
+    blocks = []
+    for start in range(0, by_item.shape[0], chunk_size):
+        block = (by_item[start:start + chunk_size] @ normalized).tocsr()
+        # Фильм не сосед сам себе
+        block = block - sparse.csr_matrix(
+            (block.diagonal(k=start), (np.arange(block.shape[0]), np.arange(block.shape[0]) + start)),
+            shape=block.shape,
+        )
+        block.eliminate_zeros()
+        blocks.append(top_per_row(block, neighbors))
+    return sparse.vstack(blocks, format='csr') if blocks else sparse.csr_matrix((0, 0))
+
+
+def recommend_chunk(interactions, positive, similarity, allowed, top_n=TOP_N):
+    """
+    Для пачки пользователей отдает [(строка пользователя, [(столбец фильма,
+    оценка, столбец фильма-причины), ...]), ...]
+    """
+    scores = (positive @ similarity).tocsr()
+    for row in range(scores.shape[0]):
+        start, end = scores.indptr[row], scores.indptr[row + 1]
+        candidates, values = scores.indices[start:end], scores.data[start:end]
+
+        seen = interactions.indices[interactions.indptr[row]:interactions.indptr[row + 1]]
+        keep = allowed[candidates] & ~np.isin(candidates, seen) & (values > 0)
+        candidates, values = candidates[keep], values[keep]
+        if not len(candidates):
+            yield row, []
+            continue
+
+        if len(candidates) > top_n:
+            best = np.argpartition(-values, top_n)[:top_n]
+            candidates, values = candidates[best], values[best]
+        order = np.argsort(-values)
+        candidates, values = candidates[order], values[order]
+
+        # Причина — фильм пользователя, который внес наибольший вклад в оценку
+        own_start, own_end = positive.indptr[row], positive.indptr[row + 1]
+        own, own_weights = positive.indices[own_start:own_end], positive.data[own_start:own_end]
+        contributions = similarity[own][:, candidates].toarray() * own_weights[:, None]
+        reasons = own[np.argmax(contributions, axis=0)]
+
+        yield row, list(zip(candidates.tolist(), values.tolist(), reasons.tolist()))
+
+
+def _write_recommendations(recommendations, titles):
+    """Заменяет рекомендации пачки пользователей: {user_id: [(movie_id, score, reason_id), ...]}"""
+    with transaction.atomic():
+        MovieRecommendation.objects.filter(user_id__in=recommendations.keys()).delete()
+        MovieRecommendation.objects.bulk_create(
+            [
+                MovieRecommendation(
+                    user_id=user_id,
+                    movie_id=movie_id,
+                    score=score,
+                    reason=f'Похоже на «{titles.get(reason_id, "")}»'[:200],
+                )
+                for user_id, items in recommendations.items()
+                for movie_id, score, reason_id in items
+            ],
+            batch_size=5000,
+        )
+
+
+def build_recommendations(top_n=TOP_N, neighbors=NEIGHBORS, user_chunk_size=USER_CHUNK_SIZE):
+    """Полный пересчет рекомендаций. Возвращает статистику выполнения."""
+    started = time.perf_counter()
+    run_started_at = timezone.now()
+    interactions, user_ids, movie_ids = build_interaction_matrix(iter_interactions())
+    positive = positive_part(interactions)
+    similarity = item_similarity(positive, neighbors)
+    prepared = time.perf_counter()
+
+    active_ids = set(Movie.objects.filter(is_active=True).values_list('id', flat=True))
+    allowed = np.array([movie_id in active_ids for movie_id in movie_ids.tolist()], dtype=bool)
+    titles = {}
+
+    written = 0
+    for start in range(0, len(user_ids), user_chunk_size):
+        stop = start + user_chunk_size
+        chunk = recommend_chunk(interactions[start:stop], positive[start:stop], similarity, allowed, top_n)
+
+        recommendations = {}
+        reason_ids = set()
+        for row, items in chunk:
+            recommendations[int(user_ids[start + row])] = [
+                (int(movie_ids[col]), score, int(movie_ids[reason])) for col, score, reason in items
+            ]
+            reason_ids.update(int(movie_ids[reason]) for _, _, reason in items)
+
+        missing = reason_ids - titles.keys()
+        titles.update(Movie.objects.filter(pk__in=missing).values_list('id', 'title'))
+        _write_recommendations(recommendations, titles)
+        written += sum(len(items) for items in recommendations.values())
+
+    # Пользователи, у которых больше нет взаимодействий, уходят в холодный старт
+    MovieRecommendation.objects.filter(created_at__lt=run_started_at).delete()
+
+    return {
+        'users': len(user_ids),
+        'movies': len(movie_ids),
+        'interactions': interactions.nnz,
+        'recommendations': written,
+        'prepare_seconds': round(prepared - started, 2),
+        'total_seconds': round(time.perf_counter() - started, 2),
+    }
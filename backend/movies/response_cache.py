@@ -0,0 +1,151 @@
+"""
+Кэш общих (неперсональных) ответов каталога: полок фильмов, жанров, коллекций.
+
+Ответ хранится в CACHES['default'] под ключом из имени представления и
+нормализованных параметров запроса. Каждая запись помечается тегами
+(movie:<id>, genre:<название>, collection:<id>, ...); списки ключей по тегам
+лежат в множествах Redis. Сигналы моделей сбрасывают только записи с
+затронутыми тегами. Персональные поля карточек (is_favorite, user_rating,
+watch_progress) в кэш не попадают и подставляются на каждый запрос; с
+?no_user_fields=1 запись отдается как есть, без обращений к данным пользователя.
+"""
+import copy
+import hashlib
+import logging
+from urllib.parse import urlencode
+
+import redis
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.redis import RedisCache, RedisSerializer
+from rest_framework.response import Response
+
+from cinema.db_router import primary_reads
+from cinema.redis_client import get_async_redis, get_redis
+from .user_state import (
+    PERSONAL_FIELDS, UserMovieState, apply_user_state, wants_user_fields
+)
+
+
+logger = logging.getLogger('cinema')
+
+TAG_KEY = 'cache:tag:{tag}'
+
+# Теги, которыми помечаются все записи определенного вида
+MOVIE_LISTS_TAG = 'movie-lists'
+GENRE_LIST_TAG = 'genre-list'
+COLLECTION_LIST_TAG = 'collection-list'
+
+
+def make_key(prefix, query_params):
+    """Ключ кэша; порядок параметров в запросе не важен"""
+    params = sorted((key, value) for key in query_params for value in query_params.getlist(key))
+    digest = hashlib.md5(urlencode(params).encode()).hexdigest()
+    return f'response:{prefix}:{digest}'
+
+
+def get(key):
+    try:
+        return cache.get(key)
+    except redis.RedisError as e:
+        logger.warning('Кэш ответов недоступен: %s', e)
+        return None
+
+
+async def aget(key):
+    """
+    get() для асинхронных представлений: запись CACHES['default'] читается
+    напрямую асинхронным клиентом Redis (асинхронные методы кэша Django 4.2
+    лишь выполняют синхронные в потоке)
+    """
+    backend = caches['default']
+    if not isinstance(backend, RedisCache):
+        return await backend.aget(key)
+    try:
+        raw = await get_async_redis().get(backend.make_and_validate_key(key))
+    except redis.RedisError as e:
+        logger.warning('Кэш ответов недоступен: %s', e)
+        return None
+    return None if raw is None else RedisSerializer().loads(raw)
+
+
+def store(key, data, tags):
+    try:
+        cache.set(key, data, settings.RESPONSE_CACHE_TTL)
+        pipe = get_redis().pipeline()
+        for tag in tags:
+            tag_key = TAG_KEY.format(tag=tag)
+            pipe.sadd(tag_key, key)
+            # Тег живет дольше записей, чтобы не потерять ключи до их истечения
+            pipe.expire(tag_key, settings.RESPONSE_CACHE_TTL * 2)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Не удалось сохранить ответ в кэш: %s', e)
+
+
+def invalidate(*tags):
+    """Удаляет все записи, помеченные хотя бы одним из тегов"""
+    if not tags:
+        return
+    try:
+        client = get_redis()
+        tag_keys = [TAG_KEY.format(tag=tag) for tag in tags]
+        keys = client.sunion(tag_keys)
+        if keys:
+            cache.delete_many([key.decode() for key in keys])
+        client.delete(*tag_keys)
+    except redis.RedisError as e:
+        logger.warning('Не удалось сбросить кэш по тегам %s: %s', tags, e)
+
+
+def movie_tags(items):
+    """Теги записи со списком карточек фильмов"""
+    tags = {MOVIE_LISTS_TAG}
+    for item in items:
+        tags.add(f"movie:{item['id']}")
+        tags.update(f'genre:{name}' for name in item.get('genres', []))
+    return tags
+
+
+class CachedListMixin:
+    """
+    Кэширует ответ ListAPIView. Представление задает cache_prefix и может
+    переопределить is_cacheable() и get_cache_tags().
+    """
+    cache_prefix = None
+    cache_tags = ()
+    # Ответ содержит карточки фильмов с персональными полями
+    has_user_fields = False
+
+    def is_cacheable(self, request):
+        return True
+
+    def get_cache_tags(self, items):
+        return set(self.cache_tags)
+
+    def list(self, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return super().list(request, *args, **kwargs)
+
+        key = make_key(self.cache_prefix, request.query_params)
+        data = get(key)
+        if data is None:
+            # Запись живет до сброса по тегам, поэтому собирается с основной БД
+            with primary_reads():
+                response = super().list(request, *args, **kwargs)
+            data = copy.deepcopy(response.data)
+            items = self.get_items(data)
+            if self.has_user_fields:
+                for item in items:
+                    for field in PERSONAL_FIELDS:
+                        item.pop(field, None)
+            store(key, data, self.get_cache_tags(items))
+            return response
+
+        if self.has_user_fields and wants_user_fields(request):
+            state = UserMovieState(request.user) if request.user.is_authenticated else None
+            apply_user_state(self.get_items(data), state)
+        return Response(data)
+
+    def get_items(self, data):
+        return data['results'] if isinstance(data, dict) else data
@@ -0,0 +1,79 @@
+"""
+Гистограмма оценок отзывов по фильмам (MovieReviewStats).
+
+Каждое создание, изменение оценки или удаление отзыва меняет нужные
+корзины атомарными дельтами, так что reviews_stats читается одной строкой.
+"""
+from collections import defaultdict
+
+from django.db.models import Count, F
+
+from .models import MovieReviewStats, Review
+
+
+def apply_review_delta(movie_id, old_rating=None, new_rating=None):
+    """Переносит отзыв из корзины old_rating в new_rating (None — отзыва нет)"""
+    if old_rating == new_rating:
+        return
+
+    changes = {}
+    count_delta = 0
+    sum_delta = 0
+    if old_rating is not None:
+        changes[f'rating_{old_rating}'] = F(f'rating_{old_rating}') - 1
+        count_delta -= 1
+        sum_delta -= old_rating
+    if new_rating is not None:
+        changes[f'rating_{new_rating}'] = F(f'rating_{new_rating}') + 1
+        count_delta += 1
+        sum_delta += new_rating
+
+    changes['reviews_count'] = F('reviews_count') + count_delta
+    changes['rating_sum'] = F('rating_sum') + sum_delta
+
+    updated = MovieReviewStats.objects.filter(movie_id=movie_id).update(**changes)
+    if not updated and old_rating is None:
+        # Первый отзыв к фильму: заводим строку и повторяем
+        MovieReviewStats.objects.get_or_create(movie_id=movie_id)
+        MovieReviewStats.objects.filter(movie_id=movie_id).update(**changes)
+    # Без строки убирать нечего: при удалении фильма каскад удаляет ее раньше отзывов
+
+
+def actual_histograms():
+    """Гистограммы, посчитанные GROUP BY по Review: {movie_id: {rating: count}}"""
+    histograms = defaultdict(dict)
+    rows = Review.objects.values('movie_id', 'rating').annotate(total=Count('id')).order_by()
+    for row in rows:
+        histograms[row['movie_id']][row['rating']] = row['total']
+    return histograms
+
+
+def find_histogram_drift():
+    """Список (movie_id, сохраненная гистограмма, фактическая) для расходящихся фильмов"""
+    actual = actual_histograms()
+    drift = []
+
+    stored_ids = set()
+    for stats in MovieReviewStats.objects.iterator():
+        stored_ids.add(stats.movie_id)
+        stored = {i: getattr(stats, f'rating_{i}') for i in range(1, 11)}
+        expected = {i: actual.get(stats.movie_id, {}).get(i, 0) for i in range(1, 11)}
+        expected_sum = sum(rating * count for rating, count in expected.items())
+        if (stored != expected or stats.reviews_count != sum(expected.values())
+                or stats.rating_sum != expected_sum):
+            drift.append((stats.movie_id, stored, expected))
+
+    for movie_id, histogram in actual.items():
+        if movie_id not in stored_ids:
+            expected = {i: histogram.get(i, 0) for i in range(1, 11)}
+            drift.append((movie_id, None, expected))
+
+    return drift
+
+
+def rebuild_histogram(movie_id, histogram):
+    """Перезаписывает гистограмму фильма фактическими значениями"""
+    fields = {f'rating_{i}': histogram.get(i, 0) for i in range(1, 11)}
+    fields['reviews_count'] = sum(histogram.values())
+    fields['rating_sum'] = sum(rating * count for rating, count in histogram.items())
+    MovieReviewStats.objects.update_or_create(movie_id=movie_id, defaults=fields)
@@ -0,0 +1,145 @@
+"""
+Счетчики лайков и дизлайков отзывов (Review.likes_count/dislikes_count).
+
+Каждый голос меняет счетчики атомарными дельтами в сигналах ReviewLike:
+новый голос +1, смена лайка на дизлайк переносит единицу между счетчиками,
+удаление голоса -1. Пересчета COUNT по всем голосам отзыва на каждый клик
+больше нет; расхождения (правки в админке, ручные изменения в БД)
+находит и исправляет команда reconcile_review_votes.
+
+Тем же UPDATE пересчитывается helpful_rank — нижняя граница 95%
+доверительного интервала Уилсона для доли лайков. В отличие от простой
+доли, отзыв с 1 лайком из 1 не обгоняет отзыв с 90 из 100. Поле
+проиндексировано вместе с фильмом, сортировка ?ordering=helpful идет по
+индексу с keyset-пагинацией.
+"""
+import math
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import Review, ReviewLike
+
+# Квантиль нормального распределения для 95% интервала
+WILSON_Z = 1.96
+
+
+def wilson_lower_bound(likes, dislikes):
+    """helpful_rank для заданных счетчиков (то же, что wilson_sql)"""
+    total = likes + dislikes
+    if total == 0:
+        return 0.0
+    z2 = WILSON_Z * WILSON_Z
+    return (
+        likes / total + z2 / (2 * total)
+        - WILSON_Z / total * math.sqrt(likes * dislikes / total + z2 / 4)
+    ) / (1 + z2 / total)
+
+
+def wilson_sql(likes, dislikes):
+    """SQL-выражение helpful_rank по SQL-выражениям счетчиков"""
+    # Счетчики integer: сумма и произведение считаются в float, иначе переполнение int4
+    total = f'(({likes})::float + ({dislikes}))'
+    z2 = WILSON_Z * WILSON_Z
+    return (
+        f'CASE WHEN {total} = 0 THEN 0 ELSE '
+        f'(({likes}) / {total} + {z2} / (2 * {total}) '
+        f'- {WILSON_Z} / {total} * sqrt(({likes})::float * ({dislikes}) / {total} + {z2 / 4})) '
+        f'/ (1 + {z2} / {total}) END'
+    )
+
+
+def _rank_from_columns():
+    table = Review._meta.db_table
+    return RawSQL(wilson_sql(f'{table}.likes_count', f'{table}.dislikes_count'), [])
+
+
+def vote_delta(old_vote, new_vote):
+    """Дельты (лайки, дизлайки) при смене голоса; None — голоса нет"""
+    return (new_vote is True) - (old_vote is True), (new_vote is False) - (old_vote is False)
+
+
+def apply_vote_delta(review_id, likes_delta, dislikes_delta):
+    """
+    Сдвигает счетчики отзыва и пересчитывает helpful_rank одним UPDATE
+    (счетчики не ниже нуля, остальное исправит сверка)
+    """
+    if not likes_delta and not dislikes_delta:
+        return
+    # В SET все столбцы имеют значения до изменения, поэтому новые
+    # счетчики для helpful_rank вычисляются тем же выражением
+    table = Review._meta.db_table
+    likes = f'GREATEST({table}.likes_count + {int(likes_delta)}, 0)'
+    dislikes = f'GREATEST({table}.dislikes_count + {int(dislikes_delta)}, 0)'
+    Review.objects.filter(pk=review_id).update(
+        likes_count=RawSQL(likes, []),
+        dislikes_count=RawSQL(dislikes, []),
+        helpful_rank=RawSQL(wilson_sql(likes, dislikes), []),
+    )
+
+
+def cast_vote(user, review, is_like):
+    """
+    Ставит, меняет или снимает (is_like=None) голос пользователя за отзыв в
+    одной транзакции. Строка голоса блокируется, поэтому параллельные клики
+    одного пользователя не сдвигают счетчики дважды. Возвращает
+    (likes_count, dislikes_count) после изменения.
+    """
+    with transaction.atomic():
+        vote = ReviewLike.objects.select_for_update().filter(user=user, review=review).first()
+        if vote is None and is_like is not None:
+            try:
+                with transaction.atomic():
+                    ReviewLike.objects.create(user=user, review=review, is_like=is_like)
+            except IntegrityError:
+                # Параллельный запрос успел создать голос: работаем с ним
+                vote = ReviewLike.objects.select_for_update().get(user=user, review=review)
+
+        if vote is not None:
+            if is_like is None:
+                vote.delete()
+            elif vote.is_like != is_like:
+                vote.is_like = is_like
+                vote.save(update_fields=['is_like'])
+
+        return Review.objects.filter(pk=review.pk).values_list('likes_count', 'dislikes_count').get()
+
+
+def user_votes(user, review_ids):
+    """Голоса пользователя за набор отзывов одним запросом: {review_id: is_like}"""
+    return dict(
+        ReviewLike.objects.filter(user=user, review_id__in=review_ids).values_list('review_id', 'is_like')
+    )
+
+
+def _actual_counts():
+    """Выражения фактического числа лайков и дизлайков отзыва по ReviewLike"""
+    votes = ReviewLike.objects.filter(review=OuterRef('pk')).values('review')
+
+    def count(is_like):
+        return Coalesce(Subquery(votes.annotate(total=Count('id', filter=Q(is_like=is_like))).values('total')), Value(0))
+
+    return count(True), count(False)
+
+
+def find_vote_drift(queryset=None):
+    """Отзывы, у которых счетчики расходятся с ReviewLike или helpful_rank — со счетчиками"""
+    if queryset is None:
+        queryset = Review.objects.all()
+    actual_likes, actual_dislikes = _actual_counts()
+    return queryset.annotate(
+        actual_likes=actual_likes, actual_dislikes=actual_dislikes, expected_rank=_rank_from_columns()
+    ).exclude(
+        likes_count=F('actual_likes'), dislikes_count=F('actual_dislikes'), helpful_rank=F('expected_rank')
+    )
+
+
+def rebuild_vote_counts(queryset):
+    """Перезаписывает счетчики отзывов фактическими значениями. Возвращает число отзывов."""
+    actual_likes, actual_dislikes = _actual_counts()
+    updated = queryset.update(likes_count=actual_likes, dislikes_count=actual_dislikes)
+    # Отдельным UPDATE: в первом helpful_rank видел бы старые счетчики
+    queryset.update(helpful_rank=_rank_from_columns())
+    return updated
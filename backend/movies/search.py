@@ -0,0 +1,85 @@
+"""
+Полнотекстовый поиск фильмов (PostgreSQL).
+
+У каждого фильма хранится взвешенный поисковый документ Movie.search_vector
+(название > оригинальное название > актеры/режиссер > описание) в русской и
+английской морфологии. Документ обновляется при сохранении фильма, по нему
+построен GIN-индекс. Результаты сортируются по релевантности с поправкой
+на наш рейтинг и популярность.
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db.models import F, FloatField, TextField, Value
+from django.db.models.functions import Cast, Coalesce, Ln
+
+from .models import Movie
+
+
+SEARCH_CONFIGS = ('russian', 'english')
+
+# Поля, при изменении которых нужно пересобрать поисковый документ
+SEARCH_FIELDS = {'title', 'original_title', 'director', 'cast', 'description'}
+
+# Вклад рейтинга и просмотров в итоговую сортировку
+RATING_WEIGHT = 0.3
+POPULARITY_WEIGHT = 0.1
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def build_search_vector():
+    """Выражение взвешенного поискового документа фильма"""
+    vector = None
+    for config in SEARCH_CONFIGS:
+        part = (
+            SearchVector('title', weight='A', config=config)
+            + SearchVector('original_title', weight='B', config=config)
+            + SearchVector('director', Cast('cast', TextField()), weight='C', config=config)
+            + SearchVector('description', weight='D', config=config)
+        )
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def update_search_vectors(queryset):
+    """Пересобирает поисковые документы для фильмов из queryset"""
+    return queryset.update(search_vector=build_search_vector())
+
+
+def build_search_query(text):
+    """
+    Запрос по всем словам строки; последнее слово ищется по префиксу,
+    чтобы результаты появлялись по мере набора
+    """
+    tokens = _TOKEN_RE.findall(text.lower())
+    if not tokens:
+        return None
+
+    terms = [f"'{token}'" for token in tokens[:-1]] + [f"'{tokens[-1]}':*"]
+    raw_query = ' & '.join(terms)
+
+    query = None
+    for config in SEARCH_CONFIGS:
+        part = SearchQuery(raw_query, search_type='raw', config=config)
+        query = part if query is None else query | part
+    return query
+
+
+def search_movies(text, queryset=None):
+    """Фильмы, подходящие под запрос, в порядке релевантности"""
+    if queryset is None:
+        queryset = Movie.objects.filter(is_active=True)
+
+    query = build_search_query(text)
+    if query is None:
+        return queryset.none()
+
+    rating_boost = Value(1.0) + RATING_WEIGHT * Coalesce('our_rating', Value(0.0)) / Value(10.0)
+    popularity_boost = Value(1.0) + POPULARITY_WEIGHT * Ln(Cast(F('views_count') + 1, FloatField()))
+
+    return queryset.filter(search_vector=query).annotate(
+        relevance=SearchRank(F('search_vector'), query),
+    ).annotate(
+        search_score=F('relevance') * rating_boost * popularity_boost,
+    ).order_by('-search_score', '-id')
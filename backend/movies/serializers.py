@@ -1,9 +1,12 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
+from django.db import models
 from .models import (
     Movie, Genre, MovieStream, UserFavorite, WatchHistory, Review,
-    MovieRating, WatchLater, MovieCollection, ReviewLike, UserMovieStatus
+    MovieRating, WatchLater, MovieCollection, UserMovieStatus,
+    MovieReviewStats
 )
+from .review_votes import user_votes
+from .user_state import PERSONAL_FIELDS, get_user_state, wants_user_fields, watch_progress_data
 
 
 class GenreSerializer(serializers.ModelSerializer):
@@ -18,6 +21,22 @@ class MovieStreamSerializer(serializers.ModelSerializer):
         fields = ['id', 'url', 'quality', 'season', 'episode', 'priority']
 
 
+class UserStateListSerializer(serializers.ListSerializer):
+    """
+    Список, который заранее загружает персональные данные пользователя
+    для всех фильмов страницы (см. movies.user_state)
+    """
+    
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
+        
+        state = get_user_state(self.context)
+        if state is not None:
+            state.load(self.child.get_state_movie_id(item) for item in items)
+        
+        return super().to_representation(items)
+
+
 class MovieListSerializer(serializers.ModelSerializer):
     genres = serializers.StringRelatedField(many=True, read_only=True)
     is_favorite = serializers.SerializerMethodField()
@@ -32,37 +51,35 @@ class MovieListSerializer(serializers.ModelSerializer):
             'duration', 'available_quality', 'views_count', 'favorites_count',
             'is_favorite', 'user_rating', 'watch_progress', 'age_rating'
         ]
+        list_serializer_class = UserStateListSerializer
     
-    def get_is_favorite(self, obj):
+    def get_fields(self):
+        fields = super().get_fields()
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return UserFavorite.objects.filter(user=request.user, movie=obj).exists()
+        if request is not None and not wants_user_fields(request):
+            for name in PERSONAL_FIELDS:
+                fields.pop(name)
+        return fields
+    
+    def get_state_movie_id(self, obj):
+        return obj.pk
+    
+    def get_is_favorite(self, obj):
+        state = get_user_state(self.context)
+        if state is not None:
+            return state.is_favorite(obj.pk)
         return False
     
     def get_user_rating(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                rating = MovieRating.objects.get(user=request.user, movie=obj)
-                return rating.rating
-            except MovieRating.DoesNotExist:
-                pass
+        state = get_user_state(self.context)
+        if state is not None:
+            return state.get_rating(obj.pk)
         return None
     
     def get_watch_progress(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                history = WatchHistory.objects.filter(user=request.user, movie=obj).first()
-                if history:
-                    return {
-                        'progress': history.progress,
-                        'season': history.season,
-                        'episode': history.episode,
-                        'percentage': (history.progress / (obj.duration * 60) * 100) if obj.duration else 0
-                    }
-            except WatchHistory.DoesNotExist:
-                pass
+        state = get_user_state(self.context)
+        if state is not None:
+            return watch_progress_data(state.get_progress(obj.pk), obj.duration)
         return None
 
 
@@ -123,34 +140,40 @@ class MovieDetailSerializer(serializers.ModelSerializer):
         return False
     
     def get_similar(self, obj):
-        # Улучшенный алгоритм поиска похожих фильмов
+        # Соседи, предрассчитанные командой compute_similar_movies
+        similar_movies = Movie.objects.filter(
+            similar_for__movie=obj, is_active=True
+        ).prefetch_related('genres').order_by('similar_for__rank')[:8]
+        if similar_movies:
+            return MovieListSerializer(similar_movies, many=True, context=self.context).data
+        
+        # Фильм еще не обработан: подбираем по жанрам и году
         similar_movies = Movie.objects.filter(
             genres__in=obj.genres.all(),
             is_active=True,
             year__range=(obj.year - 5, obj.year + 5)  # Похожие по году
-        ).exclude(id=obj.id).distinct().order_by('-our_rating')[:8]
+        ).exclude(id=obj.id).distinct().prefetch_related('genres').order_by('-our_rating')[:8]
         
         return MovieListSerializer(similar_movies, many=True, context=self.context).data
     
     def get_reviews_stats(self, obj):
-        reviews = obj.reviews.all()
-        total_reviews = reviews.count()
-        
-        if total_reviews == 0:
+        try:
+            return obj.review_stats.as_dict()
+        except MovieReviewStats.DoesNotExist:
             return {'total': 0, 'average_rating': 0, 'rating_distribution': {}}
+
+
+class ReviewVoteListSerializer(serializers.ListSerializer):
+    """Список отзывов, который загружает голоса пользователя за всю страницу одним запросом"""
+    
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.Manager) else data)
         
-        # Распределение оценок
-        rating_distribution = {}
-        for i in range(1, 11):
-            rating_distribution[str(i)] = reviews.filter(rating=i).count()
-        
-        average_rating = sum(r.rating for r in reviews) / total_reviews
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            self.context['user_votes'] = user_votes(request.user, [review.pk for review in items])
         
-        return {
-            'total': total_reviews,
-            'average_rating': round(average_rating, 1),
-            'rating_distribution': rating_distribution
-        }
+        return super().to_representation(items)
 
 
 class ReviewDetailSerializer(serializers.ModelSerializer):
@@ -167,6 +190,7 @@ class ReviewDetailSerializer(serializers.ModelSerializer):
             'is_verified', 'created_at', 'updated_at', 'user_vote'
         ]
         read_only_fields = ['user_name', 'user_avatar', 'helpful_score', 'created_at', 'updated_at']
+        list_serializer_class = ReviewVoteListSerializer
     
     def get_user_avatar(self, obj):
         # Генерируем аватар на основе имени пользователя
@@ -174,13 +198,13 @@ class ReviewDetailSerializer(serializers.ModelSerializer):
     
     def get_user_vote(self, obj):
         request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            try:
-                vote = ReviewLike.objects.get(user=request.user, review=obj)
-                return vote.is_like
-            except ReviewLike.DoesNotExist:
-                pass
-        return None
+        if not request or not request.user.is_authenticated:
+            return None
+        votes = self.context.get('user_votes')
+        if votes is None:
+            # Одиночный отзыв (создание) — без пакетной загрузки
+            votes = user_votes(request.user, [obj.pk])
+        return votes.get(obj.pk)
 
 
 class ReviewSerializer(serializers.ModelSerializer):
@@ -202,6 +226,10 @@ class WatchHistorySerializer(serializers.ModelSerializer):
     class Meta:
         model = WatchHistory
         fields = ['id', 'movie', 'progress', 'season', 'episode', 'watched_at', 'watch_percentage']
+        list_serializer_class = UserStateListSerializer
+    
+    def get_state_movie_id(self, obj):
+        return obj.movie_id
     
     def get_watch_percentage(self, obj):
         if obj.movie.duration and obj.progress:
@@ -215,6 +243,10 @@ class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = UserFavorite
         fields = ['id', 'movie', 'created_at']
+        list_serializer_class = UserStateListSerializer
+    
+    def get_state_movie_id(self, obj):
+        return obj.movie_id
 
 
 class WatchLaterSerializer(serializers.ModelSerializer):
@@ -223,14 +255,13 @@ class WatchLaterSerializer(serializers.ModelSerializer):
     class Meta:
         model = WatchLater
         fields = ['id', 'movie', 'created_at']
+        list_serializer_class = UserStateListSerializer
+    
+    def get_state_movie_id(self, obj):
+        return obj.movie_id
 
 
 class MovieCollectionSerializer(serializers.ModelSerializer):
-    movies_count = serializers.SerializerMethodField()
-    
     class Meta:
         model = MovieCollection
-        fields = ['id', 'name', 'description', 'poster_url', 'movies_count', 'created_at']
-    
-    def get_movies_count(self, obj):
-        return obj.movies.filter(is_active=True).count()
\ No newline at end of file
+        fields = ['id', 'name', 'description', 'poster_url', 'movies_count', 'created_at']
\ No newline at end of file
@@ -0,0 +1,272 @@
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from cinema.deferred import defer
+from . import collection_counts, library, response_cache, tasks
+from .models import (
+    CollectionMovie, Genre, Movie, MovieCollection, MovieRating, MovieStream, Review, ReviewLike, UserFavorite,
+    WatchHistory, WatchLater
+)
+from .ratings import apply_rating_delta
+from .review_stats import apply_review_delta
+from .review_votes import apply_vote_delta, vote_delta
+from .search import SEARCH_FIELDS
+from .suggest import SUGGEST_FIELDS
+from .user_stats import apply_genre_delta, apply_stats_delta, invalidate_genre_names, is_high_rating
+
+
+# Поля, от которых зависит попадание фильма на полки и в фильтры каталога
+LISTING_FIELDS = ('is_active', 'is_featured', 'our_rating', 'movie_type', 'year', 'available_quality')
+
+
+def _listing(instance):
+    """Значения LISTING_FIELDS; None, если часть из них не загружена (only, refresh_from_db(fields=...))"""
+    if instance.get_deferred_fields() & set(LISTING_FIELDS):
+        return None
+    return tuple(getattr(instance, field) for field in LISTING_FIELDS)
+
+
+@receiver(post_init, sender=Movie)
+def remember_listing_fields(sender, instance, **kwargs):
+    instance._original_listing = _listing(instance)
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, created, update_fields=None, **kwargs):
+    # Счетчики и прочие служебные поля на поисковые индексы не влияют
+    changed = SEARCH_FIELDS if update_fields is None else set(update_fields)
+    if SEARCH_FIELDS & changed:
+        defer(tasks.update_search_index, instance.pk)
+    if SUGGEST_FIELDS & changed:
+        defer(tasks.update_suggest_index, instance.pk)
+
+    listing = _listing(instance)
+    if listing is None or instance._original_listing is None:
+        listing_changed = update_fields is None or bool(set(LISTING_FIELDS) & set(update_fields))
+    else:
+        listing_changed = listing != instance._original_listing
+
+    if created:
+        defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG)
+        defer(tasks.recompute_similar_movies, instance.pk)
+    elif listing_changed:
+        # Фильм мог появиться на полках или пропасть с них; у коллекций меняется число фильмов
+        collection_ids = list(
+            CollectionMovie.objects.filter(movie=instance).values_list('collection_id', flat=True)
+        )
+        if listing is None or instance._original_listing is None:
+            # Прежний is_active неизвестен — пересчитываем с нуля
+            defer(tasks.refresh_collection_counts, *collection_ids)
+        elif instance._original_listing[0] != instance.is_active:
+            collection_counts.shift_counts_for_movie(collection_ids, 1 if instance.is_active else -1)
+            if instance.is_active:
+                # Снятые с показа фильмы в расчете соседей не участвуют
+                defer(tasks.recompute_similar_movies, instance.pk)
+        defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG, *[f'collection:{pk}' for pk in collection_ids])
+        # Снятый с показа фильм не должен отдаваться из кэша манифестов
+        defer(tasks.invalidate_manifests, instance.pk)
+    else:
+        defer(tasks.invalidate_cache, f'movie:{instance.pk}')
+    instance._original_listing = listing
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    defer(tasks.invalidate_cache, f'movie:{instance.pk}')
+
+
+@receiver(m2m_changed, sender=Movie.genres.through)
+def movie_genres_changed(sender, instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # genre.movie_set.add(...): меняется состав фильмов жанра
+        defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG)
+    else:
+        defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG, f'movie:{instance.pk}')
+        # Жанры — признаки похожести
+        defer(tasks.recompute_similar_movies, instance.pk)
+
+
+@receiver(post_init, sender=Genre)
+def remember_genre_name(sender, instance, **kwargs):
+    instance._original_name = instance.name
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def genre_changed(sender, instance, **kwargs):
+    defer(
+        tasks.invalidate_cache,
+        response_cache.GENRE_LIST_TAG,
+        f'genre:{instance._original_name}',
+        f'genre:{instance.name}',
+    )
+    invalidate_genre_names()
+    instance._original_name = instance.name
+
+
+@receiver(post_save, sender=MovieStream)
+@receiver(post_delete, sender=MovieStream)
+def movie_stream_changed(sender, instance, **kwargs):
+    defer(tasks.invalidate_cache, f'movie:{instance.movie_id}')
+    defer(tasks.invalidate_manifests, instance.movie_id)
+
+
+@receiver(post_save, sender=MovieCollection)
+def movie_collection_saved(sender, instance, created, **kwargs):
+    if created:
+        defer(tasks.invalidate_cache, response_cache.COLLECTION_LIST_TAG)
+    else:
+        defer(tasks.invalidate_cache, f'collection:{instance.pk}')
+
+
+@receiver(post_delete, sender=MovieCollection)
+def movie_collection_deleted(sender, instance, **kwargs):
+    defer(tasks.invalidate_cache, f'collection:{instance.pk}')
+
+
+@receiver(post_save, sender=CollectionMovie)
+def collection_movie_saved(sender, instance, created, **kwargs):
+    if created:
+        collection_counts.shift_count(instance.collection_id, instance.movie_id, 1)
+    defer(tasks.invalidate_cache, f'collection:{instance.collection_id}')
+
+
+@receiver(post_delete, sender=CollectionMovie)
+def collection_movie_deleted(sender, instance, **kwargs):
+    # При каскадном удалении фильма строки коллекций удаляются раньше самого фильма
+    collection_counts.shift_count(instance.collection_id, instance.movie_id, -1)
+    defer(tasks.invalidate_cache, f'collection:{instance.collection_id}')
+
+
+def _invalidate_rated_movie(movie_id, our_rating_changed):
+    if our_rating_changed:
+        defer(tasks.invalidate_cache, response_cache.MOVIE_LISTS_TAG, f'movie:{movie_id}')
+    else:
+        defer(tasks.invalidate_cache, f'movie:{movie_id}')
+
+
+@receiver(post_init, sender=MovieRating)
+def remember_original_rating(sender, instance, **kwargs):
+    # Оценка на момент загрузки из БД, чтобы при сохранении знать дельту
+    instance._original_rating = instance.rating if instance.pk else None
+
+
+@receiver(post_save, sender=MovieRating)
+def movie_rating_saved(sender, instance, created, **kwargs):
+    old_rating = None if created else instance._original_rating
+    our_rating_changed = False
+    if created:
+        our_rating_changed = apply_rating_delta(instance.movie_id, instance.rating, 1)
+    elif old_rating is not None:
+        our_rating_changed = apply_rating_delta(instance.movie_id, instance.rating - old_rating, 0)
+    else:
+        # Объект создан не из БД (MovieRating(pk=...).save()): дельта неизвестна
+        defer(tasks.recompute_ratings, instance.movie_id)
+
+    if created or old_rating is not None:
+        row_existed = apply_stats_delta(
+            instance.user_id,
+            ratings_count=1 if created else 0,
+            ratings_sum=instance.rating - (old_rating or 0),
+        )
+        if row_existed and is_high_rating(instance.rating) != is_high_rating(old_rating):
+            apply_genre_delta(instance.user_id, instance.movie_id, 1 if is_high_rating(instance.rating) else -1)
+
+    instance._original_rating = instance.rating
+    library.bump_version_on_commit(instance.user_id)
+    # our_rating в карточках фильма изменился; полки «Высокий рейтинг» и
+    # сортировка по рейтингу — только если изменился сам our_rating
+    _invalidate_rated_movie(instance.movie_id, our_rating_changed)
+    defer(tasks.refresh_recommendations)
+
+
+@receiver(post_delete, sender=MovieRating)
+def movie_rating_deleted(sender, instance, **kwargs):
+    rating = instance._original_rating if instance._original_rating is not None else instance.rating
+    our_rating_changed = apply_rating_delta(instance.movie_id, -rating, -1)
+    row_existed = apply_stats_delta(instance.user_id, ratings_count=-1, ratings_sum=-rating)
+    if row_existed and is_high_rating(rating):
+        apply_genre_delta(instance.user_id, instance.movie_id, -1)
+    library.bump_version_on_commit(instance.user_id)
+    _invalidate_rated_movie(instance.movie_id, our_rating_changed)
+
+
+@receiver(post_init, sender=Review)
+def remember_original_review_rating(sender, instance, **kwargs):
+    instance._original_rating = instance.rating if instance.pk else None
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    old_rating = None if created else instance._original_rating
+    apply_review_delta(instance.movie_id, old_rating, instance.rating)
+    instance._original_rating = instance.rating
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    rating = instance._original_rating if instance._original_rating is not None else instance.rating
+    apply_review_delta(instance.movie_id, rating, None)
+
+
+@receiver(post_init, sender=ReviewLike)
+def remember_original_vote(sender, instance, **kwargs):
+    instance._original_is_like = instance.is_like if instance.pk else None
+
+
+@receiver(post_save, sender=ReviewLike)
+def review_vote_saved(sender, instance, created, **kwargs):
+    old_vote = None if created else instance._original_is_like
+    apply_vote_delta(instance.review_id, *vote_delta(old_vote, instance.is_like))
+    instance._original_is_like = instance.is_like
+
+
+@receiver(post_delete, sender=ReviewLike)
+def review_vote_deleted(sender, instance, **kwargs):
+    vote = instance._original_is_like if instance._original_is_like is not None else instance.is_like
+    apply_vote_delta(instance.review_id, *vote_delta(vote, None))
+
+
+@receiver(post_init, sender=WatchHistory)
+def remember_original_progress(sender, instance, **kwargs):
+    instance._original_progress = instance.progress if instance.pk else None
+
+
+@receiver(post_save, sender=WatchHistory)
+def watch_history_saved(sender, instance, created, **kwargs):
+    progress = int(instance.progress)
+    if created:
+        apply_stats_delta(instance.user_id, watched_count=1, watch_time=progress)
+    elif instance._original_progress is not None:
+        apply_stats_delta(instance.user_id, watch_time=progress - int(instance._original_progress))
+    instance._original_progress = progress
+    library.bump_version_on_commit(instance.user_id)
+
+
+@receiver(post_delete, sender=WatchHistory)
+def watch_history_deleted(sender, instance, **kwargs):
+    progress = instance._original_progress if instance._original_progress is not None else instance.progress
+    apply_stats_delta(instance.user_id, watched_count=-1, watch_time=-int(progress))
+    library.bump_version_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=UserFavorite)
+def favorite_saved(sender, instance, created, **kwargs):
+    if created:
+        apply_stats_delta(instance.user_id, favorites_count=1)
+        library.bump_version_on_commit(instance.user_id)
+        defer(tasks.refresh_recommendations)
+
+
+@receiver(post_delete, sender=UserFavorite)
+def favorite_deleted(sender, instance, **kwargs):
+    apply_stats_delta(instance.user_id, favorites_count=-1)
+    library.bump_version_on_commit(instance.user_id)
+
+
+@receiver(post_save, sender=WatchLater)
+@receiver(post_delete, sender=WatchLater)
+def watch_later_changed(sender, instance, **kwargs):
+    library.bump_version_on_commit(instance.user_id)
@@ -0,0 +1,228 @@
+"""
+Офлайн-расчет похожих фильмов.
+
+Каждый фильм описывается разреженным вектором признаков (жанры, режиссер,
+актеры, страны, период выпуска) с весами TF-IDF и L2-нормировкой. Косинусная
+близость считается пачками строк (разреженное произведение матриц), для
+каждого фильма сохраняется top-K соседей в таблицу SimilarMovie, откуда
+MovieDetailSerializer.get_similar читает их одним индексированным запросом.
+"""
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+from django.db import transaction
+from django.db.models import Count, Min
+
+from .models import Movie, SimilarMovie
+
+# Сколько соседей хранить на фильм (на странице показываются первые 8)
+TOP_K = 20
+BATCH_SIZE = 256
+# Признаки, которые есть у большей доли фильмов, считаются плотными
+DENSE_FEATURE_SHARE = 0.01
+
+FEATURE_WEIGHTS = {
+    'genre': 1.0,
+    'director': 1.5,
+    'cast': 1.0,
+    'country': 0.5,
+    'year': 0.7,
+}
+
+
+def movie_features(movie):
+    """Список (признак, вес группы) для словаря с полями фильма"""
+    features = [(f'genre:{genre_id}', FEATURE_WEIGHTS['genre']) for genre_id in movie['genre_ids']]
+    if movie['director']:
+        features.append((f"director:{movie['director'].lower()}", FEATURE_WEIGHTS['director']))
+    features.extend(
+        (f'cast:{name.lower()}', FEATURE_WEIGHTS['cast'])
+        for name in movie['cast'] or [] if isinstance(name, str)
+    )
+    features.extend(
+        (f'country:{country.lower()}', FEATURE_WEIGHTS['country'])
+        for country in movie['countries'] or [] if isinstance(country, str)
+    )
+    if movie['year']:
+        # Два сдвинутых пятилетних окна: близкие годы делят хотя бы одно из них
+        year = movie['year']
+        features.append((f'year5:{year // 5}', FEATURE_WEIGHTS['year']))
+        features.append((f'year5s:{(year + 2) // 5}', FEATURE_WEIGHTS['year']))
+    return features
+
+
+def build_feature_matrix(movies):
+    """CSR-матрица (фильмы x признаки) с весами TF-IDF и единичными строками"""
+    vocabulary = {}
+    rows, cols, weights = [], [], []
+    for row, movie in enumerate(movies):
+        for feature, weight in movie_features(movie):
+            rows.append(row)
+            cols.append(vocabulary.setdefault(feature, len(vocabulary)))
+            weights.append(weight)
+
+    matrix = sparse.csr_matrix(
+        (np.asarray(weights, dtype=np.float32), (rows, cols)),
+        shape=(len(movies), len(vocabulary)),
+    )
+    # Повторы признака у одного фильма схлопываются
+    matrix.data = np.minimum(matrix.data, max(FEATURE_WEIGHTS.values()))
+
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    idf = np.log((1 + matrix.shape[0]) / (1 + document_frequency)).astype(np.float32) + 1
+    matrix = matrix @ sparse.diags(idf)
+
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix, dtype=np.float32)
+
+
+def score_batches(matrix, row_indices, batch_size=BATCH_SIZE):
+    """Косинусная близость строк row_indices ко всем фильмам, пачками: (строки, плотная матрица)"""
+    # Частые признаки (жанры, страны, годы) дают почти плотное произведение,
+    # которое быстрее считать BLAS; редкие (люди) остаются разреженными
+    frequency = np.diff(matrix.tocsc().indptr)
+    frequent = frequency > matrix.shape[0] * DENSE_FEATURE_SHARE
+    dense = matrix[:, np.flatnonzero(frequent)].toarray()
+    dense_transposed = np.ascontiguousarray(dense.T)
+    rare = matrix[:, np.flatnonzero(~frequent)].tocsr()
+    rare_transposed = rare.T.tocsc()
+
+    for start in range(0, len(row_indices), batch_size):
+        batch = np.asarray(row_indices[start:start + batch_size])
+        scores = dense[batch] @ dense_transposed
+        rare_scores = (rare[batch] @ rare_transposed).tocoo()
+        scores[rare_scores.row, rare_scores.col] += rare_scores.data
+        scores[np.arange(len(batch)), batch] = -1  # сам фильм не сосед
+        yield batch, scores
+
+
+def top_neighbors(matrix, row_indices, k=TOP_K, batch_size=BATCH_SIZE):
+    """Для строк row_indices отдает (строка, индексы соседей, оценки) по убыванию близости"""
+    k = min(k, matrix.shape[0] - 1)
+    if k <= 0:
+        return
+
+    for batch, scores in score_batches(matrix, row_indices, batch_size):
+        candidates = np.argpartition(-scores, k, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+        order = np.argsort(-candidate_scores, axis=1)
+
+        for i, row in enumerate(batch):
+            neighbors = candidates[i, order[i]]
+            neighbor_scores = candidate_scores[i, order[i]]
+            positive = neighbor_scores > 0
+            yield row, neighbors[positive], neighbor_scores[positive]
+
+
+def load_catalog():
+    """Признаки всех активных фильмов в виде списка словарей"""
+    genre_ids = defaultdict(list)
+    for movie_id, genre_id in Movie.genres.through.objects.values_list('movie_id', 'genre_id'):
+        genre_ids[movie_id].append(genre_id)
+
+    movies = list(
+        Movie.objects.filter(is_active=True).order_by('pk').values(
+            'id', 'year', 'director', 'cast', 'countries'
+        )
+    )
+    for movie in movies:
+        movie['genre_ids'] = genre_ids.get(movie['id'], [])
+    return movies
+
+
+def _write_neighbors(neighbors_by_movie):
+    """Перезаписывает соседей для переданных фильмов: {movie_id: [(similar_id, score), ...]}"""
+    with transaction.atomic():
+        SimilarMovie.objects.filter(movie_id__in=neighbors_by_movie.keys()).delete()
+        SimilarMovie.objects.bulk_create(
+            [
+                SimilarMovie(movie_id=movie_id, similar_id=similar_id, score=score, rank=rank)
+                for movie_id, neighbors in neighbors_by_movie.items()
+                for rank, (similar_id, score) in enumerate(neighbors)
+            ],
+            batch_size=5000,
+        )
+
+
+def recompute_all(k=TOP_K, batch_size=BATCH_SIZE):
+    """Полный пересчет таблицы соседей. Возвращает статистику выполнения."""
+    started = time.perf_counter()
+    movies = load_catalog()
+    ids = np.array([movie['id'] for movie in movies])
+    matrix = build_feature_matrix(movies)
+    prepared = time.perf_counter()
+
+    pending = {}
+    for row, neighbors, scores in top_neighbors(matrix, np.arange(len(movies)), k, batch_size):
+        pending[int(ids[row])] = list(zip(ids[neighbors].tolist(), scores.tolist()))
+        if len(pending) >= 5000:
+            _write_neighbors(pending)
+            pending = {}
+    _write_neighbors(pending)
+
+    # Неактивные фильмы соседей не получают
+    SimilarMovie.objects.exclude(movie__is_active=True).delete()
+
+    finished = time.perf_counter()
+    return {
+        'movies': len(movies),
+        'features': matrix.shape[1],
+        'prepare_seconds': round(prepared - started, 2),
+        'total_seconds': round(finished - started, 2),
+    }
+
+
+def recompute_for(movie_ids, k=TOP_K, batch_size=BATCH_SIZE):
+    """
+    Инкрементальный пересчет для новых фильмов: считает их соседей и
+    добавляет их в списки тех фильмов, где они проходят в top-K.
+    Оценки старых пар не пересчитываются, хотя веса IDF с ростом каталога
+    немного смещаются, — их выравнивает периодический полный пересчет.
+    """
+    started = time.perf_counter()
+    movies = load_catalog()
+    ids = np.array([movie['id'] for movie in movies])
+    row_by_id = {movie_id: row for row, movie_id in enumerate(ids.tolist())}
+    rows = [row_by_id[movie_id] for movie_id in movie_ids if movie_id in row_by_id]
+    if not rows:
+        return {'movies': 0, 'updated_neighbors': 0, 'total_seconds': 0}
+
+    matrix = build_feature_matrix(movies)
+    own = {}
+    for row, neighbors, scores in top_neighbors(matrix, rows, k, batch_size):
+        own[int(ids[row])] = list(zip(ids[neighbors].tolist(), scores.tolist()))
+
+    # Порог входа в список соседей каждого фильма: худшая оценка, если список полон
+    threshold = np.zeros(len(ids), dtype=np.float32)
+    stored = SimilarMovie.objects.values('movie_id').annotate(worst=Min('score'), total=Count('id'))
+    for item in stored.order_by():
+        if item['movie_id'] in row_by_id and item['total'] >= k:
+            threshold[row_by_id[item['movie_id']]] = item['worst']
+    threshold[rows] = np.inf
+
+    reverse_candidates = defaultdict(list)
+    for batch, scores in score_batches(matrix, rows, batch_size):
+        for i, j in zip(*np.nonzero(scores > threshold)):
+            reverse_candidates[int(ids[j])].append((int(ids[batch[i]]), float(scores[i, j])))
+
+    existing = defaultdict(list)
+    for movie_id, similar_id, score in SimilarMovie.objects.filter(
+        movie_id__in=reverse_candidates.keys()
+    ).values_list('movie_id', 'similar_id', 'score'):
+        existing[movie_id].append((similar_id, score))
+
+    merged = {}
+    for movie_id, candidates in reverse_candidates.items():
+        combined = dict(existing[movie_id])
+        combined.update(candidates)
+        merged[movie_id] = sorted(combined.items(), key=lambda item: -item[1])[:k]
+
+    _write_neighbors({**merged, **own})
+    return {
+        'movies': len(own),
+        'updated_neighbors': len(merged),
+        'total_seconds': round(time.perf_counter() - started, 2),
+    }
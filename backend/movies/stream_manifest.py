@@ -0,0 +1,139 @@
+"""
+Скомпилированный манифест потоков фильма (ответ /api/movies/<id>/streams/).
+
+Сгруппированный по сезонам, эпизодам и качеству манифест собирается один
+раз и хранится в Redis как готовый JSON: целиком и отдельно по каждому
+сезону (поля одного хэша). Запрос воспроизведения — одно HGET без
+обращения к БД. Сигналы MovieStream и Movie удаляют хэш фильма и сдвигают
+его поколение: манифест, собранный до изменения, не сохраняется.
+"""
+import json
+import logging
+
+import redis
+
+from cinema.db_router import primary_reads
+from cinema.redis_client import get_async_redis, get_redis
+from .models import Movie, MovieStream
+
+
+logger = logging.getLogger('cinema')
+
+MANIFEST_KEY = 'streams:manifest:{movie_id}'
+FULL_FIELD = 'all'
+SEASON_FIELD = 'season_{season}'
+# Точная инвалидация по сигналам; TTL лишь ограничивает жизнь забытых записей
+MANIFEST_TTL = 60 * 60 * 24
+# Поколение манифеста: invalidate() увеличивает его, сохранение сверяет
+VERSION_KEY = 'streams:manifest-version:{movie_id}'
+
+# Сохраняет манифест, только если поколение не изменилось с начала сборки
+STORE_IF_CURRENT = """
+if (redis.call('GET', KEYS[2]) or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, 2 do
+    redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+
+def compile_manifest(movie_id):
+    """{'movie': {качество: url}, 'season_1': {'episode_1': {качество: url}}, ...}"""
+    streams = MovieStream.objects.filter(
+        movie_id=movie_id, is_active=True
+    ).order_by('-priority', 'quality').values_list('season', 'episode', 'quality', 'url')
+
+    manifest = {}
+    for season, episode, quality, url in streams:
+        if season and episode:
+            # Для сериалов
+            episodes = manifest.setdefault(SEASON_FIELD.format(season=season), {})
+            # При нескольких ссылках одного качества побеждает самый высокий приоритет
+            episodes.setdefault(f'episode_{episode}', {}).setdefault(quality, url)
+        else:
+            # Для фильмов
+            manifest.setdefault('movie', {}).setdefault(quality, url)
+    return manifest
+
+
+def _encode(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def get_manifest(movie_id, season=None):
+    """
+    JSON-байты манифеста (или одного сезона). None — если фильм не найден
+    или неактивен либо такого сезона нет.
+    """
+    field = FULL_FIELD if season is None else SEASON_FIELD.format(season=season)
+    key = MANIFEST_KEY.format(movie_id=movie_id)
+    version_key = VERSION_KEY.format(movie_id=movie_id)
+
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hget(key, field)
+        pipe.exists(key)
+        pipe.get(version_key)
+        cached, compiled, version = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Кэш манифестов недоступен: %s', e)
+        cached, compiled, version = None, False, None
+    if compiled:
+        # Манифест собран; отсутствие поля значит, что такого сезона нет
+        return cached
+
+    # Манифест хранится сутки: реплика могла еще не получить изменение потоков
+    with primary_reads():
+        if not Movie.objects.filter(pk=movie_id, is_active=True).exists():
+            return None
+        manifest = compile_manifest(movie_id)
+
+    fields = {FULL_FIELD: _encode(manifest)}
+    for name, episodes in manifest.items():
+        if name != 'movie':
+            fields[name] = _encode({name: episodes})
+
+    args = [version or b'', MANIFEST_TTL]
+    for name, value in fields.items():
+        args.extend([name, value])
+    try:
+        # Если потоки изменились во время сборки, манифест соберет следующий запрос
+        get_redis().register_script(STORE_IF_CURRENT)(keys=[key, version_key], args=args)
+    except redis.RedisError as e:
+        logger.warning('Не удалось сохранить манифест фильма %s: %s', movie_id, e)
+
+    return fields.get(field)
+
+
+async def aget_compiled(movie_id, season=None):
+    """
+    Чтение манифеста асинхронным клиентом Redis: (собран ли манифест,
+    JSON-байты или None). Несобранный манифест собирает get_manifest.
+    """
+    field = FULL_FIELD if season is None else SEASON_FIELD.format(season=season)
+    key = MANIFEST_KEY.format(movie_id=movie_id)
+    try:
+        pipe = get_async_redis().pipeline()
+        pipe.hget(key, field)
+        pipe.exists(key)
+        cached, compiled = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Кэш манифестов недоступен: %s', e)
+        return False, None
+    return bool(compiled), cached
+
+
+def invalidate(movie_id):
+    version_key = VERSION_KEY.format(movie_id=movie_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.incr(version_key)
+        pipe.expire(version_key, MANIFEST_TTL)
+        pipe.delete(MANIFEST_KEY.format(movie_id=movie_id))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Не удалось сбросить манифест фильма %s: %s', movie_id, e)
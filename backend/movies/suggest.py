@@ -0,0 +1,196 @@
+"""
+Автодополнение названий фильмов.
+
+Для каждого фильма хранятся ключи SuggestTerm: названия, оригинальные
+названия и имена актеров, приведенные к латинскому «скелету» (транслитерация,
+без регистра, без h, без удвоенных букв и т.п.). Благодаря этому
+«interstellar» и «интерстеллар» дают один ключ, а запрос в неверной раскладке
+(«bynthcntkkfh») дополнительно проверяется после перевода раскладки.
+Поиск идет по префиксу ключа (btree с collation "C"), горячие префиксы
+кэшируются в Redis.
+"""
+import difflib
+import json
+import logging
+import re
+
+import redis
+from django.db import transaction
+
+from cinema.redis_client import get_redis
+from .models import Movie, SuggestTerm
+
+
+logger = logging.getLogger('cinema')
+
+# Поля фильма, из которых строятся ключи
+SUGGEST_FIELDS = {'title', 'original_title', 'director', 'cast'}
+
+CACHE_KEY = 'movies:suggest:{limit}:{keys}'
+CACHE_TTL = 300
+
+# Сколько строк индекса просматривать на один вариант запроса
+SCAN_LIMIT = 200
+# Минимальная длина ключа для поиска с опечатками
+FUZZY_MIN_LENGTH = 4
+FUZZY_MIN_RATIO = 0.75
+
+# Вес источника ключа; слова из середины названия весят вдвое меньше
+TITLE_WEIGHT = 3.0
+ORIGINAL_TITLE_WEIGHT = 2.0
+PERSON_WEIGHT = 1.0
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh',
+    'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o',
+    'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts',
+    'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e', 'ю': 'yu',
+    'я': 'ya',
+}
+
+# Латинские сочетания, которые звучат одинаково (порядок важен)
+LATIN_FOLDING = [
+    ('ph', 'f'), ('ck', 'k'), ('c', 'k'), ('q', 'k'), ('x', 'ks'), ('w', 'v'),
+    ('y', 'i'), ('h', ''),
+]
+
+EN_LAYOUT = "`qwertyuiop[]asdfghjkl;'zxcvbnm,."
+RU_LAYOUT = 'ёйцукенгшщзхъфывапролджэячсмитьбю'
+EN_TO_RU = str.maketrans(EN_LAYOUT, RU_LAYOUT)
+RU_TO_EN = str.maketrans(RU_LAYOUT, EN_LAYOUT)
+
+_NON_KEY_RE = re.compile(r'[^a-z0-9 ]+')
+_SPACES_RE = re.compile(r'\s+')
+_REPEATED_RE = re.compile(r'(.)\1+')
+
+
+def skeleton(text):
+    """Приводит строку к ключу автодополнения"""
+    text = text.lower().replace('дж', 'j')
+    text = ''.join(CYRILLIC_TO_LATIN.get(char, char) for char in text)
+    for source, target in LATIN_FOLDING:
+        text = text.replace(source, target)
+    text = _NON_KEY_RE.sub(' ', text)
+    text = _REPEATED_RE.sub(r'\1', text)
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def switch_layout(text):
+    """Перевод текста, набранного не в той раскладке клавиатуры"""
+    if any(char in RU_LAYOUT for char in text.lower()):
+        return text.lower().translate(RU_TO_EN)
+    return text.lower().translate(EN_TO_RU)
+
+
+def query_keys(text):
+    """Варианты ключа для запроса: как набрано и в другой раскладке"""
+    keys = []
+    for variant in (text, switch_layout(text)):
+        key = skeleton(variant)
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def movie_terms(movie):
+    """Ключи автодополнения фильма: {ключ: (вес, исходный текст)}"""
+    sources = [(movie.title, TITLE_WEIGHT), (movie.original_title, ORIGINAL_TITLE_WEIGHT)]
+    if movie.director:
+        sources.append((movie.director, PERSON_WEIGHT))
+    sources.extend((name, PERSON_WEIGHT) for name in movie.cast or [] if isinstance(name, str))
+
+    terms = {}
+    for text, weight in sources:
+        words = skeleton(text or '').split()
+        for i in range(len(words)):
+            key = ' '.join(words[i:])[:SuggestTerm._meta.get_field('key').max_length]
+            term_weight = weight if i == 0 else weight / 2
+            if key not in terms or terms[key][0] < term_weight:
+                terms[key] = (term_weight, text)
+    return terms
+
+
+def rebuild_movie_terms(movies):
+    """Пересобирает ключи автодополнения для переданных фильмов"""
+    movies = list(movies)
+    with transaction.atomic():
+        SuggestTerm.objects.filter(movie__in=movies).delete()
+        SuggestTerm.objects.bulk_create([
+            SuggestTerm(movie=movie, key=key, weight=weight, text=text[:255])
+            for movie in movies
+            for key, (weight, text) in movie_terms(movie).items()
+        ])
+
+
+def _candidates(prefix):
+    return SuggestTerm.objects.filter(key__startswith=prefix).order_by('key').values_list(
+        'key', 'weight', 'text', 'movie_id'
+    )[:SCAN_LIMIT]
+
+
+def _find(keys, limit):
+    # movie_id -> (близость ключа, вес источника, исходный текст)
+    matches = {}
+
+    def consider(movie_id, similarity, weight, text):
+        current = matches.get(movie_id)
+        if current is None or current[:2] < (similarity, weight):
+            matches[movie_id] = (similarity, weight, text)
+
+    for key in keys:
+        for term_key, weight, text, movie_id in _candidates(key):
+            # Полное совпадение ключа выше совпадения по префиксу
+            consider(movie_id, 2.0 if term_key == key else 1.0, weight, text)
+
+    # Точных совпадений нет — ищем с опечаткой, укорачивая префикс
+    if not matches:
+        for key in keys:
+            if len(key) < FUZZY_MIN_LENGTH:
+                continue
+            prefix = key[:max(FUZZY_MIN_LENGTH - 1, len(key) // 2)]
+            for term_key, weight, text, movie_id in _candidates(prefix):
+                ratio = difflib.SequenceMatcher(None, key, term_key[:len(key)]).ratio()
+                if ratio >= FUZZY_MIN_RATIO:
+                    consider(movie_id, ratio, weight, text)
+
+    if not matches:
+        return []
+
+    movies = Movie.objects.filter(pk__in=matches.keys(), is_active=True).values(
+        'id', 'title', 'original_title', 'year', 'poster_url', 'movie_type', 'views_count'
+    )
+    ranked = sorted(
+        movies,
+        key=lambda movie: (*matches[movie['id']][:2], movie['views_count']),
+        reverse=True,
+    )[:limit]
+
+    results = []
+    for movie in ranked:
+        movie.pop('views_count')
+        movie['matched'] = matches[movie['id']][2]
+        results.append(movie)
+    return results
+
+
+def suggest(text, limit=10):
+    """Подсказки для строки поиска (с кэшем горячих префиксов)"""
+    keys = query_keys(text)
+    if not keys:
+        return []
+
+    cache_key = CACHE_KEY.format(limit=limit, keys='|'.join(keys))
+    try:
+        cached = get_redis().get(cache_key)
+        if cached is not None:
+            return json.loads(cached)
+    except redis.RedisError as e:
+        logger.warning('Кэш подсказок недоступен: %s', e)
+
+    results = _find(keys, limit)
+
+    try:
+        get_redis().set(cache_key, json.dumps(results, ensure_ascii=False), ex=CACHE_TTL)
+    except redis.RedisError:
+        pass
+    return results
@@ -0,0 +1,74 @@
+"""
+Отложенные пересчеты каталога (см. cinema.deferred). Сигналы моделей
+ставят их через defer() после коммита и не ждут выполнения.
+
+В realtime — короткие задачи, результат которых пользователь видит сразу:
+сброс кэшей, поисковый индекс, счетчики коллекций, агрегаты оценок. В
+bulk — пересчеты по всему каталогу: похожие фильмы и рекомендации.
+"""
+from django.conf import settings
+
+from cinema.deferred import BULK_QUEUE, REALTIME_QUEUE, deferred_task
+from . import collection_counts, response_cache, stream_manifest
+from .models import Movie, MovieCollection
+from .ratings import rebuild_rating_aggregates
+from .search import update_search_vectors
+from .suggest import rebuild_movie_terms
+
+
+def _ids(items):
+    return [int(item) for item in items]
+
+
+@deferred_task(REALTIME_QUEUE)
+def invalidate_cache(tags):
+    """Записи кэша ответов с затронутыми тегами"""
+    response_cache.invalidate(*tags)
+
+
+@deferred_task(REALTIME_QUEUE)
+def invalidate_manifests(movie_ids):
+    for movie_id in _ids(movie_ids):
+        stream_manifest.invalidate(movie_id)
+
+
+@deferred_task(REALTIME_QUEUE)
+def update_search_index(movie_ids):
+    update_search_vectors(Movie.objects.filter(pk__in=_ids(movie_ids)))
+
+
+@deferred_task(REALTIME_QUEUE)
+def update_suggest_index(movie_ids):
+    rebuild_movie_terms(Movie.objects.filter(pk__in=_ids(movie_ids)))
+
+
+@deferred_task(REALTIME_QUEUE)
+def refresh_collection_counts(collection_ids):
+    """Счетчики коллекций с нуля — когда сдвиг на единицу неизвестен"""
+    ids = _ids(collection_ids)
+    collection_counts.refresh_counts(MovieCollection.objects.filter(pk__in=ids))
+    response_cache.invalidate(*[f'collection:{pk}' for pk in ids])
+
+
+@deferred_task(REALTIME_QUEUE)
+def recompute_ratings(movie_ids):
+    """Агрегаты оценок с нуля — когда прежняя оценка, а с ней и дельта, неизвестна"""
+    ids = _ids(movie_ids)
+    rebuild_rating_aggregates(Movie.objects.filter(pk__in=ids))
+    # Изменился ли our_rating, неизвестно — полки сбрасываются тоже
+    response_cache.invalidate(response_cache.MOVIE_LISTS_TAG, *[f'movie:{pk}' for pk in ids])
+
+
+@deferred_task(BULK_QUEUE, countdown=60)
+def recompute_similar_movies(movie_ids):
+    """Соседи новых и измененных фильмов (без полного пересчета)"""
+    # numpy и scipy нужны только воркеру bulk, бэкенд их не загружает
+    from . import similarity
+    similarity.recompute_for(_ids(movie_ids))
+
+
+@deferred_task(BULK_QUEUE, countdown=settings.RECOMMENDATIONS_REFRESH_INTERVAL)
+def refresh_recommendations(items):
+    """Полный пересчет рекомендаций; новые оценки и избранное за отсрочку учитываются одним запуском"""
+    from . import recommender
+    recommender.build_recommendations()
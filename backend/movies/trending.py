@@ -0,0 +1,62 @@
+"""
+Трендовый рейтинг с экспоненциальным затуханием.
+
+Вклад просмотра убывает вдвое каждые TRENDING_HALF_LIFE_HOURS часов.
+Чтобы не пересчитывать все фильмы при каждом сдвиге времени, в
+Movie.trending_score хранится натуральный логарифм суммы весов,
+приведенных к фиксированной эпохе:
+
+    trending_score = ln(Σ count_i * exp(units(t_i))),  units(t) = ln2 * часы от эпохи / полупериод
+
+Порядок фильмов по такому значению совпадает с порядком по затухшей
+сумме в любой момент времени, поэтому при сбросе счетчиков обновляются
+только фильмы с новыми просмотрами, а полка «В тренде» — один проход по
+индексу. Текущий «вес» фильма: exp(trending_score - units(сейчас)).
+"""
+import math
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Movie
+
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# exp(-700) ~ 1e-304: вклад такого слагаемого пренебрежимо мал
+MIN_EXPONENT = -700
+
+
+def decay_units(moment=None, half_life_hours=None):
+    """Время от эпохи в единицах затухания (ln2 на каждый полупериод)"""
+    moment = moment or timezone.now()
+    half_life_hours = half_life_hours or settings.TRENDING_HALF_LIFE_HOURS
+    hours = (moment - EPOCH).total_seconds() / 3600
+    return hours / half_life_hours * math.log(2)
+
+
+def log_sum_sql(current, added):
+    """
+    SQL-выражение ln(exp(current) + exp(added)), устойчивое к переполнению:
+    m + ln(exp(current - m) + exp(added - m)), где m = greatest(current, added).
+    Показатель ограничен снизу: PostgreSQL считает ошибкой exp(), ушедшую в ноль.
+    """
+    top = f'GREATEST({current}, {added})'
+    return (
+        f'{top} + LN(EXP(GREATEST({current} - {top}, {MIN_EXPONENT}))'
+        f' + EXP(GREATEST({added} - {top}, {MIN_EXPONENT})))'
+    )
+
+
+def current_weight(score, moment=None):
+    """Затухшее число просмотров фильма на момент moment"""
+    return math.exp(score - decay_units(moment))
+
+
+def change_half_life(old_hours, new_hours, moment=None):
+    """
+    Переводит сохраненные значения на новый полупериод, сохраняя текущие
+    веса фильмов. Дальше они затухают уже с новой скоростью.
+    """
+    shift = decay_units(moment, new_hours) - decay_units(moment, old_hours)
+    return Movie.objects.update(trending_score=F('trending_score') + shift)
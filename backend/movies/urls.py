@@ -1,11 +1,27 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    # Режим ASGI: частые запросы на чтение обслуживают асинхронные версии
+    from . import async_views
+    movie_list = async_views.movie_list
+    movie_detail = async_views.movie_detail
+    movie_streams = async_views.movie_streams
+    search_movies = async_views.search_movies
+    user_library = async_views.user_library
+else:
+    movie_list = views.MovieListView.as_view()
+    movie_detail = views.MovieDetailView.as_view()
+    movie_streams = views.movie_streams
+    search_movies = views.SearchMoviesView.as_view()
+    user_library = views.user_library
+
 urlpatterns = [
     # Фильмы
-    path('movies/', views.MovieListView.as_view(), name='movie-list'),
-    path('movies/<int:pk>/', views.MovieDetailView.as_view(), name='movie-detail'),
-    path('movies/<int:pk>/streams/', views.movie_streams, name='movie-streams'),
+    path('movies/', movie_list, name='movie-list'),
+    path('movies/<int:pk>/', movie_detail, name='movie-detail'),
+    path('movies/<int:pk>/streams/', movie_streams, name='movie-streams'),
     path('movies/<int:pk>/favorite/', views.toggle_favorite, name='toggle-favorite'),
     path('movies/<int:pk>/rate/', views.rate_movie, name='rate-movie'),
     path('movies/<int:pk>/watch/', views.update_watch_progress, name='update-watch-progress'),
@@ -16,7 +32,8 @@ urlpatterns = [
     path('reviews/<int:review_id>/like/', views.like_review, name='like-review'),
     
     # Поиск
-    path('movies/search/', views.SearchMoviesView.as_view(), name='search-movies'),
+    path('movies/search/', search_movies, name='search-movies'),
+    path('movies/suggest/', views.suggest_movies, name='suggest-movies'),
     
     # Жанры
     path('genres/', views.GenreListView.as_view(), name='genre-list'),
@@ -31,4 +48,6 @@ urlpatterns = [
     path('user/history/', views.UserWatchHistoryView.as_view(), name='user-history'),
     path('user/recommendations/', views.user_recommendations, name='user-recommendations'),
     path('user/stats/', views.user_stats, name='user-stats'),
+    path('user/sync/', views.sync_library, name='user-sync'),
+    path('user/library/', user_library, name='user-library'),
 ]
\ No newline at end of file
@@ -0,0 +1,138 @@
+from .models import UserFavorite, MovieRating, WatchHistory
+from .watch_progress import abuffered_progress, buffered_progress
+
+
+# Персональные поля карточки фильма
+PERSONAL_FIELDS = ('is_favorite', 'user_rating', 'watch_progress')
+# Параметр запроса: карточки без персональных полей, клиент подставляет их
+# сам из /api/user/library/ (см. movies.library)
+NO_USER_FIELDS_PARAM = 'no_user_fields'
+
+
+class UserMovieState:
+    """
+    Персональные данные пользователя (избранное, оценки, прогресс) для набора фильмов.
+    Загружается пачкой: три запроса на всю страницу вместо трех на каждый фильм.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.favorite_ids = set()
+        self.ratings = {}
+        self.progress = {}
+        self._buffered = None
+        self._loaded_ids = set()
+
+    def load(self, movie_ids):
+        """Догружает данные для фильмов, которых еще нет в кэше"""
+        missing_ids = set(movie_ids) - self._loaded_ids
+        if not missing_ids:
+            return
+
+        favorites, ratings, history = self._querysets(missing_ids)
+        # Еще не сброшенные позиции из буфера Redis новее записей в БД
+        if self._buffered is None:
+            self._buffered = buffered_progress(self.user.pk)
+        self._merge(missing_ids, favorites, ratings, list(history))
+
+    async def aload(self, movie_ids):
+        """load() для асинхронных представлений (асинхронный ORM и клиент Redis)"""
+        missing_ids = set(movie_ids) - self._loaded_ids
+        if not missing_ids:
+            return
+
+        favorites, ratings, history = self._querysets(missing_ids)
+        if self._buffered is None:
+            self._buffered = await abuffered_progress(self.user.pk)
+        self._merge(
+            missing_ids,
+            [movie_id async for movie_id in favorites],
+            [row async for row in ratings],
+            [row async for row in history],
+        )
+
+    def _querysets(self, movie_ids):
+        return (
+            UserFavorite.objects.filter(
+                user=self.user, movie_id__in=movie_ids
+            ).values_list('movie_id', flat=True),
+            MovieRating.objects.filter(
+                user=self.user, movie_id__in=movie_ids
+            ).values_list('movie_id', 'rating'),
+            WatchHistory.objects.filter(
+                user=self.user, movie_id__in=movie_ids
+            ).values_list('movie_id', 'progress', 'season', 'episode', 'watched_at'),
+        )
+
+    def _merge(self, movie_ids, favorites, ratings, history):
+        self.favorite_ids.update(favorites)
+        self.ratings.update(ratings)
+
+        # Берем только последнюю запись истории по каждому фильму
+        history.extend(
+            (movie_id, progress, season, episode, watched_at)
+            for (movie_id, season, episode), (progress, watched_at) in self._buffered.items()
+            if movie_id in movie_ids
+        )
+        history.sort(key=lambda row: row[4], reverse=True)
+        for movie_id, progress, season, episode, watched_at in history:
+            self.progress.setdefault(movie_id, (progress, season, episode))
+
+        self._loaded_ids.update(movie_ids)
+
+    def is_favorite(self, movie_id):
+        self.load([movie_id])
+        return movie_id in self.favorite_ids
+
+    def get_rating(self, movie_id):
+        self.load([movie_id])
+        return self.ratings.get(movie_id)
+
+    def get_progress(self, movie_id):
+        self.load([movie_id])
+        return self.progress.get(movie_id)
+
+
+def wants_user_fields(request):
+    """False, если клиент запросил карточки без персональных полей (?no_user_fields=1)"""
+    return request.query_params.get(NO_USER_FIELDS_PARAM) not in ('1', 'true')
+
+
+def get_user_state(context):
+    """Возвращает общий для всего ответа UserMovieState из контекста сериализатора"""
+    request = context.get('request')
+    if not request or not request.user.is_authenticated or not wants_user_fields(request):
+        return None
+
+    state = context.get('user_state')
+    if state is None:
+        state = context['user_state'] = UserMovieState(request.user)
+    return state
+
+
+def watch_progress_data(history, duration):
+    """Поле watch_progress карточки фильма по кортежу (progress, season, episode)"""
+    if not history:
+        return None
+    progress, season, episode = history
+    return {
+        'progress': progress,
+        'season': season,
+        'episode': episode,
+        'percentage': (progress / (duration * 60) * 100) if duration else 0
+    }
+
+
+def apply_user_state(items, state):
+    """Заполняет персональные поля в уже сериализованных карточках фильмов"""
+    if state is not None:
+        state.load(item['id'] for item in items)
+
+    for item in items:
+        if state is None:
+            item.update(is_favorite=False, user_rating=None, watch_progress=None)
+            continue
+        item['is_favorite'] = state.is_favorite(item['id'])
+        item['user_rating'] = state.get_rating(item['id'])
+        item['watch_progress'] = watch_progress_data(state.get_progress(item['id']), item.get('duration'))
+    return items
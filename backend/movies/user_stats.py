@@ -0,0 +1,175 @@
+"""
+Материализованная статистика пользователя (UserStats).
+
+Счетчики меняются атомарными дельтами из сигналов WatchHistory,
+UserFavorite и MovieRating, так что /api/user/stats/ читает одну строку
+по первичному ключу. Если строки еще нет, она строится с нуля по
+исходным таблицам (в которых текущее изменение уже учтено) — только при
+добавлении: удаления без строки пропускаются, ее построит чтение
+статистики. Иначе каскадное удаление пользователя, которое убирает
+UserStats раньше истории и оценок, вставляло бы строку заново.
+"""
+from collections import defaultdict
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import Genre, Movie, MovieRating, UserFavorite, UserStats, WatchHistory
+
+GENRE_NAMES_KEY = 'genre-names'
+COUNTER_FIELDS = ('watched_count', 'favorites_count', 'ratings_count', 'ratings_sum', 'watch_time')
+
+
+def actual_stats(user_ids):
+    """Статистика, посчитанная GROUP BY по исходным таблицам: {user_id: {поле: значение}}"""
+    stats = defaultdict(lambda: {field: 0 for field in COUNTER_FIELDS} | {'genre_counts': {}})
+
+    watched = WatchHistory.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+        total=Count('id'), time=Sum('progress')
+    ).order_by()
+    for row in watched:
+        stats[row['user_id']].update(watched_count=row['total'], watch_time=row['time'] or 0)
+
+    favorites = UserFavorite.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+        total=Count('id')
+    ).order_by()
+    for row in favorites:
+        stats[row['user_id']]['favorites_count'] = row['total']
+
+    ratings = MovieRating.objects.filter(user_id__in=user_ids).values('user_id').annotate(
+        total=Count('id'), rating_sum=Sum('rating')
+    ).order_by()
+    for row in ratings:
+        stats[row['user_id']].update(ratings_count=row['total'], ratings_sum=row['rating_sum'])
+
+    genres = MovieRating.objects.filter(
+        user_id__in=user_ids,
+        rating__gte=UserStats.FAVORITE_GENRE_RATING,
+        movie__genres__isnull=False
+    ).values('user_id', 'movie__genres').annotate(total=Count('id')).order_by()
+    for row in genres:
+        stats[row['user_id']]['genre_counts'][str(row['movie__genres'])] = row['total']
+
+    return {user_id: stats[user_id] for user_id in user_ids}
+
+
+def rebuild_user_stats(user_ids):
+    """Перезаписывает статистику пользователей фактическими значениями"""
+    rebuilt = {}
+    for user_id, fields in actual_stats(user_ids).items():
+        rebuilt[user_id], _ = UserStats.objects.update_or_create(user_id=user_id, defaults=fields)
+    return rebuilt
+
+
+def _rebuild_missing(user_id, deltas):
+    """Строит недостающую строку, если запись что-то добавила и пользователь еще существует"""
+    if any(delta > 0 for delta in deltas) and get_user_model().objects.filter(pk=user_id).exists():
+        rebuild_user_stats([user_id])
+
+
+def apply_stats_delta(user_id, **deltas):
+    """
+    Меняет счетчики пользователя атомарными дельтами (watched_count=1, watch_time=-300, ...).
+    Возвращает False, если строки не было (она построена с нуля с учетом дельт или пропущена).
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if not changes:
+        return True
+    if not UserStats.objects.filter(user_id=user_id).update(**changes):
+        _rebuild_missing(user_id, deltas.values())
+        return False
+    return True
+
+
+def apply_genre_delta(user_id, movie_id, delta):
+    """Добавляет delta (+1/-1) к числу высоких оценок во всех жанрах фильма"""
+    apply_genre_deltas(user_id, {movie_id: delta})
+
+
+def apply_genre_deltas(user_id, deltas):
+    """То же для нескольких фильмов сразу: {movie_id: delta}"""
+    genre_deltas = defaultdict(int)
+    for movie_id, genre_id in Movie.genres.through.objects.filter(
+        movie_id__in=deltas
+    ).values_list('movie_id', 'genre_id'):
+        genre_deltas[str(genre_id)] += deltas[movie_id]
+    if not any(genre_deltas.values()):
+        return
+
+    with transaction.atomic():
+        stats = UserStats.objects.select_for_update().filter(user_id=user_id).first()
+        if stats is None:
+            _rebuild_missing(user_id, genre_deltas.values())
+            return
+        for genre_id, delta in genre_deltas.items():
+            count = stats.genre_counts.get(genre_id, 0) + delta
+            if count > 0:
+                stats.genre_counts[genre_id] = count
+            else:
+                stats.genre_counts.pop(genre_id, None)
+        stats.save(update_fields=['genre_counts'])
+
+
+def is_high_rating(rating):
+    return rating is not None and rating >= UserStats.FAVORITE_GENRE_RATING
+
+
+def genre_names():
+    """{genre_id: название} из кэша; сбрасывается сигналом Genre"""
+    try:
+        names = cache.get(GENRE_NAMES_KEY)
+    except redis.RedisError:
+        names = None
+    if names is None:
+        names = dict(Genre.objects.values_list('id', 'name'))
+        try:
+            cache.set(GENRE_NAMES_KEY, names, settings.RESPONSE_CACHE_TTL)
+        except redis.RedisError:
+            pass
+    return names
+
+
+def invalidate_genre_names():
+    try:
+        cache.delete(GENRE_NAMES_KEY)
+    except redis.RedisError:
+        pass
+
+
+def active_user_ids():
+    """Пользователи, у которых есть статистика или хоть одна запись в исходных таблицах"""
+    return sorted(
+        set(WatchHistory.objects.values_list('user_id', flat=True).distinct())
+        | set(UserFavorite.objects.values_list('user_id', flat=True).distinct())
+        | set(MovieRating.objects.values_list('user_id', flat=True).distinct())
+        | set(UserStats.objects.values_list('user_id', flat=True))
+    )
+
+
+def find_stats_drift(chunk_size=1000):
+    """Список (user_id, сохранено, фактически) для пользователей с расхождениями"""
+    drift = []
+    user_ids = active_user_ids()
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        stored = {
+            stats.user_id: {field: getattr(stats, field) for field in COUNTER_FIELDS + ('genre_counts',)}
+            for stats in UserStats.objects.filter(user_id__in=chunk)
+        }
+        for user_id, expected in actual_stats(chunk).items():
+            if stored.get(user_id) != expected:
+                drift.append((user_id, stored.get(user_id), expected))
+    return drift
+
+
+def rebuild_all_user_stats(chunk_size=1000):
+    """Пересчитывает статистику всех пользователей пачками. Возвращает их число."""
+    user_ids = active_user_ids()
+    for start in range(0, len(user_ids), chunk_size):
+        with transaction.atomic():
+            rebuild_user_stats(user_ids[start:start + chunk_size])
+    return len(user_ids)
@@ -0,0 +1,135 @@
+"""
+Отложенный счетчик просмотров.
+
+Просмотры копятся в Redis (HINCRBY) и периодически переносятся в
+Movie.views_count и Movie.trending_score одним UPDATE командой flush_view_counts.
+"""
+import logging
+import math
+import time
+
+import redis
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+
+from cinema import metrics
+from cinema.redis_client import get_async_redis, get_redis
+from .models import Movie
+from .trending import decay_units, log_sum_sql
+
+
+logger = logging.getLogger('cinema')
+
+PENDING_KEY = 'movies:views:pending'
+PROCESSING_KEY = 'movies:views:processing'
+PENDING_SINCE_KEY = 'movies:views:pending_since'
+STATS_KEY = 'movies:views:stats'
+
+
+def record_view(movie_id):
+    """Учитывает просмотр фильма; при недоступности Redis пишет сразу в БД"""
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hincrby(PENDING_KEY, movie_id, 1)
+        pipe.set(PENDING_SINCE_KEY, time.time(), nx=True)
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Redis недоступен, просмотр записан напрямую: %s', e)
+        Movie.objects.filter(pk=movie_id).update(views_count=F('views_count') + 1)
+
+
+async def arecord_view(movie_id):
+    """record_view для асинхронных представлений"""
+    try:
+        pipe = get_async_redis().pipeline()
+        pipe.hincrby(PENDING_KEY, movie_id, 1)
+        pipe.set(PENDING_SINCE_KEY, time.time(), nx=True)
+        await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Redis недоступен, просмотр записан напрямую: %s', e)
+        await Movie.objects.filter(pk=movie_id).aupdate(views_count=F('views_count') + 1)
+
+
+def apply_view_counts(counts, moment=None):
+    """
+    Добавляет просмотры ({movie_id: количество}) к views_count и trending_score.
+    Один UPDATE с соединением по массивам: на тысячах фильмов за сброс это
+    быстрее, чем CASE с веткой на каждый фильм.
+    """
+    movie_ids = list(counts)
+    views = [counts[movie_id] for movie_id in movie_ids]
+    units = decay_units(moment)
+    weights = [units + math.log(count) for count in views]
+
+    table = Movie._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table} SET
+                views_count = {table}.views_count + batch.views,
+                trending_score = {log_sum_sql(f'{table}.trending_score', 'batch.weight')}
+            FROM unnest(%s::integer[], %s::integer[], %s::double precision[]) AS batch(id, views, weight)
+            WHERE {table}.id = batch.id
+            """,
+            [movie_ids, views, weights],
+        )
+        return cursor.rowcount
+
+
+def flush_view_counts():
+    """Переносит накопленные просмотры в БД. Возвращает число обновленных фильмов."""
+    client = get_redis()
+    started_at = time.time()
+
+    # Забираем накопленное атомарно; незавершенный прошлый сброс доделываем первым
+    pending_since = client.get(PENDING_SINCE_KEY)
+    if not client.exists(PROCESSING_KEY):
+        pipe = client.pipeline()
+        pipe.exists(PENDING_KEY)
+        pipe.delete(PENDING_SINCE_KEY)
+        has_pending, _ = pipe.execute()
+        if has_pending:
+            client.rename(PENDING_KEY, PROCESSING_KEY)
+
+    counts = {
+        int(movie_id): int(count)
+        for movie_id, count in client.hgetall(PROCESSING_KEY).items()
+    }
+
+    if counts:
+        with transaction.atomic():
+            apply_view_counts(counts)
+            transaction.on_commit(lambda: client.delete(PROCESSING_KEY))
+
+    finished_at = time.time()
+    stats = client.hgetall(STATS_KEY)
+    previous_flush = float(stats.get(b'last_flush_at', 0))
+    lag = finished_at - float(pending_since) if pending_since else 0
+
+    client.hset(STATS_KEY, mapping={
+        'last_flush_at': finished_at,
+        'last_flush_interval': finished_at - previous_flush if previous_flush else 0,
+        'last_flush_duration': finished_at - started_at,
+        'last_flush_lag': lag,
+        'last_flush_movies': len(counts),
+        'last_flush_views': sum(counts.values()),
+    })
+    return len(counts)
+
+
+@metrics.register('view_counter')
+def view_counter_metrics():
+    client = get_redis()
+    stats = {
+        key.decode(): float(value)
+        for key, value in client.hgetall(STATS_KEY).items()
+    }
+    pending_since = client.get(PENDING_SINCE_KEY)
+
+    return {
+        'flush_interval_setting': settings.VIEW_COUNTER_FLUSH_INTERVAL,
+        'pending_movies': client.hlen(PENDING_KEY),
+        'current_lag': time.time() - float(pending_since) if pending_since else 0,
+        **stats,
+    }
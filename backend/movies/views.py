@@ -3,11 +3,12 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Avg, Count, F
+from django.db.models import F
 from django.db import transaction
+from django.http import HttpResponse
 from .models import (
-    Movie, Genre, UserFavorite, WatchHistory, Review, MovieStream,
-    MovieRating, WatchLater, UserMovieStatus, MovieCollection, ReviewLike
+    Movie, Genre, UserFavorite, WatchHistory, Review,
+    MovieRating, WatchLater, MovieCollection, CollectionMovie, UserStats
 )
 from .serializers import (
     MovieListSerializer, MovieDetailSerializer, GenreSerializer,
@@ -15,18 +16,34 @@ from .serializers import (
     MovieRatingSerializer, WatchLaterSerializer, MovieCollectionSerializer,
     ReviewDetailSerializer
 )
+from . import library, library_sync, review_votes, watch_progress
+from .pagination import KeysetPagination
+from .response_cache import (
+    CachedListMixin, COLLECTION_LIST_TAG, GENRE_LIST_TAG, movie_tags
+)
+from .search import search_movies
+from .stream_manifest import get_manifest
+from .suggest import suggest
+from .user_stats import genre_names, rebuild_user_stats
+
+
+# Полки каталога, одинаковые для всех пользователей (кэшируются целиком)
+CACHED_SHELVES = {'featured', 'new', 'popular', 'top_rated', 'trending'}
 
 
-class MovieListView(generics.ListAPIView):
+class MovieListView(CachedListMixin, generics.ListAPIView):
     serializer_class = MovieListSerializer
+    cache_prefix = 'movie-list'
+    has_user_fields = True
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['movie_type', 'year', 'genres', 'available_quality']
     search_fields = ['title', 'original_title', 'description', 'director', 'cast']
     ordering_fields = ['year', 'created_at', 'our_rating', 'views_count', 'favorites_count']
-    ordering = ['-created_at']
     
     def get_queryset(self):
-        queryset = Movie.objects.filter(is_active=True).prefetch_related('genres')
+        # Сортировка по умолчанию задается здесь, а не через OrderingFilter.ordering,
+        # иначе она перекрывала бы сортировку категорий
+        queryset = Movie.objects.filter(is_active=True).prefetch_related('genres').order_by('-created_at')
         category = self.request.query_params.get('category')
         
         if category == 'featured':
@@ -38,21 +55,26 @@ class MovieListView(generics.ListAPIView):
         elif category == 'top_rated':
             queryset = queryset.filter(our_rating__gte=8.0).order_by('-our_rating')
         elif category == 'trending':
-            # Трендовые - популярные за последнюю неделю
-            from datetime import datetime, timedelta
-            week_ago = datetime.now() - timedelta(days=7)
-            queryset = queryset.filter(created_at__gte=week_ago).order_by('-views_count')
+            # Трендовые - по затухающей сумме недавних просмотров (см. movies.trending)
+            queryset = queryset.order_by('-trending_score')
         
         return queryset
+    
+    def is_cacheable(self, request):
+        # Кэшируются только общие для всех полки
+        return request.query_params.get('category') in CACHED_SHELVES
+    
+    def get_cache_tags(self, items):
+        return movie_tags(items)
 
 
 class MovieDetailView(generics.RetrieveAPIView):
-    queryset = Movie.objects.filter(is_active=True)
+    queryset = Movie.objects.filter(is_active=True).select_related('review_stats')
     serializer_class = MovieDetailSerializer
     
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        # Увеличиваем счетчик просмотров
+        # Учитываем просмотр (views_count обновится при сбросе счетчиков)
         instance.increment_views()
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
@@ -61,58 +83,56 @@ class MovieDetailView(generics.RetrieveAPIView):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def movie_streams(request, pk):
-    """Получение ссылок для просмотра фильма"""
-    try:
-        movie = Movie.objects.get(pk=pk, is_active=True)
-        streams = MovieStream.objects.filter(movie=movie, is_active=True).order_by('-priority', 'quality')
-        
-        # Группируем по качеству и сезонам/эпизодам
-        streams_data = {}
-        for stream in streams:
-            if stream.season and stream.episode:
-                # Для сериалов
-                season_key = f"season_{stream.season}"
-                if season_key not in streams_data:
-                    streams_data[season_key] = {}
-                
-                episode_key = f"episode_{stream.episode}"
-                if episode_key not in streams_data[season_key]:
-                    streams_data[season_key][episode_key] = {}
-                
-                streams_data[season_key][episode_key][stream.quality] = stream.url
-            else:
-                # Для фильмов
-                if "movie" not in streams_data:
-                    streams_data["movie"] = {}
-                streams_data["movie"][stream.quality] = stream.url
-        
-        return Response(streams_data)
-    except Movie.DoesNotExist:
+    """Получение ссылок для просмотра фильма (?season=N — только один сезон)"""
+    season = request.query_params.get('season')
+    if season is not None:
+        try:
+            season = int(season)
+        except ValueError:
+            return Response({'error': 'Неверный номер сезона'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Готовый JSON из кэша отдается как есть, без повторной сериализации
+    manifest = get_manifest(pk, season)
+    if manifest is None:
+        if season is not None and Movie.objects.filter(pk=pk, is_active=True).exists():
+            return Response({'error': 'Сезон не найден'}, status=status.HTTP_404_NOT_FOUND)
         return Response({'error': 'Фильм не найден'}, status=status.HTTP_404_NOT_FOUND)
+    return HttpResponse(manifest, content_type='application/json')
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def toggle_favorite(request, pk):
-    """Добавление/удаление из избранного"""
+    """
+    Добавление/удаление из избранного. С {"is_favorite": true/false} —
+    явная установка (повтор запроса безопасен), без тела — переключение.
+    """
     try:
         movie = Movie.objects.get(pk=pk, is_active=True)
-        favorite, created = UserFavorite.objects.get_or_create(
-            user=request.user,
-            movie=movie
-        )
+        wanted = request.data.get('is_favorite')
+        if wanted is not None and not isinstance(wanted, bool):
+            return Response({'error': 'is_favorite должно быть true или false'}, status=status.HTTP_400_BAD_REQUEST)
         
-        if not created:
+        favorite = UserFavorite.objects.filter(user=request.user, movie=movie).first()
+        if wanted is None:
+            wanted = favorite is None
+        
+        if wanted and favorite is None:
+            _, created = UserFavorite.objects.get_or_create(user=request.user, movie=movie)
+            if not created:
+                return Response({'is_favorite': True})
+            # Увеличиваем счетчик
+            movie.favorites_count = F('favorites_count') + 1
+        elif not wanted and favorite is not None:
             favorite.delete()
             # Уменьшаем счетчик
             movie.favorites_count = F('favorites_count') - 1
-            movie.save(update_fields=['favorites_count'])
-            return Response({'is_favorite': False})
         else:
-            # Увеличиваем счетчик
-            movie.favorites_count = F('favorites_count') + 1
-            movie.save(update_fields=['favorites_count'])
-            return Response({'is_favorite': True})
+            return Response({'is_favorite': wanted})
+        
+        movie.save(update_fields=['favorites_count'])
+        library_sync.record_change(request.user.pk, movie.pk, 'favorite')
+        return Response({'is_favorite': wanted})
             
     except Movie.DoesNotExist:
         return Response({'error': 'Фильм не найден'}, status=status.HTTP_404_NOT_FOUND)
@@ -132,11 +152,12 @@ def rate_movie(request, pk):
         rating, created = MovieRating.objects.update_or_create(
             user=request.user,
             movie=movie,
-            defaults={'rating': rating_value}
+            defaults={'rating': int(rating_value)}
         )
+        library_sync.record_change(request.user.pk, movie.pk, 'rating')
         
-        # Обновляем средний рейтинг фильма
-        movie.update_our_rating()
+        # Агрегаты оценок обновляются сигналом, читаем свежие значения
+        movie.refresh_from_db(fields=['our_rating', 'ratings_count'])
         
         return Response({
             'rating': rating.rating,
@@ -151,37 +172,32 @@ def rate_movie(request, pk):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_watch_progress(request, pk):
-    """Обновление прогресса просмотра"""
+    """
+    Обновление прогресса просмотра. Позиция пишется в буфер Redis и
+    переносится в БД командой flush_watch_progress (см. movies.watch_progress).
+    """
     try:
-        movie = Movie.objects.get(pk=pk, is_active=True)
-        progress = request.data.get('progress', 0)
-        season = request.data.get('season')
-        episode = request.data.get('episode')
-        
-        watch_history, created = WatchHistory.objects.update_or_create(
-            user=request.user,
-            movie=movie,
-            season=season,
-            episode=episode,
-            defaults={'progress': progress}
-        )
-        
-        # Обновляем статус просмотра
-        if progress > 0:
-            status_value = 'watching'
-            # Если просмотрено больше 90%, считаем просмотренным
-            if movie.duration and progress >= (movie.duration * 60 * 0.9):
-                status_value = 'watched'
-            
-            UserMovieStatus.objects.update_or_create(
-                user=request.user,
-                movie=movie,
-                defaults={'status': status_value}
-            )
-        
+        progress = int(request.data.get('progress') or 0)
+        season = int(request.data['season']) if request.data.get('season') is not None else None
+        episode = int(request.data['episode']) if request.data.get('episode') is not None else None
+    except (TypeError, ValueError):
+        return Response({'error': 'Неверные данные прогресса'}, status=status.HTTP_400_BAD_REQUEST)
+    if not watch_progress.is_valid_position(pk, progress, season, episode):
+        return Response({'error': 'Неверные данные прогресса'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    known_active = watch_progress.record_progress(request.user.pk, pk, progress, season, episode)
+    if known_active:
         return Response({'success': True})
+    
+    try:
+        movie = Movie.objects.get(pk=pk, is_active=True)
     except Movie.DoesNotExist:
         return Response({'error': 'Фильм не найден'}, status=status.HTTP_404_NOT_FOUND)
+    
+    if known_active is None:
+        # Redis недоступен — пишем сразу в БД
+        watch_progress.save_progress(request.user, movie, progress, season, episode)
+    return Response({'success': True})
 
 
 class MovieReviewListCreateView(generics.ListCreateAPIView):
@@ -190,7 +206,19 @@ class MovieReviewListCreateView(generics.ListCreateAPIView):
     
     def get_queryset(self):
         movie_id = self.kwargs['pk']
-        return Review.objects.filter(movie_id=movie_id).select_related('user').order_by('-created_at')
+        queryset = Review.objects.filter(movie_id=movie_id).select_related('user')
+        
+        # ?is_spoiler=false — без спойлеров (частичные индексы по is_spoiler=False)
+        is_spoiler = self.request.query_params.get('is_spoiler')
+        if is_spoiler in ('true', '1'):
+            queryset = queryset.filter(is_spoiler=True)
+        elif is_spoiler in ('false', '0'):
+            queryset = queryset.filter(is_spoiler=False)
+        
+        # Сортировка по полезности — по сохраненной оценке Уилсона (см. movies.review_votes)
+        if self.request.query_params.get('ordering') == 'helpful':
+            return queryset.order_by('-helpful_rank', '-id')
+        return queryset.order_by('-created_at')
     
     def perform_create(self, serializer):
         movie_id = self.kwargs['pk']
@@ -200,42 +228,35 @@ class MovieReviewListCreateView(generics.ListCreateAPIView):
             review = serializer.save(user=self.request.user, movie=movie)
             
             # Если в отзыве есть рейтинг, создаем/обновляем MovieRating
+            # Средний рейтинг фильма обновляется сигналом MovieRating
             if review.rating:
                 MovieRating.objects.update_or_create(
                     user=self.request.user,
                     movie=movie,
                     defaults={'rating': review.rating}
                 )
-                
-                # Обновляем средний рейтинг
-                movie.update_our_rating()
+                library_sync.record_change(self.request.user.pk, movie.pk, 'rating')
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def like_review(request, review_id):
-    """Лайк/дизлайк отзыва"""
+    """
+    Лайк/дизлайк отзыва. {"is_like": true/false} ставит или меняет голос
+    (по умолчанию лайк), {"is_like": null} снимает его.
+    """
     try:
         review = Review.objects.get(pk=review_id)
         is_like = request.data.get('is_like', True)
+        if is_like is not None and not isinstance(is_like, bool):
+            return Response({'error': 'is_like должно быть true, false или null'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Проверяем, не лайкает ли пользователь свой отзыв
-        if review.user == request.user:
+        if review.user_id == request.user.pk:
             return Response({'error': 'Нельзя оценивать свой отзыв'}, status=status.HTTP_400_BAD_REQUEST)
         
-        vote, created = ReviewLike.objects.update_or_create(
-            user=request.user,
-            review=review,
-            defaults={'is_like': is_like}
-        )
-        
-        # Пересчитываем лайки/дизлайки
-        likes_count = ReviewLike.objects.filter(review=review, is_like=True).count()
-        dislikes_count = ReviewLike.objects.filter(review=review, is_like=False).count()
-        
-        review.likes_count = likes_count
-        review.dislikes_count = dislikes_count
-        review.save(update_fields=['likes_count', 'dislikes_count'])
+        # Счетчики сдвигаются дельтами в сигналах ReviewLike (см. movies.review_votes)
+        likes_count, dislikes_count = review_votes.cast_vote(request.user, review, is_like)
         
         return Response({
             'likes_count': likes_count,
@@ -250,27 +271,38 @@ def like_review(request, review_id):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def add_to_watch_later(request, pk):
-    """Добавить в список 'Смотреть позже' """
+    """
+    Добавить в список 'Смотреть позже' или убрать из него. С
+    {"in_watch_later": true/false} — явная установка, без тела — переключение.
+    """
     try:
         movie = Movie.objects.get(pk=pk, is_active=True)
-        watch_later, created = WatchLater.objects.get_or_create(
-            user=request.user,
-            movie=movie
-        )
+        wanted = request.data.get('in_watch_later')
+        if wanted is not None and not isinstance(wanted, bool):
+            return Response({'error': 'in_watch_later должно быть true или false'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        watch_later = WatchLater.objects.filter(user=request.user, movie=movie).first()
+        if wanted is None:
+            wanted = watch_later is None
         
-        if not created:
+        if wanted and watch_later is None:
+            WatchLater.objects.get_or_create(user=request.user, movie=movie)
+            library_sync.record_change(request.user.pk, movie.pk, 'watch_later')
+        elif not wanted and watch_later is not None:
             watch_later.delete()
-            return Response({'in_watch_later': False})
+            library_sync.record_change(request.user.pk, movie.pk, 'watch_later')
         
-        return Response({'in_watch_later': True})
+        return Response({'in_watch_later': wanted})
         
     except Movie.DoesNotExist:
         return Response({'error': 'Фильм не найден'}, status=status.HTTP_404_NOT_FOUND)
 
 
-class GenreListView(generics.ListAPIView):
+class GenreListView(CachedListMixin, generics.ListAPIView):
     queryset = Genre.objects.all()
     serializer_class = GenreSerializer
+    cache_prefix = 'genre-list'
+    cache_tags = [GENRE_LIST_TAG]
 
 
 class SearchMoviesView(generics.ListAPIView):
@@ -281,14 +313,24 @@ class SearchMoviesView(generics.ListAPIView):
         if len(query) < 2:
             return Movie.objects.none()
         
-        return Movie.objects.filter(
-            Q(title__icontains=query) |
-            Q(original_title__icontains=query) |
-            Q(description__icontains=query) |
-            Q(director__icontains=query) |
-            Q(cast__icontains=query),
-            is_active=True
-        ).distinct().order_by('-our_rating', '-views_count')
+        # Полнотекстовый поиск с ранжированием по релевантности
+        return search_movies(query).prefetch_related('genres')
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def suggest_movies(request):
+    """Подсказки при наборе поискового запроса"""
+    query = request.query_params.get('q', '').strip()
+    try:
+        limit = min(int(request.query_params.get('limit', 10)), 20)
+    except ValueError:
+        limit = 10
+    
+    if not query:
+        return Response([])
+    
+    return Response(suggest(query[:100], limit=max(limit, 1)))
 
 
 # Пользовательские данные
@@ -297,7 +339,7 @@ class UserFavoritesView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return UserFavorite.objects.filter(user=self.request.user).select_related('movie')
+        return UserFavorite.objects.filter(user=self.request.user).select_related('movie').prefetch_related('movie__genres').order_by('-created_at')
 
 
 class UserWatchHistoryView(generics.ListAPIView):
@@ -305,7 +347,21 @@ class UserWatchHistoryView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return WatchHistory.objects.filter(user=self.request.user).select_related('movie').order_by('-watched_at')
+        return WatchHistory.objects.filter(user=self.request.user).select_related('movie').prefetch_related('movie__genres').order_by('-watched_at')
+    
+    def list(self, request, *args, **kwargs):
+        # Позиции из буфера пользователя видны сразу, без записи в БД: они
+        # новее всех сохраненных и идут в начало первой страницы
+        queryset, buffered = watch_progress.buffered_history(request.user.pk, self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        first_page = (
+            not request.query_params.get(self.paginator.cursor_query_param)
+            and request.query_params.get('page', '1') == '1'
+        )
+        if first_page:
+            page = buffered + page
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
 
 class UserWatchLaterView(generics.ListAPIView):
@@ -313,39 +369,31 @@ class UserWatchLaterView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return WatchLater.objects.filter(user=self.request.user).select_related('movie')
+        return WatchLater.objects.filter(user=self.request.user).select_related('movie').prefetch_related('movie__genres').order_by('-created_at')
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_recommendations(request):
-    """Персональные рекомендации на основе истории просмотров и рейтингов"""
+    """Персональные рекомендации, рассчитанные командой build_recommendations"""
     user = request.user
+    limit = 20
     
-    # Получаем жанры из истории просмотров и высоких оценок
-    user_genres = Genre.objects.filter(
-        Q(movie__watchhistory__user=user) |
-        Q(movie__user_ratings__user=user, movie__user_ratings__rating__gte=7)
-    ).annotate(
-        weight=Count('movie__watchhistory') + Count('movie__user_ratings')
-    ).distinct().order_by('-weight')[:5]
+    recommended_movies = list(
+        Movie.objects.filter(
+            movierecommendation__user=user,
+            is_active=True
+        ).prefetch_related('genres').order_by('-movierecommendation__score')[:limit]
+    )
     
-    if not user_genres.exists():
-        # Если истории нет, показываем популярные фильмы
-        recommended_movies = Movie.objects.filter(
+    if len(recommended_movies) < limit:
+        # Холодный старт: дополняем популярными фильмами
+        recommended_movies += Movie.objects.filter(
             is_active=True,
             our_rating__gte=7.0
-        ).order_by('-our_rating', '-views_count')[:20]
-    else:
-        # Рекомендуем фильмы с похожими жанрами, исключая уже просмотренные
-        recommended_movies = Movie.objects.filter(
-            genres__in=user_genres,
-            is_active=True,
-            our_rating__gte=6.0
         ).exclude(
-            Q(watchhistory__user=user) |
-            Q(userfavorite__user=user)
-        ).distinct().order_by('-our_rating', '-views_count')[:20]
+            pk__in=[movie.pk for movie in recommended_movies]
+        ).prefetch_related('genres').order_by('-our_rating', '-views_count')[:limit - len(recommended_movies)]
     
     serializer = MovieListSerializer(recommended_movies, many=True, context={'request': request})
     return Response(serializer.data)
@@ -354,57 +402,83 @@ def user_recommendations(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_stats(request):
-    """Статистика пользователя"""
-    user = request.user
+    """Статистика пользователя (материализованная, см. movies.user_stats)"""
+    try:
+        stats = UserStats.objects.get(pk=request.user.pk)
+    except UserStats.DoesNotExist:
+        stats = rebuild_user_stats([request.user.pk])[request.user.pk]
     
-    # Подсчитываем статистику
-    total_watched = WatchHistory.objects.filter(user=user).count()
-    total_favorites = UserFavorite.objects.filter(user=user).count()
-    total_ratings = MovieRating.objects.filter(user=user).count()
-    avg_rating = MovieRating.objects.filter(user=user).aggregate(avg=Avg('rating'))['avg']
+    return Response(stats.as_dict(genre_names()))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def user_library(request):
+    """
+    Компактный снимок библиотеки (см. movies.library). Версия отдается в ETag:
+    при совпадении с If-None-Match ответ 304 без запросов к БД.
+    """
+    # Версию читаем до данных: изменение во время сборки снимка сменит ее,
+    # и клиент перезапросит снимок в следующий раз
+    version = library.get_version(request.user.pk)
+    client_etags = library.client_etags(request.headers.get('If-None-Match'))
+    if version is not None and f'"{version}"' in client_etags:
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': f'"{version}"'})
     
-    # Любимые жанры
-    favorite_genres = Genre.objects.filter(
-        movie__user_ratings__user=user,
-        movie__user_ratings__rating__gte=7
-    ).annotate(
-        count=Count('movie__user_ratings')
-    ).order_by('-count')[:5]
+    snapshot = library.build_snapshot(request.user.pk)
+    if version is None:
+        version = library.content_version(snapshot)
+        if f'"{version}"' in client_etags:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': f'"{version}"'})
     
-    # Время просмотра (приблизительно)
-    total_watch_time = WatchHistory.objects.filter(user=user).aggregate(
-        total_time=models.Sum('progress')
-    )['total_time'] or 0
+    return Response({'version': version, **snapshot}, headers={'ETag': f'"{version}"'})
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def sync_library(request):
+    """Пакет офлайн-операций с библиотекой (см. movies.library_sync)"""
+    operations, errors = library_sync.parse_operations(request.data.get('operations'))
+    if errors:
+        return Response({'error': 'Неверные операции', 'details': errors}, status=status.HTTP_400_BAD_REQUEST)
     
-    return Response({
-        'total_watched': total_watched,
-        'total_favorites': total_favorites,
-        'total_ratings': total_ratings,
-        'average_rating': round(avg_rating, 1) if avg_rating else 0,
-        'total_watch_time_minutes': total_watch_time // 60,
-        'favorite_genres': [{'name': g.name, 'count': g.count} for g in favorite_genres]
-    })
+    return Response(library_sync.apply_operations(request.user, operations))
 
 
-class MovieCollectionListView(generics.ListAPIView):
+class MovieCollectionListView(CachedListMixin, generics.ListAPIView):
     serializer_class = MovieCollectionSerializer
     queryset = MovieCollection.objects.filter(is_featured=True)
+    cache_prefix = 'collection-list'
+    
+    def get_cache_tags(self, items):
+        return {COLLECTION_LIST_TAG} | {f"collection:{item['id']}" for item in items}
 
 
 @api_view(['GET'])
 def movie_collection_detail(request, pk):
-    """Детали коллекции с фильмами"""
+    """
+    Детали коллекции с фильмами в порядке position. Фильмы отдаются
+    страницами по курсору (поле next), поэтому страница большой коллекции
+    читается по индексу (collection, position, id) за постоянное время.
+    """
     try:
         collection = MovieCollection.objects.get(pk=pk)
-        movies = collection.movies.filter(is_active=True)
-        
-        collection_data = MovieCollectionSerializer(collection).data
-        movies_data = MovieListSerializer(movies, many=True, context={'request': request}).data
-        
-        return Response({
-            'collection': collection_data,
-            'movies': movies_data
-        })
-        
     except MovieCollection.DoesNotExist:
-        return Response({'error': 'Коллекция не найдена'}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({'error': 'Коллекция не найдена'}, status=status.HTTP_404_NOT_FOUND)
+    
+    entries = CollectionMovie.objects.filter(
+        collection=collection, movie__is_active=True
+    ).select_related('movie').prefetch_related('movie__genres').order_by('position')
+    
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(entries, request)
+    movies_data = MovieListSerializer(
+        [entry.movie for entry in page], many=True, context={'request': request}
+    ).data
+    
+    paginated = paginator.get_paginated_response(movies_data).data
+    return Response({
+        'collection': MovieCollectionSerializer(collection).data,
+        'movies': paginated.pop('results'),
+        **paginated,
+    })
@@ -0,0 +1,424 @@
+"""
+Отложенная запись прогресса просмотра.
+
+Плеер присылает позицию постоянно, поэтому каждый пинг пишется в Redis
+(HSET, остается только последняя позиция по пользователю, фильму, сезону
+и эпизоду), а команда flush_watch_progress периодически переносит
+накопленное в WatchHistory и UserMovieStatus несколькими запросами на весь
+пакет. Статистика UserStats при этом обновляется той же пачкой: сигналы
+WatchHistory на массовую запись не срабатывают.
+
+Чтение видит позицию сразу: UserMovieState и история просмотров
+(buffered_history) накладывают буфер пользователя поверх БД, ничего не
+записывая.
+"""
+import functools
+import logging
+import operator
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DataError, IntegrityError, connection, transaction
+from django.db.models import Q
+
+from cinema import metrics
+from cinema.redis_client import get_async_redis, get_redis
+from . import library, stream_manifest
+from .models import Movie, UserMovieStatus, UserStats, WatchHistory
+from .user_stats import rebuild_user_stats
+
+
+logger = logging.getLogger('cinema')
+
+# {user}:{movie}:{season}:{episode} -> {progress}:{время пинга}
+PENDING_KEY = 'movies:progress:pending'
+PROCESSING_KEY = 'movies:progress:processing'
+PENDING_SINCE_KEY = 'movies:progress:pending_since'
+STATS_KEY = 'movies:progress:stats'
+# Позиции, которые не удалось записать: отложены для разбора, чтобы не
+# повторять из-за них весь пакет. Поле и значение как в PENDING_KEY
+REJECTED_KEY = 'movies:progress:rejected'
+REJECTED_TTL = 60 * 60 * 24 * 7
+# Буфер одного пользователя для чтения: {movie}:{season}:{episode} -> {progress}:{время пинга}
+USER_KEY = 'movies:progress:user:{user_id}'
+USER_BUFFER_TTL = 60 * 60 * 24
+# Доля длительности, после которой фильм считается просмотренным
+WATCHED_SHARE = 0.9
+# Ключ pg_advisory_xact_lock: пакеты применяются по одному, иначе параллельная
+# вставка записи фильма (season и episode NULL) создала бы дубликат
+APPLY_LOCK_ID = 0x7761746368
+# Границы столбцов integer и bigint в PostgreSQL
+MAX_INTEGER = 2 ** 31 - 1
+MAX_BIGINT = 2 ** 63 - 1
+
+# Удаляет из буфера пользователя поля, которые не изменились после сброса
+FORGET_FLUSHED = """
+for i = 1, #ARGV, 2 do
+    if redis.call('HGET', KEYS[1], ARGV[i]) == ARGV[i + 1] then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+"""
+
+
+def _field(*parts):
+    return ':'.join('' if part is None else str(part) for part in parts)
+
+
+def _optional_int(value):
+    return int(value) if value else None
+
+
+def is_valid_position(movie_id, progress, season=None, episode=None):
+    """Позиция помещается в WatchHistory: id фильма — bigint, остальное — неотрицательный integer"""
+    return 0 < movie_id <= MAX_BIGINT and all(
+        value is None or 0 <= value <= MAX_INTEGER for value in (progress, season, episode)
+    )
+
+
+def record_progress(user_id, movie_id, progress, season=None, episode=None):
+    """
+    Запоминает позицию в буфере. Возвращает True, если фильм заведомо
+    активен (для него собран манифест потоков), False — если это нужно
+    проверить в БД, None — если Redis недоступен и позиция не записана.
+    """
+    value = f'{progress}:{time.time()}'
+    user_key = USER_KEY.format(user_id=user_id)
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(PENDING_KEY, _field(user_id, movie_id, season, episode), value)
+        pipe.set(PENDING_SINCE_KEY, time.time(), nx=True)
+        pipe.hset(user_key, _field(movie_id, season, episode), value)
+        pipe.expire(user_key, USER_BUFFER_TTL)
+        library.bump_version(user_id, pipe=pipe)
+        pipe.exists(stream_manifest.MANIFEST_KEY.format(movie_id=movie_id))
+        return bool(pipe.execute()[-1])
+    except redis.RedisError as e:
+        logger.warning('Redis недоступен, прогресс записывается напрямую: %s', e)
+        return None
+
+
+def save_progress(user, movie, progress, season=None, episode=None):
+    """Синхронная запись одного пинга (когда Redis недоступен)"""
+    WatchHistory.objects.update_or_create(
+        user=user, movie=movie, season=season, episode=episode,
+        defaults={'progress': progress}
+    )
+    if progress > 0:
+        watched = movie.duration and progress >= movie.duration * 60 * WATCHED_SHARE
+        UserMovieStatus.objects.update_or_create(
+            user=user, movie=movie, defaults={'status': 'watched' if watched else 'watching'}
+        )
+
+
+def buffered_progress(user_id):
+    """Еще не сброшенные позиции пользователя: {(movie_id, season, episode): (progress, время)}"""
+    try:
+        raw = get_redis().hgetall(USER_KEY.format(user_id=user_id))
+    except redis.RedisError as e:
+        logger.warning('Буфер прогресса недоступен: %s', e)
+        return {}
+    return _parse_buffer(raw)
+
+
+async def abuffered_progress(user_id):
+    """buffered_progress через асинхронный клиент Redis"""
+    try:
+        raw = await get_async_redis().hgetall(USER_KEY.format(user_id=user_id))
+    except redis.RedisError as e:
+        logger.warning('Буфер прогресса недоступен: %s', e)
+        return {}
+    return _parse_buffer(raw)
+
+
+def _parse_buffer(raw):
+    buffered = {}
+    for field, value in raw.items():
+        movie_id, season, episode = field.decode().split(':')
+        progress, moment = _parse_value(value)
+        buffered[(int(movie_id), _optional_int(season), _optional_int(episode))] = (
+            progress, datetime.fromtimestamp(moment, tz=dt_timezone.utc)
+        )
+    return buffered
+
+
+def apply_progress(entries):
+    """
+    Переносит позиции [(user_id, movie_id, season, episode, progress, время пинга)]
+    в БД: обновляет или создает записи WatchHistory (более свежая позиция в БД
+    не перезаписывается), выставляет UserMovieStatus и сдвигает счетчики
+    UserStats. Позиции неактивных и несуществующих фильмов, а также удаленных
+    пользователей отбрасываются.
+    Возвращает число измененных записей истории.
+    """
+    if not entries:
+        return 0
+    columns = [list(column) for column in zip(*entries)]
+    history = WatchHistory._meta.db_table
+    statuses = UserMovieStatus._meta.db_table
+    movies = Movie._meta.db_table
+    users = get_user_model()._meta.db_table
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [APPLY_LOCK_ID])
+        cursor.execute(
+            f"""
+            WITH batch AS (
+                SELECT b.user_id, b.movie_id, b.season, b.episode, b.progress,
+                       to_timestamp(b.moment) AS watched_at
+                FROM unnest(%s::bigint[], %s::bigint[], %s::integer[], %s::integer[],
+                            %s::integer[], %s::double precision[])
+                     AS b(user_id, movie_id, season, episode, progress, moment)
+                JOIN {movies} m ON m.id = b.movie_id AND m.is_active
+                JOIN {users} u ON u.id = b.user_id
+            ),
+            existing AS (
+                SELECT w.id, w.progress AS old_progress, w.watched_at AS old_watched_at, b.*
+                FROM {history} w
+                JOIN batch b ON w.user_id = b.user_id AND w.movie_id = b.movie_id
+                    AND w.season IS NOT DISTINCT FROM b.season
+                    AND w.episode IS NOT DISTINCT FROM b.episode
+                FOR UPDATE OF w
+            ),
+            updated AS (
+                UPDATE {history} w SET progress = e.progress, watched_at = e.watched_at
+                FROM existing e
+                WHERE w.id = e.id AND e.old_watched_at < e.watched_at
+                RETURNING w.user_id, w.movie_id, w.progress, w.watched_at,
+                          e.progress - e.old_progress AS time_delta, 0 AS added
+            ),
+            inserted AS (
+                INSERT INTO {history} (user_id, movie_id, season, episode, progress, watched_at)
+                SELECT b.user_id, b.movie_id, b.season, b.episode, b.progress, b.watched_at
+                FROM batch b
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM existing e
+                    WHERE e.user_id = b.user_id AND e.movie_id = b.movie_id
+                        AND e.season IS NOT DISTINCT FROM b.season
+                        AND e.episode IS NOT DISTINCT FROM b.episode
+                )
+                RETURNING user_id, movie_id, progress, watched_at,
+                          progress AS time_delta, 1 AS added
+            ),
+            applied AS (
+                SELECT a.*, m.duration
+                FROM (SELECT * FROM updated UNION ALL SELECT * FROM inserted) a
+                JOIN {movies} m ON m.id = a.movie_id
+            ),
+            status AS (
+                INSERT INTO {statuses} (user_id, movie_id, status, created_at, updated_at)
+                SELECT DISTINCT ON (user_id, movie_id) user_id, movie_id,
+                       CASE WHEN duration > 0 AND progress >= duration * 60 * %s
+                            THEN 'watched' ELSE 'watching' END,
+                       now(), now()
+                FROM applied
+                WHERE progress > 0
+                ORDER BY user_id, movie_id, watched_at DESC
+                ON CONFLICT (user_id, movie_id)
+                DO UPDATE SET status = EXCLUDED.status, updated_at = EXCLUDED.updated_at
+            )
+            SELECT user_id, SUM(added), SUM(time_delta), COUNT(*) FROM applied GROUP BY user_id
+            """,
+            [*columns, WATCHED_SHARE],
+        )
+        deltas = cursor.fetchall()
+        if not deltas:
+            return 0
+
+        user_ids = [row[0] for row in deltas]
+        cursor.execute(
+            f"""
+            UPDATE {UserStats._meta.db_table} s SET
+                watched_count = s.watched_count + d.added,
+                watch_time = s.watch_time + d.time_delta,
+                updated_at = now()
+            FROM unnest(%s::bigint[], %s::integer[], %s::bigint[]) AS d(user_id, added, time_delta)
+            WHERE s.user_id = d.user_id
+            RETURNING s.user_id
+            """,
+            [user_ids, [int(row[1]) for row in deltas], [int(row[2]) for row in deltas]],
+        )
+        # Статистики еще нет — строится с нуля, текущие записи уже учтены
+        missing = set(user_ids) - {row[0] for row in cursor.fetchall()}
+        if missing:
+            rebuild_user_stats(sorted(missing))
+        return sum(row[3] for row in deltas)
+
+
+def _parse_value(value):
+    progress, moment = value.decode().split(':')
+    return int(progress), float(moment)
+
+
+def _parse_pending(raw):
+    """
+    {поле PENDING_KEY: значение} -> (записи для apply_progress,
+    {user_id: [поле буфера пользователя, значение, ...]},
+    {поле: значение} для нечитаемых и не помещающихся в БД позиций)
+    """
+    entries, by_user, rejected = [], {}, {}
+    for field, value in raw.items():
+        user_id, _, user_field = field.decode().partition(':')
+        try:
+            movie_id, season, episode = user_field.split(':')
+            entry = (int(user_id), int(movie_id), _optional_int(season), _optional_int(episode), *_parse_value(value))
+        except ValueError:
+            entry = None
+        if entry and 0 < entry[0] <= MAX_BIGINT and is_valid_position(entry[1], entry[4], entry[2], entry[3]):
+            entries.append(entry)
+        else:
+            rejected[field] = value
+        if user_id.isdigit():
+            # Отклоненные позиции тоже убираются из буфера пользователя
+            by_user.setdefault(int(user_id), []).extend([user_field, value])
+    return entries, by_user, rejected
+
+
+def _apply_or_reject(entries):
+    """
+    apply_progress для пакета. Если пакет целиком не записывается, позиции
+    применяются по одной; те, что отвергла БД, возвращаются как
+    {поле: значение} вместо того, чтобы вечно повторять весь пакет.
+    """
+    try:
+        with transaction.atomic():
+            return apply_progress(entries), {}
+    except (DataError, IntegrityError) as e:
+        logger.warning('Пакет прогресса не записан, позиции применяются по одной: %s', e)
+
+    updated, rejected = 0, {}
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                updated += apply_progress([entry])
+        except (DataError, IntegrityError):
+            user_id, movie_id, season, episode, progress, moment = entry
+            rejected[_field(user_id, movie_id, season, episode).encode()] = f'{progress}:{moment}'.encode()
+    return updated, rejected
+
+
+def _set_aside(client, rejected):
+    """Откладывает непригодные позиции в REJECTED_KEY"""
+    logger.warning('Отложено позиций прогресса, которые нельзя записать: %s', len(rejected))
+    pipe = client.pipeline()
+    pipe.hset(REJECTED_KEY, mapping=rejected)
+    pipe.expire(REJECTED_KEY, REJECTED_TTL)
+    pipe.execute()
+
+
+def _forget_flushed(client, by_user):
+    """Убирает сброшенные позиции из буферов пользователей, если новых пингов не было"""
+    forget = client.register_script(FORGET_FLUSHED)
+    pipe = client.pipeline(transaction=False)
+    for user_id, args in by_user.items():
+        forget(keys=[USER_KEY.format(user_id=user_id)], args=args, client=pipe)
+    pipe.execute()
+
+
+def buffered_history(user_id, queryset):
+    """
+    Буфер пользователя поверх истории просмотров queryset: (queryset без
+    записей, которые буфер перекрывает, [записи из буфера, новые сверху]).
+    Запись, которой еще нет в БД, — несохраненная WatchHistory с id None.
+    Позиции неактивных фильмов, как и при сбросе, пропускаются.
+    """
+    buffered = buffered_progress(user_id)
+    if not buffered:
+        return queryset, []
+
+    movies = Movie.objects.filter(pk__in={movie_id for movie_id, _, _ in buffered}, is_active=True)
+    movies = {movie.pk: movie for movie in movies.prefetch_related('genres')}
+    existing = {
+        (row.movie_id, row.season, row.episode): row
+        for row in queryset.filter(movie_id__in=list(movies))
+    }
+    rows = []
+    for (movie_id, season, episode), (progress, watched_at) in buffered.items():
+        if movie_id not in movies:
+            continue
+        row = existing.get((movie_id, season, episode))
+        if row is None:
+            row = WatchHistory(user_id=user_id, movie=movies[movie_id], season=season, episode=episode)
+        elif row.watched_at >= watched_at:
+            continue
+        row.progress, row.watched_at = progress, watched_at
+        rows.append(row)
+    if not rows:
+        return queryset, []
+
+    covered = functools.reduce(operator.or_, (
+        Q(movie_id=row.movie_id, season=row.season, episode=row.episode) for row in rows
+    ))
+    rows.sort(key=lambda row: row.watched_at, reverse=True)
+    return queryset.exclude(covered), rows
+
+
+def flush_watch_progress():
+    """Переносит накопленные позиции в БД. Возвращает число обновленных записей истории."""
+    client = get_redis()
+    started_at = time.time()
+
+    # Забираем накопленное атомарно; незавершенный прошлый сброс доделываем первым
+    pending_since = client.get(PENDING_SINCE_KEY)
+    if not client.exists(PROCESSING_KEY):
+        pipe = client.pipeline()
+        pipe.exists(PENDING_KEY)
+        pipe.delete(PENDING_SINCE_KEY)
+        has_pending, _ = pipe.execute()
+        if has_pending:
+            client.rename(PENDING_KEY, PROCESSING_KEY)
+
+    entries, by_user, rejected = _parse_pending(client.hgetall(PROCESSING_KEY))
+    updated = 0
+    if entries or rejected:
+        with transaction.atomic():
+            updated, not_applied = _apply_or_reject(entries)
+            rejected.update(not_applied)
+
+            def forget():
+                # Пакет уже в БД: если Redis недоступен, следующий сброс
+                # повторит его, а более старые позиции ничего не перезапишут
+                try:
+                    if rejected:
+                        _set_aside(client, rejected)
+                    client.delete(PROCESSING_KEY)
+                    _forget_flushed(client, by_user)
+                except redis.RedisError as e:
+                    logger.warning('Не удалось убрать сброшенный прогресс из Redis: %s', e)
+            transaction.on_commit(forget)
+
+    finished_at = time.time()
+    stats = client.hgetall(STATS_KEY)
+    previous_flush = float(stats.get(b'last_flush_at', 0))
+
+    client.hset(STATS_KEY, mapping={
+        'last_flush_at': finished_at,
+        'last_flush_interval': finished_at - previous_flush if previous_flush else 0,
+        'last_flush_duration': finished_at - started_at,
+        'last_flush_lag': finished_at - float(pending_since) if pending_since else 0,
+        'last_flush_heartbeats': len(entries),
+        'last_flush_updated': updated,
+        'last_flush_rejected': len(rejected),
+    })
+    return updated
+
+
+@metrics.register('watch_progress')
+def watch_progress_metrics():
+    client = get_redis()
+    stats = {
+        key.decode(): float(value)
+        for key, value in client.hgetall(STATS_KEY).items()
+    }
+    pending_since = client.get(PENDING_SINCE_KEY)
+
+    return {
+        'flush_interval_setting': settings.WATCH_PROGRESS_FLUSH_INTERVAL,
+        'pending_heartbeats': client.hlen(PENDING_KEY),
+        'rejected_heartbeats': client.hlen(REJECTED_KEY),
+        'current_lag': time.time() - float(pending_since) if pending_since else 0,
+        **stats,
+    }
@@ -1,16 +1,34 @@
 import hashlib
 import hmac
 import json
-from urllib.parse import unquote
-from django.contrib.auth.models import User
+import time
+from functools import lru_cache
+from urllib.parse import parse_qsl
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.utils import timezone
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 
+from . import cache
+
+User = get_user_model()
+
+
+@lru_cache(maxsize=4)
+def get_secret_key(bot_token):
+    """Ключ проверки подписи: HMAC-SHA256 токена бота с ключом "WebAppData" (один раз на процесс)"""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
 
 class TelegramAuthentication(BaseAuthentication):
     """
-    Аутентификация через Telegram Web App initData
+    Аутентификация через Telegram Web App initData.
+    Проверенные initData кэшируются (см. telegram_auth.cache), поэтому
+    повторные запросы с теми же данными не проверяют подпись и не ходят в БД.
     """
     
     def authenticate(self, request):
@@ -18,87 +36,129 @@ class TelegramAuthentication(BaseAuthentication):
         if not init_data:
             return None
         
+        user = cache.get_user(init_data)
+        if user is not None:
+            return (user, None)
+        
         try:
-            user_data = self.validate_telegram_data(init_data)
+            user_id, expires_at = cache.get_user_id(init_data)
+            if user_id is not None:
+                user = User.objects.filter(pk=user_id).first()
+                if user is not None:
+                    cache.remember(init_data, user, expires_at, shared=False)
+                    return (user, None)
+            
+            user_data, auth_date = self.validate_telegram_data(init_data)
             user = self.get_or_create_user(user_data)
+            cache.remember(init_data, user, auth_date + settings.TELEGRAM_AUTH_MAX_AGE)
             return (user, None)
+        except AuthenticationFailed:
+            raise
         except Exception as e:
             raise AuthenticationFailed(f'Ошибка аутентификации Telegram: {str(e)}')
     
-    def validate_telegram_data(self, init_data):
+    async def aauthenticate(self, request):
         """
-        Валидация данных от Telegram Web App
+        authenticate() для асинхронных представлений: кэш в памяти и Redis
+        читается без потока, первая проверка подписи и создание пользователя
+        идут синхронным путем.
         """
-        if not settings.TELEGRAM_BOT_TOKEN:
-            raise AuthenticationFailed('Telegram Bot Token не настроен')
-        
-        # Парсим данные
-        data_pairs = []
-        user_data = None
+        init_data = request.META.get('HTTP_X_TELEGRAM_INIT_DATA')
+        if not init_data:
+            return None
         
-        for item in init_data.split('&'):
-            key, value = item.split('=', 1)
-            if key == 'user':
-                user_data = json.loads(unquote(value))
-            elif key != 'hash':
-                data_pairs.append(f"{key}={value}")
+        user = cache.get_user(init_data)
+        if user is not None:
+            return (user, None)
         
-        if not user_data:
-            raise AuthenticationFailed('Данные пользователя не найдены')
+        try:
+            user_id, expires_at = await cache.aget_user_id(init_data)
+            if user_id is not None:
+                user = await User.objects.filter(pk=user_id).afirst()
+                if user is not None:
+                    cache.remember(init_data, user, expires_at, shared=False)
+                    return (user, None)
+        except Exception as e:
+            raise AuthenticationFailed(f'Ошибка аутентификации Telegram: {str(e)}')
         
-        # Проверяем подпись
-        data_pairs.sort()
-        data_check_string = '\n'.join(data_pairs)
+        return await sync_to_async(self.authenticate)(request)
+    
+    def validate_telegram_data(self, init_data):
+        """
+        Валидация данных от Telegram Web App. Возвращает (данные пользователя, auth_date).
+        """
+        if not settings.TELEGRAM_BOT_TOKEN:
+            raise AuthenticationFailed('Telegram Bot Token не настроен')
         
-        secret_key = hmac.new(
-            settings.TELEGRAM_BOT_TOKEN.encode(),
-            b"WebAppData",
-            hashlib.sha256
-        ).digest()
+        # Строка проверки: все поля, кроме hash, в виде key=<value> (значения
+        # декодированы), отсортированные по ключу и разделенные переводом строки
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        received_hash = fields.pop('hash', None)
+        if not received_hash:
+            raise AuthenticationFailed('Неверная подпись данных')
         
+        data_check_string = '\n'.join(f'{key}={fields[key]}' for key in sorted(fields))
         calculated_hash = hmac.new(
-            secret_key,
+            get_secret_key(settings.TELEGRAM_BOT_TOKEN),
             data_check_string.encode(),
             hashlib.sha256
         ).hexdigest()
         
-        # Извлекаем hash из исходных данных
-        received_hash = None
-        for item in init_data.split('&'):
-            if item.startswith('hash='):
-                received_hash = item.split('=', 1)[1]
-                break
-        
-        if not received_hash or calculated_hash != received_hash:
+        if not hmac.compare_digest(calculated_hash, received_hash):
             raise AuthenticationFailed('Неверная подпись данных')
         
-        return user_data
+        try:
+            auth_date = int(fields['auth_date'])
+        except (KeyError, ValueError):
+            raise AuthenticationFailed('Не указана дата авторизации')
+        if auth_date + settings.TELEGRAM_AUTH_MAX_AGE < time.time():
+            raise AuthenticationFailed('Данные авторизации устарели')
+        
+        if 'user' not in fields:
+            raise AuthenticationFailed('Данные пользователя не найдены')
+        
+        return json.loads(fields['user']), auth_date
     
     def get_or_create_user(self, user_data):
         """
-        Создание или получение пользователя на основе Telegram данных
+        Пользователь по индексированному telegram_id: одна строка users.User
+        с профилем Telegram. При первом входе — создание; параллельный первый
+        вход с теми же данными не создает дубликатов. Изменившийся профиль
+        (имя, username, Premium) обновляется одним UPDATE.
         """
-        telegram_id = user_data['id']
+        telegram_id = int(user_data['id'])
+        profile = self.profile_fields(user_data)
         
-        try:
-            # Ищем пользователя по Telegram ID
-            user = User.objects.get(username=f"tg_{telegram_id}")
-        except User.DoesNotExist:
-            # Создаем нового пользователя
-            user = User.objects.create_user(
-                username=f"tg_{telegram_id}",
-                first_name=user_data.get('first_name', ''),
-                last_name=user_data.get('last_name', ''),
-            )
-            
-            # Сохраняем дополнительные данные Telegram
-            from .models import TelegramUser
-            TelegramUser.objects.create(
-                user=user,
-                telegram_id=telegram_id,
-                username=user_data.get('username', ''),
-                language_code=user_data.get('language_code', 'ru'),
-                is_premium=user_data.get('is_premium', False),
-            )
+        user = User.objects.filter(telegram_id=telegram_id).first()
+        if user is None:
+            try:
+                with transaction.atomic():
+                    return User.objects.create_user(
+                        username=f"tg_{telegram_id}",
+                        telegram_id=telegram_id,
+                        first_name=profile['telegram_first_name'],
+                        last_name=profile['telegram_last_name'],
+                        **profile
+                    )
+            except IntegrityError:
+                # Другой запрос успел создать пользователя первым
+                user = User.objects.get(telegram_id=telegram_id)
         
-        return user
\ No newline at end of file
+        changed = {field: value for field, value in profile.items() if getattr(user, field) != value}
+        if changed:
+            User.objects.filter(pk=user.pk).update(updated_at=timezone.now(), **changed)
+            for field, value in changed.items():
+                setattr(user, field, value)
+        return user
+    
+    @staticmethod
+    def profile_fields(user_data):
+        """Поля профиля Telegram в users.User"""
+        return {
+            'telegram_username': user_data.get('username', ''),
+            'telegram_first_name': user_data.get('first_name', ''),
+            'telegram_last_name': user_data.get('last_name', ''),
+            'telegram_photo_url': user_data.get('photo_url') or None,
+            'telegram_is_premium': bool(user_data.get('is_premium', False)),
+            'language_code': user_data.get('language_code') or 'ru',
+        }
@@ -0,0 +1,119 @@
+"""
+Кэш проверенных initData.
+
+Уровень 1 — ограниченный LRU в памяти процесса: initData -> (пользователь,
+срок). Уровень 2 — Redis, общий для всех воркеров: отпечаток initData ->
+id пользователя. Запись живет не дольше, чем initData остается действительным
+(auth_date + TELEGRAM_AUTH_MAX_AGE), так что кэш не продлевает срок подписи.
+"""
+import copy
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.conf import settings
+
+from cinema.redis_client import get_async_redis, get_redis
+
+
+logger = logging.getLogger('cinema')
+
+REDIS_KEY = 'tg-auth:{digest}'
+# Объект пользователя в памяти процесса обновляется не реже этого интервала (сек)
+USER_REFRESH_INTERVAL = 60
+
+
+class LRUCache:
+    """Потокобезопасный LRU с ограничением числа записей и сроком жизни каждой"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+local_cache = LRUCache(settings.TELEGRAM_AUTH_CACHE_SIZE)
+
+
+def digest(init_data):
+    return hashlib.sha256(init_data.encode()).hexdigest()
+
+
+def get_user(init_data):
+    """Пользователь из памяти процесса (копия, чтобы запросы не делили объект)"""
+    user = local_cache.get(init_data)
+    return copy.copy(user) if user is not None else None
+
+
+def _stored_user_id(value, ttl):
+    if value is None or ttl <= 0:
+        return None, None
+    return int(value), time.time() + ttl
+
+
+def get_user_id(init_data):
+    """(id пользователя, срок действия) из Redis или (None, None)"""
+    try:
+        pipe = get_redis().pipeline()
+        key = REDIS_KEY.format(digest=digest(init_data))
+        pipe.get(key)
+        pipe.ttl(key)
+        value, ttl = pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Кэш авторизации недоступен: %s', e)
+        return None, None
+    return _stored_user_id(value, ttl)
+
+
+async def aget_user_id(init_data):
+    """get_user_id через асинхронный клиент Redis"""
+    try:
+        pipe = get_async_redis().pipeline()
+        key = REDIS_KEY.format(digest=digest(init_data))
+        pipe.get(key)
+        pipe.ttl(key)
+        value, ttl = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning('Кэш авторизации недоступен: %s', e)
+        return None, None
+    return _stored_user_id(value, ttl)
+
+
+def remember(init_data, user, expires_at, shared=True):
+    """Запоминает проверенный initData до expires_at (unix time)"""
+    now = time.time()
+    if expires_at <= now:
+        return
+    local_cache.set(init_data, user, min(expires_at, now + USER_REFRESH_INTERVAL))
+    if not shared:
+        return
+    try:
+        get_redis().set(REDIS_KEY.format(digest=digest(init_data)), user.pk, ex=max(1, int(expires_at - now)))
+    except redis.RedisError as e:
+        logger.warning('Не удалось сохранить авторизацию в кэш: %s', e)
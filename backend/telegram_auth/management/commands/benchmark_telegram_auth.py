@@ -0,0 +1,87 @@
+import hashlib
+import hmac
+import json
+import statistics
+import time
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.test import APIRequestFactory
+
+from cinema.redis_client import get_redis
+from telegram_auth import cache
+from telegram_auth.authentication import TelegramAuthentication, get_secret_key
+
+
+def sign_init_data(fields, bot_token):
+    """initData в том виде, в каком его присылает Telegram"""
+    data_check_string = '\n'.join(f'{key}={fields[key]}' for key in sorted(fields))
+    fields = dict(fields, hash=hmac.new(
+        get_secret_key(bot_token), data_check_string.encode(), hashlib.sha256
+    ).hexdigest())
+    return urlencode(fields)
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет накладные расходы аутентификации Telegram на запрос: полная '
+        'проверка подписи, попадание в кэш Redis и в кэш процесса. Данные откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        token = settings.TELEGRAM_BOT_TOKEN or '123456:benchmark-token'
+        with override_settings(TELEGRAM_BOT_TOKEN=token), transaction.atomic():
+            auth = TelegramAuthentication()
+            factory = APIRequestFactory()
+            count = options['requests']
+            now = int(time.time())
+
+            def make_init_data(i):
+                user = json.dumps({'id': 700000000 + i % 50, 'first_name': 'Bench', 'username': f'bench{i % 50}'})
+                return sign_init_data({'query_id': f'bench{i}', 'user': user, 'auth_date': str(now)}, token)
+
+            # Первый вход создает пользователей; в замеры не входит
+            for i in range(50):
+                auth.authenticate(factory.get('/', HTTP_X_TELEGRAM_INIT_DATA=make_init_data(i)))
+
+            requests = [factory.get('/', HTTP_X_TELEGRAM_INIT_DATA=make_init_data(i)) for i in range(50, 50 + count)]
+
+            def measure(prepare=None):
+                timings = []
+                with CaptureQueriesContext(connection) as queries:
+                    for request in requests:
+                        if prepare:
+                            prepare()
+                        started = time.perf_counter()
+                        auth.authenticate(request)
+                        timings.append((time.perf_counter() - started) * 1e6)
+                return timings, len(queries) / len(requests)
+
+            results = [
+                ('Полная проверка подписи', *measure(cache.local_cache.clear)),
+                ('Кэш Redis', *measure(cache.local_cache.clear)),
+            ]
+            # Прогрев: предыдущий замер очищал кэш процесса перед каждым запросом
+            for request in requests:
+                auth.authenticate(request)
+            results.append(('Кэш процесса', *measure()))
+
+            for title, timings, queries in results:
+                timings.sort()
+                self.stdout.write(
+                    f'{title}: p50 {statistics.median(timings):.0f} мкс  '
+                    f'p99 {timings[int(len(timings) * 0.99) - 1]:.0f} мкс  запросов к БД: {queries:.1f}'
+                )
+
+            get_redis().delete(*[
+                cache.REDIS_KEY.format(digest=cache.digest(request.META['HTTP_X_TELEGRAM_INIT_DATA']))
+                for request in requests
+            ])
+            cache.local_cache.clear()
+            transaction.set_rollback(True)
@@ -0,0 +1,174 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+LEGACY_USERS = 'auth_user'
+LEGACY_PROFILES = 'telegram_auth_telegramuser'
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит пользователей из auth_user и профили TelegramUser в users.User '
+        '(по telegram_id, иначе по username) и переводит ссылки на пользователей '
+        'во всех таблицах на новые id. Запускать после "migrate users" и до общего '
+        '"migrate": тот удаляет таблицу TelegramUser. Повторный запуск ничего не меняет.'
+    )
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Показать, что будет сделано, и откатить изменения'
+        )
+
+    def handle(self, *args, **options):
+        user_model = get_user_model()
+        users_table = user_model._meta.db_table
+        tables = connection.introspection.table_names()
+
+        if LEGACY_USERS == users_table or LEGACY_USERS not in tables:
+            self.stdout.write('Старых пользователей нет — объединять нечего')
+            return
+        if users_table not in tables:
+            raise CommandError('Таблицы users.User нет: сначала выполните "python manage.py migrate users"')
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Отложенные проверки внешних ключей не дали бы менять таблицы после UPDATE
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            merged, created = self.build_identity_map(cursor, users_table, LEGACY_PROFILES in tables)
+            self.stdout.write(f'Старых пользователей: {merged + created} (найдено {merged}, создано {created})')
+
+            for table, column in self.user_references(user_model):
+                moved = self.move_references(cursor, table, column, users_table)
+                if moved is not None:
+                    self.stdout.write(f'{table}.{column}: перенесено строк {moved}')
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+                self.stdout.write(self.style.WARNING('Пробный запуск: изменения откачены'))
+                return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово. После проверки таблицы {LEGACY_USERS} и {LEGACY_PROFILES} можно удалить'
+        ))
+
+    def build_identity_map(self, cursor, users_table, has_profiles):
+        """
+        Временная таблица legacy_identity: старый id -> id в users.User.
+        Недостающих пользователей создает. Возвращает (найдено, создано).
+        """
+        users = connection.ops.quote_name(users_table)
+        profiles = (
+            f'LEFT JOIN {LEGACY_PROFILES} t ON t.user_id = a.id' if has_profiles else
+            'LEFT JOIN (SELECT NULL::integer AS user_id, NULL::bigint AS telegram_id, NULL::varchar AS username, '
+            'NULL::varchar AS language_code, NULL::boolean AS is_premium, NULL::timestamptz AS created_at) t ON false'
+        )
+        cursor.execute(f"""
+            CREATE TEMP TABLE legacy_identity ON COMMIT DROP AS
+            SELECT a.id AS old_id, a.password, a.last_login, a.is_superuser, a.username, a.first_name,
+                   a.last_name, a.email, a.is_staff, a.is_active, a.date_joined,
+                   t.telegram_id, t.username AS telegram_username, t.language_code, t.is_premium,
+                   t.created_at, NULL::bigint AS new_id, false AS created
+            FROM {LEGACY_USERS} a {profiles}
+        """)
+
+        # Тот же Telegram-аккаунт, затем тот же username без конфликта telegram_id
+        cursor.execute(f"""
+            UPDATE legacy_identity l SET new_id = u.id FROM {users} u WHERE u.telegram_id = l.telegram_id
+        """)
+        cursor.execute(f"""
+            UPDATE legacy_identity l SET new_id = u.id FROM {users} u
+            WHERE l.new_id IS NULL AND u.username = l.username
+              AND (u.telegram_id IS NULL OR l.telegram_id IS NULL)
+        """)
+
+        cursor.execute("""
+            SELECT new_id, array_agg(old_id ORDER BY old_id) FROM legacy_identity
+            WHERE new_id IS NOT NULL GROUP BY new_id HAVING count(*) > 1
+        """)
+        conflicts = cursor.fetchall()
+        if conflicts:
+            details = ', '.join(f'{new_id} <- {old_ids}' for new_id, old_ids in conflicts[:20])
+            raise CommandError(f'Несколько старых пользователей совпали с одним: {details}')
+
+        # Недостающим пользователям id выдается заранее из последовательности users.User
+        cursor.execute(f"""
+            UPDATE legacy_identity SET new_id = nextval(pg_get_serial_sequence('{users_table}', 'id')), created = true
+            WHERE new_id IS NULL
+        """)
+        cursor.execute(f"""
+            INSERT INTO {users} (
+                id, password, last_login, is_superuser, username, first_name, last_name, email,
+                is_staff, is_active, date_joined, telegram_id, telegram_username, telegram_first_name,
+                telegram_last_name, telegram_is_premium, language_code, preferred_quality, auto_play,
+                notifications_enabled, created_at, updated_at
+            )
+            SELECT l.new_id, l.password, l.last_login, l.is_superuser,
+                   CASE WHEN EXISTS (SELECT 1 FROM {users} u WHERE u.username = l.username)
+                        THEN l.username || '_' || l.old_id ELSE l.username END,
+                   l.first_name, l.last_name, l.email, l.is_staff, l.is_active, l.date_joined,
+                   l.telegram_id, l.telegram_username, l.first_name, l.last_name,
+                   COALESCE(l.is_premium, false), COALESCE(l.language_code, 'ru'), '720p', true, true,
+                   COALESCE(l.created_at, l.date_joined), now()
+            FROM legacy_identity l WHERE l.created
+        """)
+        created = cursor.rowcount
+
+        # Найденным пользователям дополняем профиль Telegram и права
+        cursor.execute(f"""
+            UPDATE {users} u SET
+                telegram_id = COALESCE(u.telegram_id, l.telegram_id),
+                telegram_username = COALESCE(NULLIF(u.telegram_username, ''), l.telegram_username),
+                telegram_is_premium = u.telegram_is_premium OR COALESCE(l.is_premium, false),
+                is_staff = u.is_staff OR l.is_staff,
+                is_superuser = u.is_superuser OR l.is_superuser,
+                updated_at = now()
+            FROM legacy_identity l WHERE u.id = l.new_id AND NOT l.created
+        """)
+        merged = cursor.rowcount
+        return merged, created
+
+    @staticmethod
+    def user_references(user_model):
+        """(таблица, колонка) всех внешних ключей моделей на пользователя"""
+        references = []
+        for model in apps.get_models():
+            if not model._meta.managed or model._meta.proxy:
+                continue
+            for field in model._meta.concrete_fields:
+                if field.is_relation and field.related_model is user_model:
+                    references.append((model._meta.db_table, field.column))
+        return references
+
+    @staticmethod
+    def move_references(cursor, table, column, users_table):
+        """
+        Переводит колонку со старых id на новые и меняет внешний ключ на
+        users.User. None — если колонка уже ссылается не на auth_user.
+        """
+        quote = connection.ops.quote_name
+        legacy_keys = [
+            name for name, constraint in connection.introspection.get_constraints(cursor, table).items()
+            if constraint['foreign_key'] == (LEGACY_USERS, 'id') and constraint['columns'] == [column]
+        ]
+        if not legacy_keys:
+            return None
+
+        for name in legacy_keys:
+            cursor.execute(f'ALTER TABLE {quote(table)} DROP CONSTRAINT {quote(name)}')
+
+        # Через отрицательные значения: старые и новые id пересекаются, а
+        # уникальные ограничения PostgreSQL проверяет после каждой строки
+        cursor.execute(f"""
+            UPDATE {quote(table)} t SET {quote(column)} = -l.new_id
+            FROM legacy_identity l WHERE t.{quote(column)} = l.old_id
+        """)
+        moved = cursor.rowcount
+        cursor.execute(f'UPDATE {quote(table)} SET {quote(column)} = -{quote(column)} WHERE {quote(column)} < 0')
+
+        cursor.execute(
+            f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(f"{table}_{column}_fk_{users_table}"[:63])} '
+            f'FOREIGN KEY ({quote(column)}) REFERENCES {quote(users_table)} (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+        return moved
@@ -12,7 +12,7 @@ class UserAdmin(BaseUserAdmin):
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Telegram Info', {
             'fields': ('telegram_id', 'telegram_username', 'telegram_first_name', 
-                      'telegram_last_name', 'telegram_photo_url', 'telegram_is_premium')
+                      'telegram_last_name', 'telegram_photo_url', 'telegram_is_premium', 'language_code')
         }),
         ('Preferences', {
             'fields': ('preferred_quality', 'auto_play', 'notifications_enabled')
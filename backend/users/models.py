@@ -11,6 +11,7 @@ class User(AbstractUser):
     telegram_last_name = models.CharField(max_length=255, null=True, blank=True)
     telegram_photo_url = models.URLField(null=True, blank=True)
     telegram_is_premium = models.BooleanField(default=False)
+    language_code = models.CharField(max_length=10, default='ru')
     
     # Пользовательские настройки
     preferred_quality = models.CharField(
@@ -52,6 +52,14 @@ export const api = {
     return response
   },
 
+  // Подсказки при наборе запроса
+  suggestMovies: async (query, limit = 10) => {
+    const response = await apiClient.get('/movies/suggest/', {
+      params: { q: query, limit }
+    })
+    return response
+  },
+
   // Получение ссылок для просмотра
   getMovieStreams: async (id) => {
     const response = await apiClient.get(`/movies/${id}/streams/`)